@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# runs the collector's update cycle against tools.fake_twitter, in a scratch copy of ./db, and reports
+# wall time, bytes written and peak memory per phase, then tweets/sec and allocations of process_tweets.
+# nothing goes to twitter.
+#
+#   python benchmark.py --cycles 20
+#   python benchmark.py --cycles 5 --latency 0.2 --rate-limited
+#   DB_STORAGE_MODE=sqlite python benchmark.py --recording recorded_responses.json --json
+#
+# the db starts out empty unless --seed-db points at a folder of existing dbs.
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_FILES = ['daily_database.json', 'daily_trend_search_database.json', 'daily_top_rt_database.json']
+
+
+def io_written():
+    # bytes handed to write() by this process so far, None where /proc is not available
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('wchar:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def max_rss_mb():
+    # ru_maxrss is in KB on linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def restart_tracemalloc():
+    # tracemalloc.reset_peak() is 3.9+, restarting the trace is how a phase gets a peak of its own on 3.6
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+    tracemalloc.start()
+
+
+def folder_bytes(folder):
+    total = 0
+    for root, dirs, files in os.walk(folder):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def setup_workdir(workdir, seed_db=None):
+    db_folder = os.path.join(workdir, 'db')
+    os.makedirs(db_folder, exist_ok=True)
+    if seed_db:
+        for name in DB_FILES:
+            shutil.copy(os.path.join(seed_db, name), os.path.join(db_folder, name))
+        return
+
+    empty = {
+        "daily_database.json": {
+            "trends": {
+                "include_hashtags": {"timestamp": '1999-01-01 00:00:00+0000', "initial_timestamp": '1999-01-01 00:00:00+0000', "content": []},
+                "exclude_hashtags": {"timestamp": '1999-01-01 00:00:00+0000', "initial_timestamp": '1999-01-01 00:00:00+0000', "content": []}
+            },
+            "hashtags": {"timestamp": '1999-01-01 00:00:00+0000', "initial_timestamp": '1999-01-01 00:00:00+0000', "content": []}
+        },
+        "daily_trend_search_database.json": {"trends": []},
+        "daily_top_rt_database.json": {"top_posts": []},
+    }
+    for name, db in empty.items():
+        with open(os.path.join(db_folder, name), 'w') as f:
+            json.dump(db, f)
+
+
+def bench_process_tweets(twitter_api, fake, n, repeat=3):
+    """
+    tweets/sec and allocations of process_tweets (dicts) and iter_tweet_records (compact records),
+    over n search results shaped like get_search_tweets returns them
+    """
+    # what get_search_tweet_images_raw keeps of a status (AsDict moves the entities up a level)
+    fields = ['text', 'retweet_count', 'favorite_count', 'retweeted_status', 'id', 'created_at']
+    statuses = fake.GetSearch(term='benchmark', count=min(n, 1000), return_json=True)['statuses']
+    tweets = []
+    for i in range(n):
+        status = statuses[i % len(statuses)]
+        tweet = {k: status.get(k, {}) for k in fields}
+        tweet['media'] = status['entities'].get('media') or {}
+        tweet['hashtags'] = status['entities'].get('hashtags') or {}
+        tweets.append(tweet)
+
+    results = {}
+    for name, process in (('process_tweets', lambda: twitter_api.process_tweets(tweets)),
+                          ('iter_tweet_records', lambda: list(twitter_api.iter_tweet_records(tweets)))):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            kept = process()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        del kept
+
+        tracing = tracemalloc.is_tracing()
+        restart_tracemalloc()
+        before = tracemalloc.get_traced_memory()[0]
+        kept = process()
+        current, peak = tracemalloc.get_traced_memory()
+        if not tracing:
+            tracemalloc.stop()
+
+        results[name] = {
+            "tweets": n,
+            "kept": len(kept),
+            "tweets_per_sec": n / best if best else None,
+            "alloc_peak_bytes": peak - before,
+            "alloc_retained_bytes": current - before,
+        }
+        del kept
+    return results
+
+
+def run(args):
+    # everything below uses paths relative to the working directory, so move there before importing it
+    sys.path.insert(0, APP_DIR)
+    os.chdir(args.workdir)
+
+    import collector
+    from tools import twitter_api, rate_limit, search_cache
+    from tools.fake_twitter import FakeTwitterApi
+
+    fake = FakeTwitterApi(recording=args.recording, latency=args.latency, jitter=args.jitter,
+                          num_trends=args.trends,
+                          search_limit=180 if args.rate_limited else None,
+                          trends_limit=75 if args.rate_limited else None)
+    twitter_api.set_api(fake)
+    if not args.rate_limited:
+        for bucket in rate_limit.buckets.values():
+            bucket.limit = bucket.remaining = 10**9
+    # trends are fetched every cycle instead of being served from the 14 minute cache
+    collector.REFRESH_MINS = 1
+
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    stats = {}
+    cycles = []
+    for cycle in range(args.cycles):
+        cycle_start = time.perf_counter()
+        for name, phase in collector.update_phases(materialize=not args.no_materialize):
+            written = io_written()
+            if args.tracemalloc:
+                restart_tracemalloc()
+            start = time.perf_counter()
+
+            if args.verbose:
+                phase()
+            else:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    phase()
+
+            elapsed = time.perf_counter() - start
+            s = stats.setdefault(name, {"calls": 0, "total_secs": 0.0, "max_secs": 0.0, "bytes_written": 0, "peak_mb": 0.0})
+            s['calls'] += 1
+            s['total_secs'] += elapsed
+            s['max_secs'] = max(s['max_secs'], elapsed)
+            if written is not None:
+                s['bytes_written'] += io_written() - written
+            peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024) if args.tracemalloc else max_rss_mb()
+            s['peak_mb'] = max(s['peak_mb'], peak)
+
+        cycles.append(time.perf_counter() - cycle_start)
+        print('cycle {}/{}: {:.3f}s'.format(cycle + 1, args.cycles, cycles[-1]), file=sys.stderr)
+
+    process_stats = bench_process_tweets(twitter_api, fake, args.tweets) if args.tweets else {}
+
+    return {
+        "cycles": args.cycles,
+        "storage_mode": os.environ.get('DB_STORAGE_MODE', 'json'),
+        "cycle_secs": {"mean": sum(cycles) / len(cycles), "max": max(cycles), "last": cycles[-1]},
+        "phases": stats,
+        "peak_memory": "tracemalloc" if args.tracemalloc else "max rss",
+        "db_bytes": folder_bytes('db'),
+        "api_calls": fake.calls,
+        "search_cache": search_cache.get_stats(),
+        "tweet_processing": process_stats,
+    }
+
+
+def print_report(report):
+    print('{} cycles, storage mode {}, cycle mean {:.3f}s max {:.3f}s last {:.3f}s'.format(
+        report['cycles'], report['storage_mode'], report['cycle_secs']['mean'], report['cycle_secs']['max'],
+        report['cycle_secs']['last']))
+    print('')
+    print('{:<22}{:>10}{:>10}{:>16}{:>12}'.format('phase', 'mean ms', 'max ms', 'bytes written', 'peak MB'))
+    for name, s in report['phases'].items():
+        print('{:<22}{:>10.1f}{:>10.1f}{:>16,}{:>12.1f}'.format(
+            name, s['total_secs'] / s['calls'] * 1000, s['max_secs'] * 1000, s['bytes_written'], s['peak_mb']))
+    print('')
+    print('peak memory is {}'.format(report['peak_memory']))
+    print('db size after the run: {:,} bytes'.format(report['db_bytes']))
+    print('fake api calls: {}'.format(report['api_calls']))
+    cache = report['search_cache']
+    if cache['hit_rate'] is not None:
+        print('trend search cache: {:.0%} hit rate, {} searches saved, {} stale hits'.format(
+            cache['hit_rate'], cache['searches_saved'], cache['stale_hits']))
+    if report['tweet_processing']:
+        print('')
+        print('{:<22}{:>10}{:>14}{:>16}{:>18}'.format('tweet processing', 'tweets', 'tweets/sec', 'alloc peak', 'alloc retained'))
+        for name, s in report['tweet_processing'].items():
+            print('{:<22}{:>10,}{:>14,.0f}{:>16,}{:>18,}'.format(
+                name, s['tweets'], s['tweets_per_sec'] or 0, s['alloc_peak_bytes'], s['alloc_retained_bytes']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='update cycle benchmark against a fake twitter api')
+    parser.add_argument('--cycles', type=int, default=10)
+    parser.add_argument('--trends', type=int, default=50, help='synthetic trends per cycle')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds per fake api call')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random extra seconds per fake api call')
+    parser.add_argument('--recording', help='json file of recorded api responses, see tools.fake_twitter')
+    parser.add_argument('--rate-limited', action='store_true', help="apply twitter's 15 minute rate limits")
+    parser.add_argument('--seed-db', help='folder with the three db files to start from')
+    parser.add_argument('--workdir', help='scratch folder, a temporary one by default (and deleted after)')
+    parser.add_argument('--no-materialize', action='store_true', help='skip prebuilding responses')
+    parser.add_argument('--tracemalloc', action='store_true', help='peak python memory per phase (slower) instead of max rss')
+    parser.add_argument('--tweets', type=int, default=20000, help='tweets for the process_tweets throughput test, 0 to skip')
+    parser.add_argument('--verbose', action='store_true', help="keep the app's own output")
+    parser.add_argument('--json', action='store_true', help='print the report as json')
+    args = parser.parse_args()
+
+    if args.recording:
+        args.recording = os.path.abspath(args.recording)
+    if args.seed_db:
+        args.seed_db = os.path.abspath(args.seed_db)
+
+    keep_workdir = bool(args.workdir)
+    args.workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix='twitter-benchmark-'))
+    setup_workdir(args.workdir, seed_db=args.seed_db)
+    try:
+        report = run(args)
+    finally:
+        if not keep_workdir:
+            shutil.rmtree(args.workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(report, indent=4))
+    else:
+        print_report(report)
@@ -0,0 +1,320 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# read path benchmark: builds the three dbs at increasing sizes and drives every route in main.py
+# through flask's test client. per route: latency percentiles, response size, and (one extra traced request)
+# peak / net python allocations. results go to a json file so runs can be compared between commits.
+#
+#   python benchmark_routes.py                                  # 1k, 10k, 100k, 1M records
+#   python benchmark_routes.py --sizes 1000,10000 --requests 50 --out before.json
+#   python benchmark_routes.py --compare before.json after.json
+#
+# every size runs in its own process (and scratch db folder), so caches and memory don't carry over.
+# a route that answers anything but 200 is reported as failed instead of with its (error page) latency,
+# and the run exits with 1 after saving the results.
+# the records are cloned from what get_top_trends_from_twitter_api / process_tweets produce against
+# tools.fake_twitter, so they have exactly the schema the collector writes.
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import shutil
+import tracemalloc
+from collections import Counter
+
+from benchmark import APP_DIR, setup_workdir, folder_bytes
+
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+TRENDS_PER_SNAPSHOT = 50
+SNAPSHOT_SECS = 15 * 60
+LABELS = 2000
+
+
+# --------
+# FIXTURES
+# --------
+def templates():
+    """
+    one cycle's worth of real records: trend snapshots, trend searches, top posts
+    """
+    from tools import twitter_api, rate_limit
+    from tools.fake_twitter import FakeTwitterApi
+
+    twitter_api.set_api(FakeTwitterApi(search_limit=None, trends_limit=None))
+    for bucket in rate_limit.buckets.values():
+        bucket.limit = bucket.remaining = 10**9
+
+    output_json, images_output_json = twitter_api.get_top_trends_from_twitter_api(exclude_hashtags=False)
+    top_posts = twitter_api.analyze_top_retweets()
+    return json.loads(output_json), json.loads(images_output_json), top_posts
+
+
+def build_fixtures(size, tweets_per_search=3, start_epoch=1534838400):
+    """
+    writes ./db/*.json with size records in each record list
+    """
+    from tools.time_utils import datetime_2_str, str_to_unix_timestamp
+    import pytz
+
+    trends, searches, posts = templates()
+    posts = [p for p in posts if p.get('timestamp')] or posts
+    search_tweets = [t for s in searches for t in s.get('tweets') or []]
+
+    def time_of(i):
+        epoch = start_epoch + (i // TRENDS_PER_SNAPSHOT) * SNAPSHOT_SECS
+        dt = str_to_unix_timestamp(epoch).replace(tzinfo=pytz.utc)
+        return epoch, datetime_2_str(dt, output_format='%Y-%m-%d %H:%M:%S%z')
+
+    def label_of(i):
+        # a trend sticks around for a few snapshots, like the real ones do
+        return '{}{}'.format(trends[i % len(trends)]['label'], (i // (TRENDS_PER_SNAPSHOT * 8) + i) % LABELS)
+
+    content = []
+    trend_searches = []
+    top_posts = []
+    for i in range(size):
+        epoch, time_str = time_of(i)
+        label = label_of(i)
+
+        t = dict(trends[i % len(trends)], label=label, time=time_str)
+        if 'epoch' in t:
+            t['epoch'] = epoch
+        content.append(t)
+
+        s = {"label": label, "time": time_str, "tweets": []}
+        if 'epoch' in searches[0]:
+            s['epoch'] = epoch
+        for j in range(tweets_per_search):
+            tweet = search_tweets[(i + j) % len(search_tweets)] if search_tweets else {}
+            s['tweets'].append(dict(tweet, url='https://twitter.com/anyuser/status/{}'.format(i * 100 + j)))
+        trend_searches.append(s)
+
+        p = dict(posts[i % len(posts)], url='https://twitter.com/anyuser/status/{}'.format(9 * 10**17 + i))
+        if isinstance(p.get('timestamp'), dict):
+            p['timestamp'] = dict(p['timestamp'], created=time_str)
+            if 'created_epoch' in p['timestamp']:
+                p['timestamp']['created_epoch'] = epoch
+        top_posts.append(p)
+
+    now_str = time_of(size)[1]
+    main_db = {
+        "trends": {
+            "include_hashtags": {"timestamp": now_str, "initial_timestamp": time_of(0)[1], "content": content},
+            "exclude_hashtags": {"timestamp": now_str, "initial_timestamp": time_of(0)[1], "content": []}
+        },
+        "hashtags": {"timestamp": now_str, "initial_timestamp": time_of(0)[1], "content": []}
+    }
+    # same formatting as db_utils writes them
+    for name, db in (('daily_database.json', main_db),
+                     ('daily_trend_search_database.json', {"trends": trend_searches}),
+                     ('daily_top_rt_database.json', {"top_posts": top_posts})):
+        with open(os.path.join('db', name), 'w') as f:
+            json.dump(db, f, indent=4, ensure_ascii=False)
+
+    return content[-1]['label'], time_of(size // 2)[0]
+
+
+# ------
+# ROUTES
+# ------
+def routes(label, middle_epoch):
+    from urllib.parse import quote
+    return [
+        ("landing", "/", {}),
+        ("hashtags", "/twitter/hashtags", {}),
+        ("trends", "/twitter/trends", {}),
+        ("trends gzip", "/twitter/trends", {"Accept-Encoding": "gzip"}),
+        ("trends page", "/twitter/trends?limit=100&since={}".format(middle_epoch), {}),
+        ("trends images", "/twitter/trends/images", {}),
+        ("trends hourly", "/twitter/trends/hourly", {}),
+        ("trends rising", "/twitter/trends/rising", {}),
+        ("trend series", "/twitter/trends/{}/series".format(quote(label, safe='')), {}),
+        ("top posts", "/twitter/top_posts", {}),
+        ("top posts page", "/twitter/top_posts?limit=100&since={}".format(middle_epoch), {}),
+        ("rate limit", "/twitter/rate_limit", {}),
+        ("db main", "/db?q=main", {}),
+        ("db trends", "/db?q=trends", {}),
+        ("db top posts", "/db?q=top_posts", {}),
+        ("db top posts ndjson", "/db?q=top_posts&format=ndjson", {}),
+        ("db top posts gzip", "/db?q=top_posts", {"Accept-Encoding": "gzip"}),
+        ("db cache", "/db/cache", {}),
+    ]
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    k = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+def request(client, url, headers):
+    start = time.perf_counter()
+    response = client.get(url, headers=headers)
+    # streamed responses only do their work while being read
+    body = response.get_data()
+    elapsed = time.perf_counter() - start
+    return elapsed, response.status_code, len(body)
+
+
+def bench_size(size, requests, tweets_per_search):
+    sys.path.insert(0, APP_DIR)
+    build_start = time.perf_counter()
+    label, middle_epoch = build_fixtures(size, tweets_per_search=tweets_per_search)
+    build_secs = time.perf_counter() - build_start
+
+    import main
+    client = main.app.test_client()
+
+    results = {}
+    for name, url, headers in routes(label, middle_epoch):
+        # first request pays for loading the snapshot / building indexes
+        cold, status, size_bytes = request(client, url, headers)
+        statuses = Counter([status])
+
+        latencies = []
+        for _ in range(requests):
+            elapsed, status, size_bytes = request(client, url, headers)
+            statuses[status] += 1
+            latencies.append(elapsed)
+        latencies.sort()
+
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        request(client, url, headers)
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        results[name] = {
+            "url": url,
+            "status": status,
+            # an error page is fast, its latency says nothing about the route
+            "ok": set(statuses) == {200},
+            "statuses": {str(code): n for code, n in sorted(statuses.items())},
+            "response_bytes": size_bytes,
+            "cold_ms": cold * 1000,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p90_ms": percentile(latencies, 90) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "max_ms": latencies[-1] * 1000,
+            "alloc_peak_bytes": peak - before,
+            "alloc_net_bytes": current - before,
+        }
+        if results[name]['ok']:
+            print('{:>9} records  {:<22}{:>8.2f} ms p50{:>12,} bytes  status {}'.format(
+                size, name, results[name]['p50_ms'], size_bytes, status), file=sys.stderr)
+        else:
+            print('{:>9} records  {:<22}FAILED, statuses {}'.format(
+                size, name, results[name]['statuses']), file=sys.stderr)
+
+    return {
+        "records": size,
+        "fixture_build_secs": build_secs,
+        "db_bytes": folder_bytes('db'),
+        "routes": results,
+    }
+
+
+# --------
+# REPORTS
+# --------
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=APP_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def route_ok(result):
+    # files from before "ok" was recorded only have the last status
+    return result.get('ok', result.get('status') == 200)
+
+
+def compare(before_path, after_path, metric='p50_ms'):
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+
+    print('{} ({}) -> {} ({}), {}'.format(before_path, (before.get('commit') or '?')[:8],
+                                          after_path, (after.get('commit') or '?')[:8], metric))
+    for size, result in after['sizes'].items():
+        old = before['sizes'].get(size)
+        if old is None:
+            continue
+        print('')
+        print('{} records'.format(size))
+        for name, r in result['routes'].items():
+            o = old['routes'].get(name)
+            if o is None:
+                continue
+            if not route_ok(r) or not route_ok(o):
+                print('  {:<22}{:>10}{:>10}'.format(name, 'ok' if route_ok(o) else 'failed',
+                                                    'ok' if route_ok(r) else 'failed'))
+                continue
+            change = (r[metric] - o[metric]) / o[metric] * 100 if o[metric] else 0
+            print('  {:<22}{:>10.2f}{:>10.2f}{:>+9.1f}%'.format(name, o[metric], r[metric], change))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='route latency benchmark over synthetic dbs')
+    parser.add_argument('--sizes', default=','.join(str(s) for s in DEFAULT_SIZES), help='records per db, comma separated')
+    parser.add_argument('--requests', type=int, default=20, help='timed requests per route')
+    parser.add_argument('--tweets-per-search', type=int, default=3)
+    parser.add_argument('--out', default='benchmark_routes.json')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two result files and exit')
+    parser.add_argument('--metric', default='p50_ms', help='for --compare')
+    parser.add_argument('--verbose', action='store_true', help="keep the app's own output")
+    # internal: run one size in this process and print its result
+    parser.add_argument('--one-size', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare, metric=args.metric)
+        sys.exit(0)
+
+    if args.one_size:
+        os.chdir(os.environ['BENCHMARK_WORKDIR'])
+        result = bench_size(args.one_size, args.requests, args.tweets_per_search)
+        with open('result.json', 'w') as f:
+            json.dump(result, f)
+        sys.exit(0)
+
+    report = {
+        "commit": git_commit(),
+        "created": int(time.time()),
+        "python": platform.python_version(),
+        "storage_mode": os.environ.get('DB_STORAGE_MODE', 'json'),
+        "requests_per_route": args.requests,
+        "sizes": {},
+    }
+    for size in [int(s) for s in args.sizes.split(',')]:
+        workdir = tempfile.mkdtemp(prefix='twitter-routes-benchmark-')
+        try:
+            setup_workdir(workdir)
+            # the app's own prints are dropped, progress goes to stderr
+            subprocess.check_call(
+                [sys.executable, os.path.abspath(__file__), '--one-size', str(size),
+                 '--requests', str(args.requests), '--tweets-per-search', str(args.tweets_per_search)],
+                env=dict(os.environ, BENCHMARK_WORKDIR=workdir, COLLECTOR='external'),
+                stdout=None if args.verbose else subprocess.DEVNULL)
+            with open(os.path.join(workdir, 'result.json')) as f:
+                report['sizes'][str(size)] = json.load(f)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.out, 'w') as f:
+        json.dump(report, f, indent=4)
+    print('results saved to {}'.format(args.out))
+
+    failed = sorted(set(name for result in report['sizes'].values()
+                        for name, r in result['routes'].items() if not r['ok']))
+    if failed:
+        print('routes that did not answer 200: {}'.format(', '.join(failed)), file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# the twitter side of the app: fetches trends / top posts every REFRESH_MINS and writes the dbs.
+#
+#   python main.py        one process, flask dev server + this schedule in a thread (COLLECTOR=embedded, default)
+#   python collector.py   just the schedule, for when the app is served by uwsgi workers (see uwsgi.ini).
+#                         the workers only read, and pick up each update through the db snapshot cache,
+#                         which reloads a db as soon as its file (or segments / sqlite db) changes.
+#                         with DB_MMAP_SNAPSHOTS=1 the trend search and top posts dbs are also published as
+#                         memory mapped snapshots that all workers share (see tools.mmap_snapshot).
+
+import time, datetime, pytz
+import schedule
+
+from tools.twitter_api import get_top_trends_from_twitter, get_top_hashtags_from_twitter, get_update_top_posts_from_twitter
+from tools.db_utils import make_db, adjust_db, adjust_images_db, adjust_top_posts_db, publish_db_snapshots, \
+    begin_transaction, commit_transaction, abort_transaction
+from tools.mmap_snapshot import MMAP_SNAPSHOTS
+from tools.time_utils import datetime_2_str
+from tools.response_cache import materialize_responses
+from tools import metrics, profiling, search_cache
+
+
+start_time = time.time()
+time_format_full_with_timezone = '%Y-%m-%d %H:%M:%S%z'
+
+DATABASE_PATH = './db/daily_database.json'
+TRENDS_DATABASE_PATH = './db/daily_trend_search_database.json'
+TOP_RETWEETS_DATABASE_PATH = './db/daily_top_rt_database.json'
+# written by a standalone collector, read by /metrics
+METRICS_FILE = './db/collector_metrics.prom'
+DATABASE_STRUCTURE = {
+    "trends": {
+        "include_hashtags": {
+            "timestamp": '1999-01-01 00:00:00+0000',
+            "initial_timestamp": datetime_2_str(datetime.datetime.now(tz=pytz.utc), output_format=time_format_full_with_timezone),
+            "content": []
+        },
+        "exclude_hashtags": {
+            "timestamp": '1999-01-01 00:00:00+0000',
+            "initial_timestamp": datetime_2_str(datetime.datetime.now(tz=pytz.utc), output_format=time_format_full_with_timezone),
+            "content": []
+        }
+    },
+    "hashtags": {
+        "timestamp": '1999-01-01 00:00:00+0000',
+        "initial_timestamp": datetime_2_str(datetime.datetime.now(tz=pytz.utc), output_format=time_format_full_with_timezone),
+        "content": []
+    }
+}
+
+REFRESH_MINS = 15
+
+
+def run_schedule():
+    while 1:
+        schedule.run_pending()
+        time.sleep(1)
+
+
+def get_twitter_trends():
+    print("Elapsed time: " + str(time.time() - start_time))
+    print('calling twitter API to get trends')
+
+    get_top_trends_from_twitter(country='Japan', cache_duration_mins=REFRESH_MINS-1)
+
+
+def get_twitter_extended_hashtags():
+    print("Elapsed time: " + str(time.time() - start_time))
+    print('calling twitter API to build hashtags')
+
+    get_top_hashtags_from_twitter(country='Japan', cache_duration_mins=REFRESH_MINS-1)
+
+
+def update_phases(materialize=True):
+    """
+    the steps of one update, in order
+    :param materialize: prebuild the responses of this process right away.
+                        pointless in a standalone collector, nothing is served from it
+    :return: list of (name, function)
+    """
+    # the dbs as committed, so publishing doesn't load them again
+    committed = {}
+    phases = [
+        # every db is loaded at most once and written once, at commit (see tools.db_utils, UPDATE TRANSACTION)
+        ("begin", begin_transaction),
+        ("trends", get_twitter_trends),
+        ("adjust_db", adjust_db),
+        ("adjust_images_db", adjust_images_db),
+        ("top_posts", get_update_top_posts_from_twitter),
+        ("adjust_top_posts_db", adjust_top_posts_db),
+        #("hashtags", get_twitter_extended_hashtags),
+        ("commit", lambda: committed.update(commit_transaction() or {})),
+    ]
+    if MMAP_SNAPSHOTS:
+        # the big read-mostly dbs, shared by every worker on this host
+        phases.append(("publish_snapshots", lambda: publish_db_snapshots(
+            TRENDS_DATABASE_PATH, TOP_RETWEETS_DATABASE_PATH, states=committed)))
+    if materialize:
+        phases.append(("materialize", lambda: materialize_responses(DATABASE_PATH, TRENDS_DATABASE_PATH, TOP_RETWEETS_DATABASE_PATH)))
+    return phases
+
+
+def get_updates_from_twitter(materialize=True, metrics_file=None):
+    """
+    :param metrics_file: where to write this process' metrics after the update, for /metrics of the serving processes
+    """
+    update_start = time.time()
+    # see tools.profiling, PROFILE_UPDATES. sampled across threads by default, the searches run on a pool
+    profile = None
+    if profiling.take_update_profile():
+        profile = profiling.Profile('update', mode=profiling.PROFILE_UPDATES_MODE, all_threads=True).start()
+
+    try:
+        with metrics.update_seconds.time():
+            for name, phase in update_phases(materialize=materialize):
+                with metrics.update_phase_seconds.time(phase=name):
+                    phase()
+    except Exception:
+        metrics.updates_total.inc(result='error')
+        try:
+            # nothing of a failed cycle is written, a stage may have left a db half changed
+            if abort_transaction():
+                # its searches are not in the dbs, so they have to be made again
+                search_cache.forget_since(update_start)
+        except Exception as e:
+            print('could not roll back the failed update: {}'.format(e))
+        raise
+    else:
+        metrics.updates_total.inc(result='ok')
+        metrics.last_update.set(time.time())
+    finally:
+        if profile is not None:
+            profile.stop()
+        if metrics_file:
+            metrics.write_textfile(metrics_file)
+
+    print("total update time took: {} seconds".format(str(time.time() - update_start)))
+
+
+def start_schedule(materialize=True, metrics_file=None):
+    """
+    first update right away, then every REFRESH_MINS
+    """
+    make_db(DATABASE_STRUCTURE, debug=True)
+    get_updates_from_twitter(materialize=materialize, metrics_file=metrics_file)
+    schedule.every(REFRESH_MINS).minutes.do(get_updates_from_twitter, materialize=materialize, metrics_file=metrics_file)
+
+
+if __name__ == '__main__':
+    print("Start time: " + str(start_time))
+    start_schedule(materialize=False, metrics_file=METRICS_FILE)
+    run_schedule()
@@ -1,17 +1,24 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from flask import Flask, request, jsonify, render_template_string
+from flask import Flask, Response, g, request, jsonify, render_template_string
 from flask_cors import CORS
 
 from tools.baseutils import textify
-import time, datetime, pytz
-import schedule
+import os, time, datetime, pytz
 from threading import Thread
 
-from tools.twitter_api import get_top_trends_from_twitter, get_top_hashtags_from_twitter, get_update_top_posts_from_twitter, check_rate_limit
-from tools.db_utils import make_db, load_db, update_db, adjust_images_db, adjust_top_posts_db
-from tools.time_utils import datetime_2_str, str_2_datetime
+from collector import DATABASE_PATH, TRENDS_DATABASE_PATH, TOP_RETWEETS_DATABASE_PATH, METRICS_FILE, start_schedule, run_schedule
+from tools.twitter_api import check_rate_limit
+from tools.db_utils import load_db_snapshot, get_snapshot_stats, STORAGE_MODE
+from tools.time_utils import str_2_datetime
+from tools.db_stream import stream_db, stream_file, NDJSON_RECORDS
+from tools.trend_series import get_series, rising
+from tools.hourly_view import get_hours, DEFAULT_HOURS
+from tools.time_index import page_records, parse_time_arg, decode_cursor, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from tools.response_cache import send_prebuilt, send_payload, get_prebuilt_trends, get_prebuilt_images, \
+    get_prebuilt_top_posts, top_posts_output, DEFAULT_TOP_POSTS_COUNT
+from tools import metrics, profiling
 
 # pretty interface
 from flasgger import Swagger
@@ -36,62 +43,72 @@ time_format_full_no_timezone = '%Y-%m-%d %H:%M:%S'
 time_format_full_with_timezone = '%Y-%m-%d %H:%M:%S%z'
 jp_timezone = pytz.timezone('Asia/Tokyo')
 
-DATABASE_PATH = './db/daily_database.json'
-TRENDS_DATABASE_PATH = './db/daily_trend_search_database.json'
-TOP_RETWEETS_DATABASE_PATH = './db/daily_top_rt_database.json'
-DATABASE_STRUCTURE = {
-    "trends": {
-        "include_hashtags": {
-            "timestamp": '1999-01-01 00:00:00+0000',
-            "initial_timestamp": datetime_2_str(datetime.datetime.now(tz=pytz.utc), output_format=time_format_full_with_timezone),
-            "content": []
-        },
-        "exclude_hashtags": {
-            "timestamp": '1999-01-01 00:00:00+0000',
-            "initial_timestamp": datetime_2_str(datetime.datetime.now(tz=pytz.utc), output_format=time_format_full_with_timezone),
-            "content": []
-        }
-    },
-    "hashtags": {
-        "timestamp": '1999-01-01 00:00:00+0000',
-        "initial_timestamp": datetime_2_str(datetime.datetime.now(tz=pytz.utc), output_format=time_format_full_with_timezone),
-        "content": []
-    }
-}
+# embedded: python main.py also runs the twitter updates in a thread (the original setup)
+# external: this process only serves, collector.py does the updates (uwsgi workers, see uwsgi.ini)
+COLLECTOR = os.environ.get('COLLECTOR', 'embedded')
 
-REFRESH_MINS = 15
 
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
 
-def run_schedule():
-    while 1:
-        schedule.run_pending()
-        time.sleep(1)
 
+@app.after_request
+def record_request_metrics(response):
+    # labelled by the route pattern, not the url, so /twitter/trends/<label>/series stays one series
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    elapsed = time.perf_counter() - g.get('request_start', time.perf_counter())
+    metrics.http_request_seconds.observe(elapsed, route=route, method=request.method, status=response.status_code)
+    # streamed responses have no length until they are sent
+    if not response.is_streamed and response.content_length is not None:
+        metrics.http_response_bytes.observe(response.content_length, route=route)
+    return response
 
-def get_twitter_trends():
-    print("Elapsed time: " + str(time.time() - start_time))
-    print('calling twitter API to get trends')
 
-    get_top_trends_from_twitter(country='Japan', cache_duration_mins=REFRESH_MINS-1)
+if profiling.PROFILE_SECRET:
+    # only installed when profiling is configured, see tools.profiling
+    @app.before_request
+    def start_request_profile():
+        mode = profiling.requested(request.headers, request.args)
+        if mode:
+            g.profile = profiling.Profile(request.path, mode=mode).start()
 
+    @app.after_request
+    def stop_request_profile(response):
+        profile = g.pop('profile', None)
+        if profile is not None:
+            # streamed responses do most of their work after this, so stop once the body is sent
+            response.call_on_close(profile.stop)
+        return response
 
-def get_twitter_extended_hashtags():
-    print("Elapsed time: " + str(time.time() - start_time))
-    print('calling twitter API to build hashtags')
+    @app.teardown_request
+    def stop_failed_request_profile(exc):
+        profile = g.pop('profile', None)
+        if profile is not None:
+            profile.stop()
 
-    get_top_hashtags_from_twitter(country='Japan', cache_duration_mins=REFRESH_MINS-1)
 
+def get_page_args():
+    """
+    since / until / limit / cursor query parameters for the paged routes
+    :return: kwargs for page_records, or None if the client didn't ask for a page
+    """
+    args = request.args
+    if not any(args.get(k) for k in ('since', 'until', 'limit', 'cursor')):
+        return None
 
-def get_updates_from_twitter():
-    update_start = time.time()
-
-    get_twitter_trends()
-    adjust_images_db()
-    get_update_top_posts_from_twitter()
-    adjust_top_posts_db()
-    #get_twitter_extended_hashtags()
-
-    print("total update time took: {} seconds".format(str(time.time() - update_start)))
+    try:
+        limit = int(args.get('limit') or DEFAULT_PAGE_SIZE)
+        decode_cursor(args.get('cursor'))
+    except ValueError:
+        raise ValueError('limit must be a number and cursor must be a next_cursor from a previous page')
+
+    return {
+        "since": parse_time_arg(args.get('since')),
+        "until": parse_time_arg(args.get('until')),
+        "cursor": args.get('cursor'),
+        "limit": limit
+    }
 
 
 # only POST
@@ -104,11 +121,16 @@ def daily():
         "endpoints": {
             "/": "landing page",
             "/twitter/hashtags": "currently not supported",
-            "/twitter/trends": "returns minimal trends db since the beginning of time",
+            "/twitter/trends": "returns minimal trends db since the beginning of time. since/until/limit/cursor for a time ordered page",
             "/twitter/trends/images": "returns minimal images db since the beginning of time",
-            "/twitter/top_posts": "returns top N tweets since the beginning of time (default 30)",
+            "/twitter/trends/<label>/series": "volume over time of one trend. since/until to narrow it down",
+            "/twitter/trends/rising": "current trends ranked by volume growth since their previous snapshot (limit, default 10)",
+            "/twitter/trends/hourly": "trends per JST hour, newest first. since/until, limit = number of hours (default 24)",
+            "/twitter/top_posts": "returns top N tweets since the beginning of time (default 30). since/until/limit/cursor for a time ordered page",
             "/twitter/rate_limit": "checks twitter for rate limiting",
-            "/db": "full database, VERY HEAVY",
+            "/db": "full database, streamed. q=main|trends|top_posts, format=ndjson for one record per line",
+            "/db/cache": "hit/miss counters of the in-process db snapshot cache",
+            "/metrics": "update phase / db write / route timings and counters, prometheus text format",
         }
     }
 
@@ -142,7 +164,7 @@ def hashtags_twitter_only():
     print("time since app start: {:.2f} minutes".format(str((time.time() - start_time) / 60)))
     print("time since last update: {:.2f} minutes".format(str((time.time() - update_start) / 60)))
 
-    full_db = load_db(database_path=DATABASE_PATH)
+    full_db = load_db_snapshot(database_path=DATABASE_PATH)
 
     direct_hashtags_from_trends = full_db['trends']['include_hashtags']['content']
 
@@ -176,8 +198,13 @@ def all():
     if not args:
         args = "main"
 
+    # format=ndjson streams the records of the db one per line
+    ndjson = request.args.get('format') == 'ndjson'
+    gzip = bool(request.accept_encodings['gzip'])
+
     if args == "main":
-        full_db = load_db(database_path=DATABASE_PATH)
+        database_path = DATABASE_PATH
+        full_db = load_db_snapshot(database_path=DATABASE_PATH)
 
         db_init_timestamp = str_2_datetime(full_db['trends']['include_hashtags']['initial_timestamp'], input_format=time_format_full_with_timezone)
         db_update_timestamp = str_2_datetime(full_db['trends']['include_hashtags']['timestamp'], input_format=time_format_full_with_timezone)
@@ -187,17 +214,41 @@ def all():
         print("time since last update: {:.2f} minutes".format((datetime.datetime.now(tz=pytz.utc) - db_update_timestamp).seconds/60))
 
     elif args == "trends":
-        full_db = load_db(database_path=TRENDS_DATABASE_PATH)
+        database_path = TRENDS_DATABASE_PATH
     elif args == "top_posts":
-        full_db = load_db(database_path=TOP_RETWEETS_DATABASE_PATH)
+        database_path = TOP_RETWEETS_DATABASE_PATH
+    else:
+        return jsonify({"status": "q must be one of main, trends, top_posts"}), 400
 
-    return jsonify(full_db)
+    # streamed, so memory per request stays the same however big the db gets
+    if ndjson:
+        return stream_db(load_db_snapshot(database_path=database_path), ndjson_path=NDJSON_RECORDS[args], gzip=gzip)
+    if STORAGE_MODE == 'json':
+        # the file on disk already is the answer
+        return stream_file(database_path, gzip=gzip)
+    return stream_db(load_db_snapshot(database_path=database_path), gzip=gzip)
 
 
 @app.route('/db/backup', methods=['GET'])
 def backup():
-    backup_db = load_db(database_path=DATABASE_PATH + '.bak')
-    return jsonify(backup_db)
+    if not os.path.exists(DATABASE_PATH + '.bak'):
+        return jsonify({"status": "no backup yet"}), 404
+    return stream_file(DATABASE_PATH + '.bak', gzip=bool(request.accept_encodings['gzip']))
+
+
+@app.route('/db/cache', methods=['GET'])
+def db_cache():
+    return jsonify(get_snapshot_stats())
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_text():
+    collector_text, collector_names = '', set()
+    if COLLECTOR == 'external':
+        # the updates run in collector.py, which leaves its metrics in a file after every update
+        collector_text, collector_names = metrics.read_textfile(METRICS_FILE)
+    return Response(metrics.render(skip=collector_names) + collector_text,
+                    content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 @app.route('/twitter/trends', methods={'GET'})
@@ -218,7 +269,7 @@ def trends():
                   type: string
                   default: ok
     """
-    full_db = load_db(database_path=DATABASE_PATH)
+    full_db = load_db_snapshot(database_path=DATABASE_PATH)
 
     db_init_timestamp = str_2_datetime(full_db['trends']['include_hashtags']['initial_timestamp'],
                                        input_format=time_format_full_with_timezone)
@@ -237,72 +288,90 @@ def trends():
     print('db init time: {}'.format(db_init_timestamp))
     print('diff: {}'.format(datetime.datetime.now(tz=pytz.utc) - db_init_timestamp))
 
-    # send back only a portion of the db
-    results = full_db['trends']['include_hashtags']
-    del full_db
+    try:
+        page_args = get_page_args()
+    except ValueError as e:
+        return jsonify({"status": str(e)}), 400
+
+    if page_args is not None:
+        # only the trends in the requested window, oldest first
+        contents, next_cursor = page_records(DATABASE_PATH, ['trends', 'include_hashtags', 'content'], **page_args)
+        results = full_db['trends']['include_hashtags']
+        return send_payload({
+            "results": {
+                "content": [{"label": c['label'], "time": c['time'], "volume": c['volume']} for c in contents],
+                "timestamp": results['timestamp'],
+                "initial_timestamp": results['initial_timestamp'],
+                "next_cursor": next_cursor
+            },
+            "status": 'ok'
+        })
 
-    contents = results['content']
+    return send_prebuilt(get_prebuilt_trends(DATABASE_PATH))
 
-    output_content = []
-    for c in contents:
-        output_content.append({
-            "label": c['label'],
-            "time": c['time'],
-            "volume": c['volume']
-        })
 
-    output_results = {
-        "content": output_content,
-        "timestamp": results['timestamp'],
-        "initial_timestamp": results['initial_timestamp']
-    }
+@app.route('/twitter/trends/images', methods=['GET'])
+def images():
+    return send_prebuilt(get_prebuilt_images(TRENDS_DATABASE_PATH))
 
-    trends_output = {
-        "results": output_results,
-        "status": 'ok'
-    }
 
-    return jsonify(trends_output)
+# trend labels can contain '/'
+@app.route('/twitter/trends/<path:label>/series', methods=['GET'])
+def trend_series(label):
+    """
+    volume over time of one trend label, from the in-process series index
+    """
+    try:
+        since = parse_time_arg(request.args.get('since'))
+        until = parse_time_arg(request.args.get('until'))
+    except ValueError as e:
+        return jsonify({"status": str(e)}), 400
+
+    series = get_series(label, since=since, until=until, database_path=DATABASE_PATH)
+    if series is None:
+        return jsonify({"status": "no trend named {}".format(label)}), 404
+
+    epochs, volumes = series
+    return send_payload({
+        "results": {
+            "label": label,
+            "epochs": epochs,
+            "volumes": volumes
+        },
+        "status": "ok"
+    })
 
 
-@app.route('/twitter/trends/images', methods=['GET'])
-def images():
-    full_db = load_db(database_path=TRENDS_DATABASE_PATH)
-
-    # from trends content
-    # send back only a portion of the db
-    contents = full_db['trends']
-    del full_db
-
-    output_content = []
-    for c in contents:
-        output_media_url = []
-        try:
-            for t in c['tweets']:
-                if t['media']:
-                    output_media_url.append({
-                        "url": t['url'],
-                        "images": t['media']
-                    })
-        except:
-            continue
-
-        output_content.append({
-            "label": c['label'],
-            "time": c['time'],
-            "media": output_media_url
-        })
+@app.route('/twitter/trends/rising', methods=['GET'])
+def rising_trends():
+    try:
+        limit = int(request.args.get('limit') or 10)
+    except ValueError:
+        limit = 10
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
 
-    output_results = {
-        "content": output_content
-    }
+    return send_payload({
+        "results": rising(limit=limit, database_path=DATABASE_PATH),
+        "status": "ok"
+    })
 
-    trends_output = {
-        "results": output_results,
-        "status": 'ok'
-    }
 
-    return jsonify(trends_output)
+@app.route('/twitter/trends/hourly', methods=['GET'])
+def hourly_trends():
+    """
+    trends per Asia/Tokyo hour, same shape as misc/thdal_ideal_output_format.json
+    """
+    try:
+        since = parse_time_arg(request.args.get('since'))
+        until = parse_time_arg(request.args.get('until'))
+        limit = int(request.args.get('limit') or DEFAULT_HOURS)
+    except ValueError as e:
+        return jsonify({"status": str(e)}), 400
+
+    return send_payload({
+        "results": get_hours(since=since, until=until, limit=max(1, limit), database_path=DATABASE_PATH),
+        "status": "ok"
+    })
 
 
 @app.route('/twitter/top_posts', methods=['GET'])
@@ -314,21 +383,25 @@ def top_posts():
     except:
         arg = 100
 
-    full_db = load_db(database_path=TOP_RETWEETS_DATABASE_PATH)
-
-    # from trends content
-    # send back only a portion of the db
-    contents = full_db['top_posts']
-    del full_db
+    try:
+        page_args = get_page_args()
+    except ValueError as e:
+        return jsonify({"status": str(e)}), 400
+
+    if page_args is not None:
+        # time ordered page instead of the most recent N
+        contents, next_cursor = page_records(TOP_RETWEETS_DATABASE_PATH, ['top_posts'], **page_args)
+        return send_payload({
+            "results": contents,
+            "next_cursor": next_cursor,
+            "status": "ok"
+        })
 
     print('returning {} most recent items from db'.format(arg))
 
-    output = {
-        "results": contents[arg*-1:],
-        "status": "ok"
-    }
-
-    return jsonify(output)
+    if arg == DEFAULT_TOP_POSTS_COUNT:
+        return send_prebuilt(get_prebuilt_top_posts(TOP_RETWEETS_DATABASE_PATH))
+    return send_payload(top_posts_output(load_db_snapshot(TOP_RETWEETS_DATABASE_PATH), count=arg))
 
 
 @app.route('/twitter/rate_limit', methods={'GET'})
@@ -347,16 +420,12 @@ def ratelimit():
 
 
 if __name__ == '__main__':
-    make_db(DATABASE_STRUCTURE, debug=True)
-    get_updates_from_twitter()
-
-    # right now i am using flask dev server because of the timing loop
-    # but if i am confident in my caching system i can probably use the production server and
-    schedule.every(REFRESH_MINS).minutes.do(get_updates_from_twitter)
-    t = Thread(target=run_schedule)
-    t.start()
+    if COLLECTOR == 'embedded':
+        # right now i am using flask dev server because of the timing loop
+        # for more than one worker run collector.py on its own and serve with uwsgi instead
+        start_schedule()
+        t = Thread(target=run_schedule)
+        t.start()
     print("Start time: " + str(start_time))
     app.run(debug=True, host='0.0.0.0', port=8080, use_reloader=False)
     print('a flask app is initiated at {0}'.format(app.instance_path))
-
-
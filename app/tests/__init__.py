@@ -0,0 +1,5 @@
+# behaviour tests for tools/. run from app/:
+#
+#   python -m unittest discover -s tests -t .
+#
+# (or python -m pytest tests). everything works in temporary folders, nothing goes to twitter.
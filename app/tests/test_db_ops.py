@@ -0,0 +1,70 @@
+import copy
+import random
+import unittest
+
+from tools.db_ops import apply_op, apply_ops, append_op, upsert_op, trim_op, set_op, ListIndex
+
+
+def post(url, likes=0, checked='2018-09-03 10:00:00+0000'):
+    return {"url": url, "likes": likes, "timestamp": {"created": "2018-09-01 00:00:00+0000", "last_checked": checked}}
+
+
+class DbOpsTest(unittest.TestCase):
+    def test_upsert_updates_fields_in_place_and_appends_new_records(self):
+        state = {"top_posts": [post('a', 1), post('b', 2)]}
+        apply_ops(state, [upsert_op(['top_posts'], [post('b', 20, checked='later'), post('c', 3)],
+                                    fields=['likes', 'timestamp.last_checked'])])
+
+        self.assertEqual([(p['url'], p['likes']) for p in state['top_posts']], [('a', 1), ('b', 20), ('c', 3)])
+        self.assertEqual(state['top_posts'][1]['timestamp'],
+                         {"created": "2018-09-01 00:00:00+0000", "last_checked": "later"})
+
+    def test_upsert_without_fields_replaces_the_record(self):
+        state = {"top_posts": [post('a', 1)]}
+        apply_op(state, upsert_op(['top_posts'], [{"url": "a", "likes": 5}]))
+        self.assertEqual(state['top_posts'], [{"url": "a", "likes": 5}])
+
+    def test_trim_drops_the_oldest(self):
+        state = {"top_posts": [post('a'), post('b'), post('c')]}
+        apply_op(state, trim_op(['top_posts'], 2))
+        self.assertEqual([p['url'] for p in state['top_posts']], ['c'])
+
+    def test_append_with_unique_key_moves_the_new_version_to_the_end(self):
+        state = {"trends": [{"label": "x", "n": 1}, {"label": "y", "n": 1}]}
+        apply_op(state, append_op(['trends'], [{"label": "x", "n": 2}], unique_key='label'))
+        self.assertEqual(state['trends'], [{"label": "y", "n": 1}, {"label": "x", "n": 2}])
+
+    def test_upsert_after_trim_uses_the_shifted_positions(self):
+        # the index of the first upsert is kept through the trim instead of being built again
+        state = {"top_posts": [post('a'), post('b'), post('c')]}
+        indexes = {}
+        apply_op(state, upsert_op(['top_posts'], [post('d')]), indexes=indexes)
+        apply_op(state, trim_op(['top_posts'], 2), indexes=indexes)
+        apply_op(state, upsert_op(['top_posts'], [post('a', 7), post('d', 9)], fields=['likes']), indexes=indexes)
+
+        self.assertEqual([(p['url'], p['likes']) for p in state['top_posts']], [('c', 0), ('d', 9), ('a', 7)])
+        self.assertIsInstance(indexes[(('top_posts',), 'url')], ListIndex)
+
+    def test_kept_indexes_match_indexes_built_from_scratch(self):
+        rnd = random.Random(0)
+        for trial in range(100):
+            kept, fresh = {"top_posts": [], "other": {"list": []}}, {"top_posts": [], "other": {"list": []}}
+            indexes = {}
+            for step in range(30):
+                records = [post('u{}'.format(rnd.randrange(10)), likes=step) for _ in range(rnd.randrange(4))]
+                op = rnd.choice([
+                    upsert_op(['top_posts'], records, fields=['likes']),
+                    upsert_op(['top_posts'], records),
+                    append_op(['top_posts'], records),
+                    append_op(['top_posts'], records, unique_key='url'),
+                    trim_op(['top_posts'], rnd.randrange(4)),
+                    set_op(['top_posts'], records),
+                    upsert_op(['other', 'list'], records),
+                ])
+                apply_op(kept, copy.deepcopy(op), indexes=indexes)
+                apply_op(fresh, copy.deepcopy(op))
+                self.assertEqual(kept, fresh)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,198 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from tools import db_utils
+from tools.db_ops import append_op, trim_op
+
+
+def trend(label, n):
+    return {"label": label, "tweets": [{"id": i} for i in range(n)]}
+
+
+class DbTransactionTest(unittest.TestCase):
+    storage_mode = 'json'
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.mode = db_utils.STORAGE_MODE
+        db_utils.STORAGE_MODE = self.storage_mode
+
+        self.trends = os.path.join(self.folder, 'daily_trend_search_database.json')
+        self.top_posts = os.path.join(self.folder, 'daily_top_rt_database.json')
+        with open(self.trends, 'w') as f:
+            json.dump({"trends": [trend('a', 2), trend('b', 1)]}, f)
+        with open(self.top_posts, 'w') as f:
+            json.dump({"top_posts": [{"url": "x"}]}, f)
+
+        self.writes = []
+        write_db_ops = db_utils._write_db_ops
+
+        def counting_write(ops, database_path, state, debug=False):
+            self.writes.append(database_path)
+            return write_db_ops(ops, database_path, state, debug=debug)
+        patcher = mock.patch.object(db_utils, '_write_db_ops', counting_write)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        db_utils.abort_transaction()
+        db_utils.STORAGE_MODE = self.mode
+        for path in (self.trends, self.top_posts):
+            db_utils.invalidate_snapshot(path)
+            db_utils._indexes.pop(db_utils._snapshot_key(path), None)
+        shutil.rmtree(self.folder)
+
+    def labels(self, path=None):
+        return [t['label'] for t in db_utils.load_db(path or self.trends)['trends']]
+
+    def test_each_changed_db_is_written_once_on_commit(self):
+        db_utils.begin_transaction()
+        db_utils.apply_db_ops([append_op(['trends'], [trend('c', 1)])], self.trends)
+        db_utils.apply_db_ops([trim_op(['trends'], 1)], self.trends)
+        db_utils.load_db(self.top_posts)
+        # seen by the transaction, not written yet
+        self.assertEqual(self.labels(), ['b', 'c'])
+        self.assertEqual(self.writes, [])
+
+        states = db_utils.commit_transaction()
+
+        self.assertEqual(self.writes, [self.trends])
+        self.assertIsNone(db_utils.current_transaction())
+        self.assertEqual(self.labels(), ['b', 'c'])
+        # what was committed is what a fresh load reads
+        self.assertEqual(states[db_utils._snapshot_key(self.trends)], db_utils.load_db(self.trends))
+        self.assertEqual(states[db_utils._snapshot_key(self.top_posts)], db_utils.load_db(self.top_posts))
+
+    def test_abort_writes_nothing(self):
+        db_utils.begin_transaction()
+        db_utils.apply_db_ops([trim_op(['trends'], 2)], self.trends)
+
+        self.assertTrue(db_utils.abort_transaction())
+        self.assertFalse(db_utils.abort_transaction())
+        self.assertEqual(self.writes, [])
+        self.assertEqual(self.labels(), ['a', 'b'])
+
+    def test_db_an_op_failed_on_is_not_written(self):
+        db_utils.begin_transaction()
+        db_utils.apply_db_ops([append_op(['top_posts'], [{"url": "y"}])], self.top_posts)
+        with self.assertRaises(Exception):
+            db_utils.apply_db_ops([trim_op(['trends'], 1), append_op(['missing', 'list'], [{}])], self.trends)
+
+        states = db_utils.commit_transaction()
+
+        self.assertEqual(self.writes, [self.top_posts])
+        self.assertEqual(self.labels(), ['a', 'b'])
+        self.assertNotIn(db_utils._snapshot_key(self.trends), states)
+
+    def test_list_weight_follows_the_ops(self):
+        db_utils.begin_transaction()
+        self.assertEqual(db_utils.list_weight(self.trends, ['trends'], 'tweets'), 3)
+        db_utils.apply_db_ops([append_op(['trends'], [trend('c', 4), trend('a', 1)], unique_key='label')],
+                              self.trends)
+        self.assertEqual(db_utils.list_weight(self.trends, ['trends'], 'tweets'), 6)
+        db_utils.apply_db_ops([trim_op(['trends'], 1)], self.trends)
+        self.assertEqual(db_utils.list_weight(self.trends, ['trends'], 'tweets'), 5)
+        db_utils.commit_transaction()
+
+        self.assertEqual(db_utils.list_weight(self.trends, ['trends'], 'tweets'), 5)
+
+    def test_snapshots_only_show_what_is_committed(self):
+        db_utils.begin_transaction()
+        db_utils.apply_db_ops([trim_op(['trends'], 1)], self.trends)
+        self.assertEqual([t['label'] for t in db_utils.load_db_snapshot(self.trends)['trends']], ['a', 'b'])
+        db_utils.abort_transaction()
+
+        self.assertEqual([t['label'] for t in db_utils.load_db_snapshot(self.trends)['trends']], ['a', 'b'])
+
+    def test_on_commit_runs_after_the_write_and_never_after_an_abort(self):
+        seen = []
+        db_utils.begin_transaction()
+        db_utils.apply_db_ops([trim_op(['trends'], 1)], self.trends)
+        db_utils.on_commit(lambda: seen.append('aborted'))
+        db_utils.abort_transaction()
+
+        db_utils.begin_transaction()
+        db_utils.apply_db_ops([trim_op(['trends'], 1)], self.trends)
+        db_utils.on_commit(lambda: seen.append(self.labels()))
+        self.assertEqual(seen, [])
+        db_utils.commit_transaction()
+
+        db_utils.on_commit(lambda: seen.append('no transaction'))
+        self.assertEqual(seen, [['b'], 'no transaction'])
+
+    def test_only_one_transaction_per_thread(self):
+        db_utils.begin_transaction()
+        with self.assertRaises(RuntimeError):
+            db_utils.begin_transaction()
+
+
+class SegmentsDbTransactionTest(DbTransactionTest):
+    storage_mode = 'segments'
+
+
+class SqliteDbTransactionTest(DbTransactionTest):
+    storage_mode = 'sqlite'
+
+
+class FailedUpdateTest(unittest.TestCase):
+    """
+    collector.get_updates_from_twitter with the update phases swapped for ones that fail halfway
+    """
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.folder = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.folder, 'db'))
+        for name in ('daily_database.json', 'daily_trend_search_database.json', 'daily_top_rt_database.json'):
+            with open(os.path.join(self.folder, 'db', name), 'w') as f:
+                f.write('{}')
+        # the twitter side finds its dbs relative to the working directory when it is imported
+        os.chdir(self.folder)
+        import collector
+        self.collector = collector
+
+        self.path = os.path.join(self.folder, 'db', 'daily_database.json')
+        with open(self.path, 'w') as f:
+            json.dump({"trends": [trend('a', 1)]}, f)
+
+    def tearDown(self):
+        db_utils.abort_transaction()
+        db_utils.invalidate_snapshot(self.path)
+        os.chdir(self.cwd)
+        shutil.rmtree(self.folder)
+
+    def update(self, error):
+        def fail():
+            raise error
+        phases = [
+            ("begin", db_utils.begin_transaction),
+            ("trends", lambda: db_utils.apply_db_ops([trim_op(['trends'], 1)], self.path)),
+            ("top_posts", fail),
+            ("commit", db_utils.commit_transaction),
+        ]
+        with mock.patch.object(self.collector, 'update_phases', lambda materialize=True: phases):
+            self.collector.get_updates_from_twitter(materialize=False)
+
+    def test_failed_update_is_rolled_back_and_raised(self):
+        error = ValueError('top posts failed')
+        with self.assertRaises(ValueError) as raised:
+            self.update(error)
+
+        self.assertIs(raised.exception, error)
+        self.assertIsNone(db_utils.current_transaction())
+        self.assertEqual(db_utils.load_db(self.path), {"trends": [trend('a', 1)]})
+
+    def test_original_error_is_raised_even_if_the_rollback_fails(self):
+        error = ValueError('top posts failed')
+        with mock.patch.object(self.collector, 'abort_transaction', side_effect=OSError('rollback failed')):
+            with self.assertRaises(ValueError) as raised:
+                self.update(error)
+
+        self.assertIs(raised.exception, error)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+
+def tweet(id, text=''):
+    return {"url": "https://twitter.com/anyuser/status/{}".format(id), "text": text}
+
+
+def status(id, text):
+    return {"id": id, "text": text, "favorite_count": 10, "retweet_count": 1,
+            "created_at": "Mon Sep 03 10:00:00 +0000 2018", "entities": {"hashtags": []}}
+
+
+class IncrementalSearchTest(unittest.TestCase):
+    """
+    the since_id side of the trend searches, against tools.fake_twitter
+    """
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.folder = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.folder, 'db'))
+        for name in ('daily_database.json', 'daily_trend_search_database.json', 'daily_top_rt_database.json'):
+            with open(os.path.join(self.folder, 'db', name), 'w') as f:
+                f.write('{}')
+        # twitter_api finds its dbs relative to the working directory when it is imported
+        os.chdir(self.folder)
+        from tools import twitter_api, rate_limit
+        self.twitter_api, self.budget = twitter_api, rate_limit.search_budget
+        self.api = twitter_api.api
+        self.saved_budget = self.budget.limit, self.budget.remaining
+
+    def tearDown(self):
+        self.twitter_api.set_api(self.api)
+        self.budget.limit, self.budget.remaining = self.saved_budget
+        os.chdir(self.cwd)
+        shutil.rmtree(self.folder)
+
+    def test_merge_puts_new_tweets_first_without_duplicates(self):
+        stored = [{"label": "a", "since_id": 3, "tweets": [tweet(3), tweet(2), tweet(1)]}]
+        new = [{"label": "a", "since_id": 5, "tweets": [tweet(5), tweet(4), tweet(3)]}]
+
+        merged = self.twitter_api.merge_trend_searches(stored, new, max_tweets=10)
+
+        self.assertEqual(merged, [{"label": "a", "since_id": 5,
+                                   "tweets": [tweet(5), tweet(4), tweet(3), tweet(2), tweet(1)]}])
+
+    def test_merge_keeps_at_most_max_tweets(self):
+        stored = [{"label": "a", "tweets": [tweet(i) for i in range(10, 0, -1)]}]
+        new = [{"label": "a", "tweets": [tweet(12), tweet(11)]}]
+
+        merged = self.twitter_api.merge_trend_searches(stored, new, max_tweets=5)
+        self.assertEqual(merged[0]['tweets'], [tweet(12), tweet(11), tweet(10), tweet(9), tweet(8)])
+
+        # more new tweets than fit, none of the stored ones are left
+        new = [{"label": "a", "tweets": [tweet(i) for i in range(20, 12, -1)]}]
+        merged = self.twitter_api.merge_trend_searches(stored, new, max_tweets=5)
+        self.assertEqual(merged[0]['tweets'], [tweet(i) for i in range(20, 15, -1)])
+
+    def test_merge_folds_older_entries_of_a_label_into_one(self):
+        # entries from before the searches were incremental, one per cycle
+        stored = [
+            {"label": "a", "tweets": [tweet(1), tweet(2)]},
+            {"label": "b", "tweets": [tweet(7)]},
+            {"label": "a", "tweets": [tweet(3), tweet(2)]},
+        ]
+        new = [{"label": "a", "tweets": [tweet(4)]}, {"label": "c", "tweets": [tweet(8)]},
+               {"label": "a", "tweets": [tweet(9)]}]
+
+        merged = self.twitter_api.merge_trend_searches(stored, new, max_tweets=10)
+
+        # newest stored entry first, the label's second search in the same cycle is dropped
+        self.assertEqual(merged, [{"label": "a", "tweets": [tweet(4), tweet(3), tweet(2), tweet(1)]},
+                                  {"label": "c", "tweets": [tweet(8)]}])
+
+    def test_since_ids_come_from_the_newest_entry_of_each_label(self):
+        stored = [{"label": "a", "since_id": 3}, {"label": "b"}, {"label": "a", "since_id": 9},
+                  {"label": "c", "since_id": 4}, {"label": "c"}]
+        self.assertEqual(self.twitter_api.latest_since_ids(stored), {"a": 9, "c": 4})
+
+    def search_batched(self, statuses, since_ids):
+        from tools.fake_twitter import FakeTwitterApi
+        query = '"a" OR "b"'
+        fake = FakeTwitterApi(recording={"search": {query: statuses}})
+        get_search, self.sent_since_ids = fake.GetSearch, []
+
+        def recording_get_search(*args, **kwargs):
+            self.sent_since_ids.append(kwargs.get('since_id'))
+            return get_search(*args, **kwargs)
+        fake.GetSearch = recording_get_search
+        self.twitter_api.set_api(fake)
+        self.budget.limit = self.budget.remaining = 10
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            output = self.twitter_api.search_trending_keywords_batched(query, ['a', 'b'], since_ids=since_ids)
+        self.assertEqual(len(self.sent_since_ids), 1)
+        return {label: ([r.url.rsplit('/', 1)[-1] for r in records], since_id)
+                for label, (records, since_id) in output.items()}
+
+    def test_batched_search_drops_what_each_label_already_has(self):
+        statuses = [status(250, 'b'), status(150, 'a b'), status(120, 'a'), status(90, 'a b')]
+
+        output = self.search_batched(statuses, {"a": 100, "b": 200})
+
+        # the query went back to 100 for a, b only gets what is newer than its own since_id
+        self.assertEqual(self.sent_since_ids, [100])
+        self.assertEqual(output, {"a": (['150', '120'], 150), "b": (['250'], 250)})
+
+    def test_batched_search_without_a_since_id_for_every_label(self):
+        statuses = [status(250, 'b'), status(150, 'a b'), status(90, 'a')]
+
+        output = self.search_batched(statuses, {"b": 200})
+
+        self.assertEqual(self.sent_since_ids, [None])
+        self.assertEqual(output, {"a": (['150', '90'], 150), "b": (['250'], 250)})
+
+    def test_batched_search_with_nothing_new_keeps_the_since_ids(self):
+        output = self.search_batched([status(150, 'a b')], {"a": 150, "b": 200})
+        self.assertEqual(output, {"a": ([], 150), "b": ([], 200)})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import gzip
+import json
+import unittest
+from unittest import mock
+
+from flask import Flask
+
+from tools import response_cache
+
+
+app = Flask(__name__)
+PAYLOAD = {"results": [{"label": "トレンド", "volume": [100]}], "status": "ok"}
+
+
+class ResponseCacheTest(unittest.TestCase):
+    def send(self, send, *args, headers=None):
+        with app.test_request_context('/', headers=headers or {}):
+            return send(*args)
+
+    def test_payload_is_only_gzipped_for_clients_that_take_it(self):
+        with mock.patch.object(response_cache.gzip, 'compress', wraps=gzip.compress) as compress:
+            plain = self.send(response_cache.send_payload, PAYLOAD)
+            self.assertEqual(compress.call_count, 0)
+            zipped = self.send(response_cache.send_payload, PAYLOAD, headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(compress.call_count, 1)
+
+        self.assertEqual(json.loads(plain.get_data().decode('utf-8')), PAYLOAD)
+        self.assertNotIn('Content-Encoding', plain.headers)
+        self.assertEqual(zipped.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(zipped.get_data()), plain.get_data())
+        self.assertEqual(plain.headers['ETag'], zipped.headers['ETag'])
+
+    def test_payload_etag_follows_the_content(self):
+        etag = self.send(response_cache.send_payload, PAYLOAD).headers['ETag']
+        self.assertEqual(self.send(response_cache.send_payload, dict(PAYLOAD)).headers['ETag'], etag)
+        self.assertNotEqual(self.send(response_cache.send_payload, dict(PAYLOAD, status='no')).headers['ETag'], etag)
+
+        not_modified = self.send(response_cache.send_payload, PAYLOAD, headers={'If-None-Match': etag})
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.get_data(), b'')
+
+    def test_prebuilt_sends_its_own_copies(self):
+        prebuilt = response_cache.prebuild(PAYLOAD)
+
+        with mock.patch.object(response_cache.gzip, 'compress') as compress:
+            zipped = self.send(response_cache.send_prebuilt, prebuilt, headers={'Accept-Encoding': 'gzip'})
+        compress.assert_not_called()
+        self.assertEqual(zipped.get_data(), prebuilt.gzip_body)
+        self.assertEqual(self.send(response_cache.send_prebuilt, prebuilt).get_data(), prebuilt.body)
+        self.assertEqual(self.send(response_cache.send_prebuilt, prebuilt,
+                                   headers={'If-None-Match': '"{}"'.format(prebuilt.etag)}).status_code, 304)
+
+
+if __name__ == '__main__':
+    unittest.main()
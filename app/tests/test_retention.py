@@ -0,0 +1,178 @@
+import copy
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from tools import db_utils, retention, segment_store
+from tools.db_ops import apply_ops
+from tools.retention import HOUR, DAY
+
+
+# a day boundary plus a bit, so the cutoffs have something to align
+NOW = 17778 * DAY + 30 * 60 + 5
+
+
+def snapshot(label, epoch, volume, url=None):
+    return {"label": label, "time": "", "epoch": epoch, "volume": [volume], "query": label,
+            "url": url or 'http://twitter.com/search?q=' + label}
+
+
+def every_15_mins(label, start, end, volume=lambda epoch: 100):
+    return [snapshot(label, epoch, volume(epoch)) for epoch in range(start, end, 15 * 60)]
+
+
+def trend_db(content):
+    return {
+        "trends": {
+            "include_hashtags": {"timestamp": "", "initial_timestamp": "", "content": content},
+            "exclude_hashtags": {"timestamp": "", "initial_timestamp": "", "content": []}
+        }
+    }
+
+
+@mock.patch.multiple(retention, RAW_DAYS=1, HOURLY_DAYS=3, DAILY_DAYS=0)
+class TrendHistoryTest(unittest.TestCase):
+    def adjusted(self, state, now=NOW):
+        state = copy.deepcopy(state)
+        apply_ops(state, retention.trend_history_ops(state, now=now))
+        return state['trends']['include_hashtags']
+
+    def test_cutoffs_are_aligned_to_the_bucket(self):
+        self.assertEqual(retention.cutoff(NOW, 1, HOUR), NOW - DAY - 30 * 60 - 5)
+        self.assertEqual(retention.cutoff(NOW, 3, DAY), NOW - 3 * DAY - 30 * 60 - 5)
+        self.assertIsNone(retention.cutoff(NOW, 0, DAY))
+
+    def test_expired_prefix_stops_at_the_first_record_to_keep(self):
+        records = [{"epoch": 1}, {"epoch": 5}, {"epoch": 2}, {"epoch": 9}]
+        self.assertEqual(retention.expired_prefix(records, 5), 1)
+        self.assertEqual(retention.expired_prefix(records, 10), 4)
+        self.assertEqual(retention.expired_prefix(records, None), 0)
+
+    def test_raw_snapshots_at_the_cutoff_are_kept(self):
+        raw_cutoff = retention.cutoff(NOW, 1, HOUR)
+        content = every_15_mins('a', raw_cutoff - HOUR, raw_cutoff + HOUR)
+        group = self.adjusted(trend_db(content))
+
+        self.assertEqual([r['epoch'] for r in group['content']], list(range(raw_cutoff, raw_cutoff + HOUR, 15 * 60)))
+        self.assertEqual([(r['epoch'], r['samples']) for r in group['hourly']], [(raw_cutoff - HOUR, 4)])
+        self.assertNotIn('daily', group)
+
+    def test_hourly_aggregates(self):
+        start = retention.cutoff(NOW, 1, HOUR) - HOUR
+        volumes = {start: 10, start + 900: 40, start + 1800: 0, start + 2700: 30}
+        content = every_15_mins('a', start, start + HOUR, volume=volumes.get) + [snapshot('b', start + 600, 7)]
+        content.sort(key=lambda r: r['epoch'])
+        content[-1]['url'] = 'latest'
+
+        hourly = self.adjusted(trend_db(content))['hourly']
+
+        self.assertEqual([r['label'] for r in hourly], ['a', 'b'])
+        a, b = hourly
+        self.assertEqual((a['volume_max'], a['volume_avg'], a['samples']), (40, 20, 4))
+        self.assertEqual((a['first_seen'], a['last_seen'], a['url']), (start, start + 2700, 'latest'))
+        self.assertEqual((a['resolution'], a['time']), ('hourly', '2018-09-02 23:00:00+0000'))
+        self.assertEqual((b['volume_max'], b['volume_avg'], b['samples']), (7, 7, 1))
+
+    def test_daily_aggregates_weigh_hours_by_their_samples(self):
+        day = retention.cutoff(NOW, 3, DAY) - DAY
+        hourly = retention.rollup(every_15_mins('a', day, day + HOUR, volume=lambda e: 10), HOUR, 'hourly') + \
+            retention.rollup([snapshot('a', day + 5 * HOUR, 40)], HOUR, 'hourly')
+
+        daily = retention.rollup(hourly, DAY, 'daily')
+
+        self.assertEqual(len(daily), 1)
+        self.assertEqual((daily[0]['volume_max'], daily[0]['volume_avg'], daily[0]['samples']), (40, 16, 5))
+        self.assertEqual((daily[0]['first_seen'], daily[0]['last_seen']), (day, day + 5 * HOUR))
+
+    def test_snapshots_go_down_every_expired_tier_at_once(self):
+        # a collector that was off for a week: the oldest snapshots skip straight to daily
+        start = retention.cutoff(NOW, 3, DAY) - DAY
+        content = every_15_mins('a', start, NOW)
+        group = self.adjusted(trend_db(content))
+
+        self.assertEqual([r['epoch'] for r in group['daily']], [start])
+        self.assertEqual(group['daily'][0]['samples'], 96)
+        self.assertEqual(group['hourly'][0]['epoch'], start + DAY)
+        self.assertEqual(group['hourly'][-1]['epoch'], retention.cutoff(NOW, 1, HOUR) - HOUR)
+        self.assertEqual(sum(r['samples'] for r in group['daily'] + group['hourly']) + len(group['content']),
+                         len(content))
+
+    def test_a_second_rollup_changes_nothing(self):
+        state = trend_db(every_15_mins('a', NOW - 5 * DAY, NOW) + every_15_mins('b', NOW - 2 * DAY, NOW))
+        apply_ops(state, retention.trend_history_ops(state, now=NOW))
+        self.assertEqual(retention.trend_history_ops(state, now=NOW), [])
+
+        # 15 mins later only what expired meanwhile moves
+        later = copy.deepcopy(state)
+        apply_ops(later, retention.trend_history_ops(later, now=NOW + 15 * 60))
+        self.assertEqual(later, state)
+
+    def test_daily_tier_expires_when_configured(self):
+        state = trend_db(every_15_mins('a', NOW - 10 * DAY, NOW))
+        with mock.patch.object(retention, 'DAILY_DAYS', 5):
+            group = self.adjusted(state)
+        self.assertEqual(group['daily'][0]['epoch'], retention.cutoff(NOW, 5, DAY))
+
+
+@mock.patch.multiple(retention, RAW_DAYS=1, HOURLY_DAYS=3, DAILY_DAYS=0)
+class AdjustDbTest(unittest.TestCase):
+    storage_mode = 'json'
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.mode = db_utils.STORAGE_MODE
+        db_utils.STORAGE_MODE = self.storage_mode
+        self.path = os.path.join(self.folder, 'daily_database.json')
+        self.images = os.path.join(self.folder, 'daily_trend_search_database.json')
+
+    def tearDown(self):
+        db_utils.STORAGE_MODE = self.mode
+        for path in (self.path, self.images):
+            db_utils.invalidate_snapshot(path)
+            db_utils._indexes.pop(db_utils._snapshot_key(path), None)
+        shutil.rmtree(self.folder)
+
+    def write(self, path, state):
+        with open(path, 'w') as f:
+            json.dump(state, f)
+
+    def test_stored_rollup_matches_the_ops(self):
+        state = trend_db(every_15_mins('a', NOW - 5 * DAY, NOW) + every_15_mins('b', NOW - 2 * DAY, NOW))
+        self.write(self.path, state)
+        expected = copy.deepcopy(state)
+        apply_ops(expected, retention.trend_history_ops(expected, now=NOW))
+
+        db_utils.adjust_db(self.path, now=NOW)
+        self.assertEqual(db_utils.load_db(self.path), expected)
+        # and once more, nothing left to roll up
+        db_utils.adjust_db(self.path, now=NOW)
+        self.assertEqual(db_utils.load_db(self.path), expected)
+
+        if self.storage_mode == 'segments':
+            self.assertTrue(segment_store.compact(self.path))
+            self.assertEqual(db_utils.load_db(self.path), expected)
+
+    def test_images_db_drops_the_oldest_trends_over_capacity(self):
+        trends = [{"label": str(i), "tweets": [{"id": j} for j in range(10)]} for i in range(40)]
+        self.write(self.images, {"trends": trends})
+
+        db_utils.adjust_images_db(self.images, max_capacity=400)
+        self.assertEqual(len(db_utils.load_db(self.images)['trends']), 40)
+
+        db_utils.adjust_images_db(self.images, max_capacity=399, num_to_delete=30)
+        self.assertEqual(db_utils.load_db(self.images)['trends'], trends[30:])
+
+
+class SegmentsAdjustDbTest(AdjustDbTest):
+    storage_mode = 'segments'
+
+
+class SqliteAdjustDbTest(AdjustDbTest):
+    storage_mode = 'sqlite'
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+
+from tools import search_batch
+
+
+class BuildQueriesTest(unittest.TestCase):
+    def test_at_most_batch_size_labels_per_query(self):
+        queries = search_batch.build_queries(['a', 'b', 'c', 'd', 'e'], batch_size=2)
+        self.assertEqual(queries, [('"a" OR "b"', ['a', 'b']),
+                                   ('"c" OR "d"', ['c', 'd']),
+                                   ('"e"', ['e'])])
+
+    def test_queries_stay_under_max_chars(self):
+        labels = ['label{:02d}'.format(i) * 3 for i in range(20)]
+        queries = search_batch.build_queries(labels, batch_size=10, max_chars=100)
+        self.assertTrue(all(len(query) <= 100 for query, group in queries))
+        self.assertEqual([label for query, group in queries for label in group], labels)
+        self.assertGreater(len(queries), 2)
+
+    def test_quotes_in_labels_are_dropped(self):
+        self.assertEqual(search_batch.build_queries(['say "hi"'], batch_size=5), [('"say hi"', ['say "hi"'])])
+
+
+class PlanSearchesTest(unittest.TestCase):
+    labels = ['t{}'.format(i) for i in range(12)]
+
+    def test_everything_searched_on_its_own_when_it_fits(self):
+        self.assertEqual(search_batch.plan_searches(self.labels, 12, batch_size=5), (self.labels, []))
+
+    def test_only_what_does_not_fit_is_batched(self):
+        singles, batches = search_batch.plan_searches(self.labels, 8, batch_size=5)
+        covered = singles + [label for query, group in batches for label in group]
+
+        self.assertEqual(covered, self.labels)
+        self.assertLessEqual(len(singles) + len(batches), 8)
+        # as many single searches as the budget allows
+        self.assertEqual(len(singles), 7)
+
+    def test_labels_that_do_not_fit_even_batched_are_left_out(self):
+        singles, batches = search_batch.plan_searches(self.labels, 2, batch_size=5)
+        covered = singles + [label for query, group in batches for label in group]
+
+        self.assertEqual(singles, [])
+        self.assertEqual(len(batches), 2)
+        self.assertEqual(covered, self.labels[:10])
+
+    def test_batch_size_1_turns_it_off(self):
+        self.assertEqual(search_batch.plan_searches(self.labels, 5, batch_size=1), (self.labels[:5], []))
+        self.assertEqual(search_batch.plan_searches(self.labels, 0, batch_size=5), ([], []))
+
+
+class DemultiplexTest(unittest.TestCase):
+    def test_statuses_go_to_the_labels_they_mention(self):
+        labels = ['#ポケモン', 'ＡＢＣ', 'sun']
+        tweets = [
+            {"id": 1, "text": "今日のポケモン", "hashtags": [{"text": "ポケモン"}]},
+            {"id": 2, "text": "abc and SUN", "hashtags": []},
+            {"id": 3, "text": "nothing here", "hashtags": {}},
+            {"id": 4, "text": None, "hashtags": [{"text": "Sun"}]},
+        ]
+        output = search_batch.demultiplex(tweets, labels)
+
+        self.assertEqual({label: [t['id'] for t in matched] for label, matched in output.items()},
+                         {'#ポケモン': [1], 'ＡＢＣ': [2], 'sun': [2, 4]})
+
+    def test_every_label_gets_an_entry(self):
+        self.assertEqual(search_batch.demultiplex([], ['a', 'b']), {'a': [], 'b': []})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from tools import search_cache
+
+
+class SearchCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.ttl, self.size = search_cache.TTL_MINS, search_cache.MAX_LABELS
+        search_cache.TTL_MINS, search_cache.MAX_LABELS = 10, 3
+        search_cache.clear()
+
+    def tearDown(self):
+        search_cache.TTL_MINS, search_cache.MAX_LABELS = self.ttl, self.size
+        search_cache.clear()
+
+    def test_hit_within_the_ttl_miss_after(self):
+        search_cache.put('a', 'result', now=1000)
+        self.assertEqual(search_cache.get('a', now=1000 + 599), 'result')
+        self.assertIsNone(search_cache.get('a', now=1000 + 600))
+        # past the ttl it can still stand in for a trend the window has no room for
+        self.assertEqual(search_cache.get_stale('a'), 'result')
+        self.assertIsNone(search_cache.get('b', now=1000))
+
+        stats = search_cache.get_stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['stale_hits']), (1, 2, 1))
+        # the stale hit stood in for a search that wasn't going to be made, it saved nothing
+        self.assertEqual(stats['searches_saved'], 1)
+        self.assertEqual(stats['hit_rate'], 1 / 3)
+
+    def test_least_recently_used_goes_first(self):
+        for label in ('a', 'b', 'c'):
+            search_cache.put(label, label, now=1000)
+        # a is used again, so b is the oldest now
+        search_cache.get('a', now=1001)
+        search_cache.put('d', 'd', now=1002)
+
+        self.assertIsNone(search_cache.get_stale('b'))
+        for label in ('a', 'c', 'd'):
+            self.assertEqual(search_cache.get_stale(label), label)
+        self.assertEqual(search_cache.get_stats()['evictions'], 1)
+        self.assertEqual(search_cache.get_stats()['labels'], 3)
+
+    def test_put_again_refreshes_the_ttl(self):
+        search_cache.put('a', 'old', now=1000)
+        search_cache.put('a', 'new', now=1500)
+        self.assertEqual(search_cache.get('a', now=2000), 'new')
+
+    def test_forget_since(self):
+        search_cache.put('a', 'a', now=1000)
+        search_cache.put('b', 'b', now=2000)
+        search_cache.forget_since(2000)
+        self.assertEqual(search_cache.get('a', now=1001), 'a')
+        self.assertIsNone(search_cache.get_stale('b'))
+
+    def test_ttl_0_turns_it_off(self):
+        search_cache.TTL_MINS = 0
+        self.assertFalse(search_cache.enabled())
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+class TrendSearchCacheTest(unittest.TestCase):
+    """
+    the cache as get_top_trends_from_twitter_api uses it, against tools.fake_twitter
+    """
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.folder = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.folder, 'db'))
+        for name in ('daily_database.json', 'daily_trend_search_database.json', 'daily_top_rt_database.json'):
+            with open(os.path.join(self.folder, 'db', name), 'w') as f:
+                f.write('{}')
+        # twitter_api finds its dbs relative to the working directory when it is imported
+        os.chdir(self.folder)
+        from tools import twitter_api, rate_limit
+        from tools.fake_twitter import FakeTwitterApi
+        self.twitter_api, self.budget = twitter_api, rate_limit.search_budget
+
+        self.api = twitter_api.api
+        self.fake = FakeTwitterApi(num_trends=20, search_limit=5)
+        twitter_api.set_api(self.fake)
+        self.saved_budget = self.budget.limit, self.budget.remaining
+        search_cache.clear()
+
+    def tearDown(self):
+        self.twitter_api.set_api(self.api)
+        self.budget.limit, self.budget.remaining = self.saved_budget
+        search_cache.clear()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.folder)
+
+    def trends(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            output_json, images_json = self.twitter_api.get_top_trends_from_twitter_api(since_ids={})
+        return json.loads(images_json)
+
+    def test_skipped_searches_are_not_cached(self):
+        # the plan counted on more searches than the budget has by the time they run
+        # (e.g. another stage used some meanwhile), so all but 3 are skipped
+        self.budget.limit = self.budget.remaining = 3
+        self.twitter_api.plan, plan = (lambda family, wanted: wanted), self.twitter_api.plan
+        try:
+            trends = self.trends()
+        finally:
+            self.twitter_api.plan = plan
+
+        self.assertEqual(self.fake.calls['search'], 3)
+        self.assertEqual(len(trends), 20)
+        self.assertEqual(search_cache.get_stats()['labels'], 3)
+
+    def test_twitter_saying_the_window_is_used_up_skips_the_search(self):
+        # the local budget thinks there is plenty left, e.g. after a restart in the middle of a window
+        self.budget.limit = self.budget.remaining = 10 ** 6
+        self.twitter_api.update_from_api, update_from_api = (lambda api, family: None), self.twitter_api.update_from_api
+        try:
+            trends = self.trends()
+        finally:
+            self.twitter_api.update_from_api = update_from_api
+
+        self.assertEqual(self.budget.available(), 0)
+        self.assertEqual(len([t for t in trends if t['tweets']]), search_cache.get_stats()['labels'])
+        self.assertLess(search_cache.get_stats()['labels'], len(trends))
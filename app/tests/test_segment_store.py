@@ -0,0 +1,97 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from tools import segment_store
+from tools.db_ops import append_op, upsert_op, trim_op, set_op
+
+
+class SegmentStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'db.json')
+        with open(self.path, 'w') as f:
+            json.dump({"top_posts": [], "timestamp": "1999-01-01 00:00:00+0000"}, f)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def write(self, *ops):
+        segment_store.append_segment(list(ops), self.path)
+
+    def test_replays_segments_in_order(self):
+        self.write(append_op(['top_posts'], [{"url": "a", "likes": 1}, {"url": "b", "likes": 2}]))
+        self.write(upsert_op(['top_posts'], [{"url": "a", "likes": 10}, {"url": "c", "likes": 3}], fields=['likes']))
+        self.write(trim_op(['top_posts'], 1), set_op(['timestamp'], '2018-09-03 10:38:28+0000'))
+
+        state = segment_store.load_segmented_db(self.path)
+        self.assertEqual(state['top_posts'], [{"url": "b", "likes": 2}, {"url": "c", "likes": 3}])
+        self.assertEqual(state['timestamp'], '2018-09-03 10:38:28+0000')
+        self.assertEqual([seq for seq, path in segment_store.list_segments(self.path)], [1, 2, 3])
+
+    def test_compaction_keeps_the_state_and_removes_segments(self):
+        for i in range(5):
+            self.write(append_op(['top_posts'], [{"url": str(i)}]))
+        before = segment_store.load_segmented_db(self.path)
+
+        self.assertTrue(segment_store.compact(self.path))
+        self.assertEqual(segment_store.list_segments(self.path), [])
+        self.assertEqual(segment_store.load_segmented_db(self.path), before)
+        self.assertTrue(os.path.exists(self.path + '.bak'))
+
+        # numbering goes on after the compacted segments
+        self.write(append_op(['top_posts'], [{"url": "5"}]))
+        self.assertEqual([seq for seq, path in segment_store.list_segments(self.path)], [6])
+        self.assertEqual([r['url'] for r in segment_store.load_segmented_db(self.path)['top_posts']],
+                         ['0', '1', '2', '3', '4', '5'])
+
+    def test_segments_already_in_the_base_are_not_applied_twice(self):
+        self.write(append_op(['top_posts'], [{"url": "a"}]))
+        self.write(append_op(['top_posts'], [{"url": "b"}]))
+        segments = segment_store.list_segments(self.path)
+        # a compaction that died after replacing the base, before deleting its segments
+        with open(self.path, 'w') as f:
+            json.dump({"top_posts": [{"url": "a"}, {"url": "b"}], "timestamp": "x",
+                       segment_store.SEGMENT_SEQ_KEY: segments[-1][0]}, f)
+
+        self.assertEqual([r['url'] for r in segment_store.load_segmented_db(self.path)['top_posts']], ['a', 'b'])
+
+    def test_reader_starts_over_when_a_compaction_removed_its_segments(self):
+        self.write(append_op(['top_posts'], [{"url": "a"}]))
+        self.write(append_op(['top_posts'], [{"url": "b"}]))
+
+        original_replay = segment_store._replay
+        compacted = []
+
+        def replay_after_compaction(state, segments, base_seq):
+            # another process compacts between this reader's listing and its reading the segments
+            if not compacted:
+                compacted.append(True)
+                segment_store.compact(self.path)
+            return original_replay(state, segments, base_seq)
+
+        segment_store._replay = replay_after_compaction
+        try:
+            state = segment_store.load_segmented_db(self.path)
+        finally:
+            segment_store._replay = original_replay
+
+        self.assertEqual(segment_store.list_segments(self.path), [])
+        self.assertEqual([r['url'] for r in state['top_posts']], ['a', 'b'])
+
+    def test_compaction_of_one_db_does_not_block_another(self):
+        other = os.path.join(self.folder, 'other.json')
+        shutil.copy(self.path, other)
+        self.write(append_op(['top_posts'], [{"url": "a"}]))
+        segment_store.append_segment([append_op(['top_posts'], [{"url": "b"}])], other)
+
+        lock = segment_store._compaction_lock(self.path)
+        with lock:
+            self.assertFalse(segment_store.compact(self.path))
+            self.assertTrue(segment_store.compact(other))
+
+
+if __name__ == '__main__':
+    unittest.main()
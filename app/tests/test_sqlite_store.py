@@ -0,0 +1,86 @@
+import copy
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from tools import sqlite_store
+from tools.db_ops import apply_ops, append_op, upsert_op, trim_op, set_op
+
+
+def trend(label, epoch, volume=100):
+    return {"label": label, "time": "", "epoch": epoch, "volume": [volume]}
+
+
+class SqliteStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'daily_database.json')
+        self.state = {
+            "trends": {
+                "include_hashtags": {
+                    "timestamp": "2018-09-03 10:00:00+0000",
+                    "initial_timestamp": "2018-09-01 00:00:00+0000",
+                    "content": [trend('a', 1000), trend('b', 1000), trend('a', 2000, 150)]
+                },
+                "exclude_hashtags": {"timestamp": "1999-01-01 00:00:00+0000", "content": []}
+            },
+            "hashtags": {"timestamp": "1999-01-01 00:00:00+0000", "content": []}
+        }
+        with open(self.path, 'w') as f:
+            json.dump(self.state, f)
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_import_round_trip(self):
+        self.assertEqual(sqlite_store.import_json_db(self.path), 3)
+        self.assertEqual(sqlite_store.load_sqlite_db(self.path), self.state)
+
+    def test_ops_give_the_same_state_as_in_json_mode(self):
+        sqlite_store.import_json_db(self.path)
+        content = ['trends', 'include_hashtags', 'content']
+        ops = [
+            append_op(content, [trend('c', 3000), trend('d', 3000)]),
+            append_op(content, [trend('a', 3000, 200)], unique_key='label'),
+            trim_op(content, 1),
+            set_op(['trends', 'include_hashtags', 'timestamp'], "2018-09-03 11:00:00+0000"),
+        ]
+        sqlite_store.apply_ops_sqlite(copy.deepcopy(ops), self.path)
+
+        self.assertEqual(sqlite_store.load_sqlite_db(self.path), apply_ops(copy.deepcopy(self.state), ops))
+
+    def test_upsert_updates_in_place(self):
+        path = os.path.join(self.folder, 'daily_top_rt_database.json')
+        posts = [{"url": "u1", "likes": 1, "text": "one"}, {"url": "u2", "likes": 2, "text": "two"}]
+        with open(path, 'w') as f:
+            json.dump({"top_posts": posts}, f)
+        sqlite_store.import_json_db(path)
+
+        sqlite_store.apply_ops_sqlite([upsert_op(['top_posts'], [{"url": "u1", "likes": 10, "text": "new"},
+                                                                 {"url": "u3", "likes": 3, "text": "three"}],
+                                                 fields=['likes'])], path)
+
+        self.assertEqual(sqlite_store.load_sqlite_db(path)['top_posts'], [
+            {"url": "u1", "likes": 10, "text": "one"},
+            {"url": "u2", "likes": 2, "text": "two"},
+            {"url": "u3", "likes": 3, "text": "three"},
+        ])
+
+    def test_query_records(self):
+        sqlite_store.import_json_db(self.path)
+        content = ['trends', 'include_hashtags', 'content']
+
+        rows = sqlite_store.query_records(self.path, content, since=1000, until=2000)
+        self.assertEqual([(epoch, key) for epoch, key, record in rows], [(1000, 'a'), (1000, 'b')])
+
+        rows = sqlite_store.query_records(self.path, content, label='a')
+        self.assertEqual([record['volume'] for epoch, key, record in rows], [[100], [150]])
+
+        rows = sqlite_store.query_records(self.path, content, after=(1000, 'a'), limit=1)
+        self.assertEqual([(epoch, key) for epoch, key, record in rows], [(1000, 'b')])
+
+
+if __name__ == '__main__':
+    unittest.main()
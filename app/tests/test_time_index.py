@@ -0,0 +1,105 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from tools import db_utils, time_index
+from tools.db_ops import trim_op
+
+
+class PagingTest(unittest.TestCase):
+    storage_mode = 'json'
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.mode = db_utils.STORAGE_MODE
+        db_utils.STORAGE_MODE = self.storage_mode
+
+        self.top_posts = os.path.join(self.folder, 'daily_top_rt_database.json')
+        # three posts per second, stored newest url first so list order isn't time order
+        posts = [{"url": "https://twitter.com/i/{:02d}".format(i), "timestamp": {"created_epoch": 1000 + i // 3}}
+                 for i in reversed(range(30))]
+        with open(self.top_posts, 'w') as f:
+            json.dump({"top_posts": posts}, f)
+
+        self.trends = os.path.join(self.folder, 'daily_database.json')
+        # trends of one snapshot share an epoch, some labels have a '/'
+        snapshots = [{"label": "{}/{}".format(label, t), "epoch": 2000 + t, "volume": [t]}
+                     for t in range(4) for label in ('トレンド', '#tag', 'a b')]
+        with open(self.trends, 'w') as f:
+            json.dump({"trends": {"include_hashtags": {"content": snapshots}}}, f)
+
+    def tearDown(self):
+        db_utils.STORAGE_MODE = self.mode
+        db_utils.invalidate_snapshot(self.top_posts)
+        db_utils.invalidate_snapshot(self.trends)
+        shutil.rmtree(self.folder)
+
+    def page_all(self, path, list_path, limit, between_pages=None, **kwargs):
+        records, cursor = time_index.page_records(path, list_path, limit=limit, **kwargs)
+        pages = [records]
+        while cursor:
+            if between_pages:
+                between_pages()
+                between_pages = None
+            records, cursor = time_index.page_records(path, list_path, cursor=cursor, limit=limit, **kwargs)
+            pages.append(records)
+        return pages
+
+    def test_pages_are_in_time_order(self):
+        pages = self.page_all(self.top_posts, ['top_posts'], limit=7)
+        urls = [r['url'] for page in pages for r in page]
+        self.assertEqual([len(page) for page in pages], [7, 7, 7, 7, 2])
+        self.assertEqual(urls, ["https://twitter.com/i/{:02d}".format(i) for i in range(30)])
+
+    def test_since_and_until(self):
+        records, cursor = time_index.page_records(self.top_posts, ['top_posts'], since=1002, until=1004)
+        self.assertEqual([r['url'][-2:] for r in records], ['06', '07', '08', '09', '10', '11'])
+        self.assertIsNone(cursor)
+
+    def test_paging_across_a_trim(self):
+        # the update between two pages drops the oldest stored records (the front of the list),
+        # which moves every record that is left
+        def trim():
+            db_utils.apply_db_ops([trim_op(['top_posts'], 5)], database_path=self.top_posts)
+
+        pages = self.page_all(self.top_posts, ['top_posts'], limit=10, between_pages=trim)
+        urls = [r['url'] for page in pages for r in page]
+        self.assertEqual(len(urls), len(set(urls)))
+        # the trim took 29..25 off the stored list, 20..29 were on the first page already
+        self.assertEqual(urls, ["https://twitter.com/i/{:02d}".format(i) for i in range(25)])
+
+    def test_trends_of_one_snapshot_across_pages(self):
+        content = ['trends', 'include_hashtags', 'content']
+
+        def trim():
+            db_utils.apply_db_ops([trim_op(content, 2)], database_path=self.trends)
+
+        pages = self.page_all(self.trends, content, limit=4, between_pages=trim)
+        seen = [(r['epoch'], r['label']) for page in pages for r in page]
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(seen, sorted(seen))
+        self.assertEqual(len(seen), 12)
+
+
+class SqlitePagingTest(PagingTest):
+    storage_mode = 'sqlite'
+
+
+class CursorTest(unittest.TestCase):
+    def test_round_trip(self):
+        for key in ('https://twitter.com/x/status/1?s=20', 'トレンド/#tag', '', 'a_b'):
+            cursor = time_index.encode_cursor(1535967508, key)
+            self.assertNotIn('/', cursor)
+            self.assertEqual(time_index.decode_cursor(cursor), (1535967508, key))
+
+    def test_not_a_cursor(self):
+        for cursor in ('nope', '12_!!', 'x_YQ'):
+            with self.assertRaises(ValueError):
+                time_index.decode_cursor(cursor)
+        self.assertIsNone(time_index.decode_cursor(''))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import datetime
+import random
+import unittest
+
+from tools import time_utils
+from tools.time_utils import str_2_datetime, str_2_epoch, record_epoch, records_after
+
+
+class FastParserTest(unittest.TestCase):
+    def samples(self):
+        rnd = random.Random(0)
+        for _ in range(300):
+            yield datetime.datetime(rnd.randrange(1999, 2031), rnd.randrange(1, 13), rnd.randrange(1, 29),
+                                    rnd.randrange(24), rnd.randrange(60), rnd.randrange(60),
+                                    tzinfo=datetime.timezone(datetime.timedelta(minutes=rnd.choice([0, 540, -300, 330]))))
+
+    def assert_same_as_strptime(self, text, input_format):
+        expected = datetime.datetime.strptime(text, input_format)
+        parsed = str_2_datetime(text, input_format=input_format)
+        self.assertEqual(parsed, expected)
+        self.assertEqual(parsed.tzinfo is None, expected.tzinfo is None)
+        self.assertEqual(parsed.utcoffset(), expected.utcoffset())
+
+    def test_every_fixed_format_matches_strptime(self):
+        for dt in self.samples():
+            for input_format in time_utils._fast_parsers:
+                self.assert_same_as_strptime(dt.strftime(input_format), input_format)
+
+    def test_known_values(self):
+        self.assert_same_as_strptime('2018-09-03 10:38:28+0900', time_utils.time_format_full_with_timezone)
+        self.assert_same_as_strptime('Mon Sep 03 10:38:28 +0000 2018', time_utils.time_format_twitter_created_at)
+        self.assert_same_as_strptime('2018-08-21T08:00:00Z', time_utils.time_format_twitter_trends)
+        self.assertEqual(str_2_epoch('2018-09-03 10:38:28+0000'), 1535971108)
+
+    def test_other_formats_still_go_through_strptime(self):
+        self.assert_same_as_strptime('03/09/2018', '%d/%m/%Y')
+        # not the exact shape the fast parser takes, strptime still accepts it
+        self.assert_same_as_strptime('2018-9-3', time_utils.time_format_date)
+
+    def test_bad_input_raises_value_error_like_strptime(self):
+        for text, input_format in [('2018-09-03 10:38:28', time_utils.time_format_full_with_timezone),
+                                   ('2018-13-03 10:38:28+0000', time_utils.time_format_full_with_timezone),
+                                   ('2018-09-03T10:38:28+0000', time_utils.time_format_full_with_timezone),
+                                   ('Xyz Sep 03 10:38:28 +0000 2018', time_utils.time_format_twitter_created_at),
+                                   ('Mon Foo 03 10:38:28 +0000 2018', time_utils.time_format_twitter_created_at),
+                                   ('2018-+9-03 10:38:28+0000', time_utils.time_format_full_with_timezone),
+                                   ('2018-09-03 10:38:28+09:0', time_utils.time_format_full_with_timezone),
+                                   ('Mon Sep 03 10-38-28 +0000 2018', time_utils.time_format_twitter_created_at),
+                                   ('2018-+9-03', time_utils.time_format_date),
+                                   ('', time_utils.time_format_twitter_trends)]:
+            with self.assertRaises(ValueError, msg=text):
+                datetime.datetime.strptime(text, input_format)
+            with self.assertRaises(ValueError, msg=text):
+                str_2_datetime(text, input_format=input_format)
+
+
+class RecordEpochTest(unittest.TestCase):
+    def test_stored_epochs_come_first(self):
+        self.assertEqual(record_epoch({"epoch": 5, "time": "2018-09-03 10:38:28+0000"}), 5)
+        self.assertEqual(record_epoch({"timestamp": {"created_epoch": 7, "created": "2018-09-03 10:38:28+0000"}}), 7)
+
+    def test_parses_the_display_strings_otherwise(self):
+        self.assertEqual(record_epoch({"time": "2018-09-03 10:38:28+0000"}), 1535971108)
+        self.assertEqual(record_epoch({"timestamp": {"created": "2018-09-03 10:38:28+0000"}}), 1535971108)
+        self.assertEqual(record_epoch({"time": "not a time"}), 0)
+        self.assertEqual(record_epoch(None), 0)
+
+    def test_records_after(self):
+        records = [{"epoch": e} for e in (1, 2, 3, 3, 4)]
+        self.assertEqual(records_after(records, 3), [{"epoch": 4}])
+        self.assertEqual(records_after(records, 0), records)
+        self.assertEqual(records_after(records, 4), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
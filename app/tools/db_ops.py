@@ -0,0 +1,186 @@
+# ------------
+# DB OPERATIONS
+# ------------
+# a write to a db is described as a list of small operations on the json document,
+# so the same change can be applied to an in-memory state (json mode)
+# or appended as a record to a segment file (segments mode) without rewriting history.
+#
+# path is a list of keys from the root of the db, e.g. ['trends', 'include_hashtags', 'content']
+
+
+def set_op(path, value):
+    return {"op": "set", "path": list(path), "value": value}
+
+
+def append_op(path, records, unique_key=None):
+    """
+    appends records to the list at path.
+    with unique_key, stored records with the same value for that key are removed first
+    (the new version goes to the end of the list)
+    """
+    op = {"op": "append", "path": list(path), "records": list(records)}
+    if unique_key:
+        op['unique_key'] = unique_key
+    return op
+
+
+def upsert_op(path, records, key='url', fields=None):
+    """
+    updates records already in the list at path (matched on key) in place and appends the rest.
+    :param fields: dotted field names to copy onto the stored record, e.g. 'timestamp.last_checked'.
+                   None replaces the stored record entirely
+    """
+    op = {"op": "upsert", "path": list(path), "records": list(records), "key": key}
+    if fields:
+        op['fields'] = list(fields)
+    return op
+
+
+def trim_op(path, count):
+    """
+    drops the first (oldest) count records of the list at path
+    """
+    return {"op": "trim", "path": list(path), "count": count}
+
+
+def _resolve(state, path):
+    container = state
+    for k in path[:-1]:
+        container = container[k]
+    return container, path[-1]
+
+
+def merge_fields(stored, record, fields):
+    """
+    copies the dotted fields of record onto stored, in place
+    """
+    for field in fields:
+        parts = field.split('.')
+        src = record
+        try:
+            for p in parts:
+                src = src[p]
+        except (KeyError, TypeError):
+            continue
+
+        dst = stored
+        for p in parts[:-1]:
+            if not isinstance(dst.get(p), dict):
+                dst[p] = {}
+            dst = dst[p]
+        dst[parts[-1]] = src
+    return stored
+
+
+class ListIndex(object):
+    """
+    {unique value: position} of one list, built once and then kept up to date by the ops on that list,
+    so an upsert costs O(new records) after the first one.
+    trims from the front only move the offset the positions are counted from
+    """
+    __slots__ = ('unique_key', 'positions', 'offset')
+
+    def __init__(self, records, unique_key):
+        self.unique_key = unique_key
+        self.offset = 0
+        self.positions = {}
+        for i, d in enumerate(records):
+            self.positions[d.get(unique_key)] = i
+
+    def get(self, value):
+        position = self.positions.get(value)
+        return None if position is None else position - self.offset
+
+    def add(self, records, start):
+        for i, d in enumerate(records):
+            self.positions[d.get(self.unique_key)] = self.offset + start + i
+
+    def trim(self, removed):
+        for i, d in enumerate(removed):
+            value = d.get(self.unique_key)
+            # a later record with the same value keeps its entry
+            if self.positions.get(value) == self.offset + i:
+                del self.positions[value]
+        self.offset += len(removed)
+
+
+def _get_index(indexes, path, container, key, unique_key):
+    index_key = (tuple(path), unique_key)
+    index = indexes.get(index_key)
+    if index is None:
+        index = indexes[index_key] = ListIndex(container.get(key) or [], unique_key)
+    return index
+
+
+def apply_op(state, op, indexes=None):
+    """
+    :param state:
+    :param op:
+    :param indexes: dict shared between the ops of one batch (see apply_ops)
+    :return:
+    """
+    if indexes is None:
+        indexes = {}
+    container, key = _resolve(state, op['path'])
+    kind = op['op']
+    path = tuple(op['path'])
+    # indexes of this very list, they follow appends and trims instead of being built again
+    kept = [index for (index_path, unique_key), index in indexes.items() if index_path == path]
+
+    if kind == "set":
+        container[key] = op['value']
+        kept = []
+
+    elif kind == "append":
+        current = container.get(key) or []
+        unique_key = op.get('unique_key')
+        if unique_key:
+            # one pass over the stored list instead of one pass per new record
+            new_keys = set(r.get(unique_key) for r in op['records'])
+            current = [d for d in current if d.get(unique_key) not in new_keys]
+            # records were taken out of the middle
+            kept = []
+        for index in kept:
+            index.add(op['records'], len(current))
+        current.extend(op['records'])
+        container[key] = current
+
+    elif kind == "upsert":
+        current = container.get(key)
+        if current is None:
+            current = container[key] = []
+        index = _get_index(indexes, op['path'], container, key, op['key'])
+        fields = op.get('fields')
+
+        for r in op['records']:
+            position = index.get(r.get(op['key']))
+            if position is None:
+                index.add([r], len(current))
+                current.append(r)
+            elif fields:
+                merge_fields(current[position], r, fields)
+            else:
+                current[position] = r
+
+    elif kind == "trim":
+        for index in kept:
+            index.trim(container[key][:op['count']])
+        container[key] = container[key][op['count']:]
+
+    else:
+        raise ValueError('unknown db operation: {}'.format(kind))
+
+    if kind != "upsert":
+        # other lists below this path may have been replaced, those indexes get built again when next needed
+        for k in [k for k, index in indexes.items() if k[0][:len(path)] == path and index not in kept]:
+            del indexes[k]
+
+    return state
+
+
+def apply_ops(state, ops, indexes=None):
+    if indexes is None:
+        indexes = {}
+    for op in ops:
+        apply_op(state, op, indexes=indexes)
+    return state
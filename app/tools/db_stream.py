@@ -0,0 +1,154 @@
+import json
+import zlib
+
+from flask import Response
+
+
+# ------------------
+# STREAMED DB EXPORT
+# ------------------
+# /db used to jsonify the whole db into one pretty printed string per request.
+# here the db is written out a record at a time and handed to the client in ~64KB chunks,
+# so a request only ever holds one chunk on top of the (shared) snapshot.
+
+STREAM_CHUNK_BYTES = 64 * 1024
+
+# the record lists that make up most of each db, streamed one line per record in ndjson mode
+NDJSON_RECORDS = {
+    "main": ['trends', 'include_hashtags', 'content'],
+    "trends": ['trends'],
+    "top_posts": ['top_posts'],
+}
+
+
+def _dumps(obj):
+    # whole records still go through the fast C encoder
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+
+def iter_json(obj):
+    """
+    yields the json text of obj piece by piece. dicts and lists are opened up,
+    everything inside a list is encoded one item at a time
+    """
+    if isinstance(obj, dict):
+        yield '{'
+        first = True
+        for k, v in obj.items():
+            if not first:
+                yield ','
+            first = False
+            yield _dumps(str(k)) + ':'
+            for piece in iter_json(v):
+                yield piece
+        yield '}'
+    elif isinstance(obj, list):
+        yield '['
+        for i, item in enumerate(obj):
+            if i:
+                yield ','
+            yield _dumps(item)
+        yield ']'
+    elif hasattr(obj, 'iter_raw'):
+        # records of a memory mapped snapshot, already json
+        yield '['
+        for i, raw in enumerate(obj.iter_raw()):
+            if i:
+                yield ','
+            yield raw
+        yield ']'
+    else:
+        yield _dumps(obj)
+
+
+def iter_ndjson(records):
+    if hasattr(records, 'iter_raw'):
+        for raw in records.iter_raw():
+            yield raw
+            yield '\n'
+        return
+    for r in records:
+        yield _dumps(r) + '\n'
+
+
+def iter_chunks(pieces, chunk_bytes=STREAM_CHUNK_BYTES):
+    """
+    joins small text (or already encoded) pieces into utf-8 chunks of about chunk_bytes
+    """
+    buffer = []
+    size = 0
+    for piece in pieces:
+        if isinstance(piece, str):
+            piece = piece.encode('utf-8')
+        buffer.append(piece)
+        size += len(piece)
+        if size >= chunk_bytes:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def iter_gzip(chunks, compresslevel=6):
+    # wbits 31 = gzip container
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+def iter_file(f, chunk_bytes=STREAM_CHUNK_BYTES):
+    with f:
+        while True:
+            chunk = f.read(chunk_bytes)
+            if not chunk:
+                break
+            yield chunk
+
+
+def get_records(full_db, path):
+    records = full_db
+    for k in path:
+        records = records[k]
+    return records
+
+
+def _response(chunks, mimetype, gzip=False):
+    if gzip:
+        chunks = iter_gzip(chunks)
+
+    response = Response(chunks, mimetype=mimetype)
+    if gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def stream_file(filepath, gzip=False):
+    """
+    streamed flask response straight from a json file on disk, nothing gets parsed
+    """
+    # opened here, so a missing file fails the request instead of the stream.
+    # the open file keeps pointing at the same version even if update_db renames a new one into place
+    return _response(iter_file(open(filepath, 'rb')), 'application/json', gzip=gzip)
+
+
+def stream_db(full_db, ndjson_path=None, gzip=False):
+    """
+    streamed flask response for a db (or the record list at ndjson_path, as ndjson)
+    :param full_db: read only db dict, usually a snapshot
+    :param ndjson_path: path of the record list to stream as ndjson, None for the whole db as json
+    :param gzip: gzip the stream (Content-Encoding: gzip)
+    :return:
+    """
+    if ndjson_path:
+        pieces = iter_ndjson(get_records(full_db, ndjson_path))
+        mimetype = 'application/x-ndjson'
+    else:
+        pieces = iter_json(full_db)
+        mimetype = 'application/json'
+
+    return _response(iter_chunks(pieces), mimetype, gzip=gzip)
@@ -1,30 +1,221 @@
 import json
 import os
+import threading
+from collections import namedtuple
+
+try:
+    from tools.db_ops import set_op, trim_op, apply_ops
+    from tools import segment_store, sqlite_store, retention, mmap_snapshot, metrics
+    from tools.time_utils import records_after
+except:
+    from app.tools.db_ops import set_op, trim_op, apply_ops
+    from app.tools import segment_store, sqlite_store, retention, mmap_snapshot, metrics
+    from app.tools.time_utils import records_after
 
 
 db_path = './db/daily_database.json'
 img_db_path = './db/daily_trend_search_database.json'
 top_retweets_db_path = './db/daily_top_rt_database.json'
 
+# json: every write rewrites the whole file (and keeps a .bak)
+# segments: every write appends its ops to a segment file, compacted in the background (see segment_store)
+# sqlite: records live in indexed sqlite tables next to the json file (see sqlite_store)
+STORAGE_MODE = os.environ.get('DB_STORAGE_MODE', 'json')
+
 
 def load_db(database_path=db_path, debug=False):
+    transaction = current_transaction()
+    if transaction is not None:
+        return transaction.load(database_path)
+    return _load_db(database_path)
+
+
+def _load_db(database_path):
+    if STORAGE_MODE == 'segments':
+        return segment_store.load_segmented_db(database_path)
+    if STORAGE_MODE == 'sqlite':
+        return sqlite_store.load_sqlite_db(database_path)
+
     with open(database_path, 'r') as json_db:
         return json.load(json_db)
 
 
-def update_db(dict_in, database_path=db_path, debug=False):
-    with open(database_path, 'r') as json_db:
-        state_str = json_db.read()
-        state = json.loads(state_str)
-        if debug:
-            print('current state')
-            print(json.dumps(state, indent=4, ensure_ascii=False))
-            print('replacing state (this is not redux yet)')
+# --------------
+# SNAPSHOT CACHE
+# --------------
+# read-only routes share one parsed copy of each db instead of json.load-ing it on every request.
+# a snapshot is never mutated, only swapped for a new one, so a reader always sees one consistent version.
+# DO NOT mutate snapshot.data. writers keep using load_db(), which always returns a fresh copy.
+# snapshot.derived holds values computed from that exact version (prebuilt responses, indexes),
+# so they are dropped together with the snapshot.
+DbSnapshot = namedtuple('DbSnapshot', ['path', 'version', 'data', 'derived'])
+
+_snapshots = {}
+_snapshot_lock = threading.Lock()
+# counted in metrics.snapshot_cache_total, which is safe to increment from any request thread
+SNAPSHOT_EVENTS = {"hits": 'hit', "misses": 'miss', "invalidations": 'invalidation'}
+
+
+def _snapshot_key(database_path):
+    return os.path.realpath(database_path)
+
+
+def _stat_version(stat_result):
+    # update_db renames a new file into place, so the inode changes on every write.
+    # mtime and size catch anything that edits the file in place.
+    return stat_result.st_ino, stat_result.st_mtime_ns, stat_result.st_size
+
+
+def _db_version(database_path):
+    if mmap_snapshot.MMAP_SNAPSHOTS and mmap_snapshot.records_path_for(database_path):
+        # readers follow the published generations instead of the db itself
+        version = mmap_snapshot.snapshot_version(database_path)
+        if version is not None:
+            return version
+    return _storage_version(database_path)
+
+
+def _storage_version(database_path):
+    if STORAGE_MODE == 'segments':
+        return segment_store.segments_version(database_path)
+    if STORAGE_MODE == 'sqlite':
+        return sqlite_store.sqlite_version(database_path)
+    return _stat_version(os.stat(database_path))
+
+
+def get_db_snapshot(database_path=db_path):
+    """
+    returns the cached DbSnapshot for a db, reloading it if the file on disk has changed.
+    the mtime/inode check also picks up writes from other processes.
+    :param database_path:
+    :return: DbSnapshot(path, version, data, derived)
+    """
+    key = _snapshot_key(database_path)
+    version = _db_version(database_path)
+
+    snapshot = _snapshots.get(key)
+    if snapshot is not None and snapshot.version == version:
+        metrics.snapshot_cache_total.inc(event='hit')
+        return snapshot
+
+    with _snapshot_lock:
+        # another thread may have reloaded it while we were waiting
+        snapshot = _snapshots.get(key)
+        if snapshot is not None and snapshot.version == version:
+            metrics.snapshot_cache_total.inc(event='hit')
+            return snapshot
+
+        metrics.snapshot_cache_total.inc(event='miss')
+        if version[0] == 'mmap':
+            # maps the file instead of parsing it, the records are decoded when read
+            version, data = mmap_snapshot.open_snapshot(database_path)
+            snapshot = DbSnapshot(key, version, data, {})
+        elif STORAGE_MODE != 'json':
+            # version was taken before loading, so a write landing meanwhile just causes one more reload.
+            # what is committed, never the state of a transaction open in this thread
+            snapshot = DbSnapshot(key, version, _load_db(database_path), {})
+        else:
+            with open(database_path, 'r') as json_db:
+                # stat the file we actually parse, in case it was replaced after the check above
+                version = _stat_version(os.fstat(json_db.fileno()))
+                snapshot = DbSnapshot(key, version, json.load(json_db), {})
+
+        # swapping the dict entry is atomic, readers holding the old snapshot keep using it
+        _snapshots[key] = snapshot
+        return snapshot
+
+
+def publish_db_snapshots(*database_paths, states=None):
+    """
+    writes the current generation of each db as a memory mapped snapshot for the serving workers
+    (DB_MMAP_SNAPSHOTS=1, see tools.mmap_snapshot)
+    :param states: what commit_transaction returned, dbs in it are published without loading them again
+    """
+    states = states or {}
+    for database_path in database_paths:
+        state = states.get(_snapshot_key(database_path))
+        if state is None:
+            state = load_db(database_path)
+        mmap_snapshot.publish_snapshot(state, database_path)
+
+
+def load_db_snapshot(database_path=db_path):
+    """
+    cached, READ ONLY version of load_db for the request handlers
+    :param database_path:
+    :return:
+    """
+    return get_db_snapshot(database_path).data
+
+
+def get_snapshot_derived(name, builder, database_path=db_path):
+    """
+    returns builder(snapshot.data), computed once per snapshot version
+    :param name: cache key within the snapshot
+    :param builder: function taking the (read only) db dict
+    :param database_path:
+    :return:
+    """
+    return snapshot_derived(get_db_snapshot(database_path), name, builder)
+
+
+def snapshot_derived(snapshot, name, builder):
+    """
+    same as get_snapshot_derived, for a snapshot the caller already holds
+    (so the derived value and the data it is used with come from the same version)
+    """
+    try:
+        return snapshot.derived[name]
+    except KeyError:
+        # two threads may both build it, the values are identical so last one wins
+        value = builder(snapshot.data)
+        snapshot.derived[name] = value
+        return value
+
+
+def sync_snapshot_view(synced, latest, add_records, full_paths, tail_path, database_path=db_path):
+    """
+    catches an in-process view of a db up with it: a full build the first time, after that only the records
+    at the end of tail_path newer than the view's latest, whether written by this process or by a collector
+    running in another one
+    :param synced: {"version": ...}, the db version the view has caught up with
+    :param latest: {"epoch": ...}, newest record of the view
+    :param add_records: adds a list of records to the view
+    :param full_paths: the record lists of the full build, oldest tier first
+    :param tail_path: the list new records are appended to
+    """
+    snapshot = get_db_snapshot(database_path)
+    if snapshot.version == synced['version']:
+        return
+
+    def records(path):
+        data = snapshot.data
+        for k in path:
+            data = data.get(k)
+            if data is None:
+                return []
+        return data
+
+    if synced['version'] is None:
+        for path in full_paths:
+            add_records(records(path))
+    else:
+        add_records(records_after(records(tail_path), latest['epoch']))
+    synced['version'] = snapshot.version
+
 
-        # update logic
-        for k, v in dict_in.items():
-            state[k] = dict_in[k]
+def invalidate_snapshot(database_path=db_path):
+    if _snapshots.pop(_snapshot_key(database_path), None) is not None:
+        metrics.snapshot_cache_total.inc(event='invalidation')
 
+
+def get_snapshot_stats():
+    output = {name: metrics.snapshot_cache_total.value(event=event) for name, event in SNAPSHOT_EVENTS.items()}
+    output['cached_dbs'] = sorted(_snapshots.keys())
+    return output
+
+
+def _save_json_state(state, database_path=db_path, debug=False):
     with open(database_path + '.tmp', 'w') as json_db:
         if debug:
             print('saving state')
@@ -32,7 +223,287 @@ def update_db(dict_in, database_path=db_path, debug=False):
 
     os.rename(database_path, database_path + '.bak')
     os.rename(database_path + '.tmp', database_path)
+    invalidate_snapshot(database_path)
     print('database updated. backup replaced.')
+    return os.path.getsize(database_path)
+
+
+def _db_name(database_path):
+    # metric label, e.g. daily_top_rt_database
+    return os.path.splitext(os.path.basename(database_path))[0]
+
+
+def apply_db_ops(ops, database_path=db_path, state=None, debug=False):
+    """
+    applies a list of db ops (see tools.db_ops) to a db.
+    in segments mode only the ops are written, in json mode the whole state is rewritten.
+    inside a transaction the ops only change the transaction's state, and are written on commit
+
+    :param ops:
+    :param database_path:
+    :param state: already loaded state to apply the ops to (json mode only, saves loading it again)
+    :param debug:
+    :return:
+    """
+    transaction = current_transaction()
+    if transaction is not None:
+        transaction.apply(ops, database_path)
+        return
+
+    if STORAGE_MODE == 'json':
+        key = _snapshot_key(database_path)
+        indexes = {}
+        if state is None:
+            version = _storage_version(database_path)
+            state = load_db(database_path)
+            indexes = _take_indexes(key, version)
+        apply_ops(state, ops, indexes)
+    _write_db_ops(ops, database_path, state, debug=debug)
+    if STORAGE_MODE == 'json':
+        _indexes[key] = (_storage_version(database_path), indexes)
+
+
+def _write_db_ops(ops, database_path, state, debug=False):
+    """
+    writes ops that are already applied to state: json mode saves state, the other modes only write the ops
+    """
+    db_name = _db_name(database_path)
+    with metrics.db_write_seconds.time(db=db_name, mode=STORAGE_MODE):
+        if STORAGE_MODE == 'sqlite':
+            sqlite_store.apply_ops_sqlite(ops, database_path, debug=debug)
+            invalidate_snapshot(database_path)
+            print('database rows updated.')
+            return
+
+        if STORAGE_MODE == 'segments':
+            written = segment_store.append_segment(ops, database_path, debug=debug)
+            invalidate_snapshot(database_path)
+            print('database segment appended.')
+        else:
+            written = _save_json_state(state, database_path, debug=debug)
+    metrics.db_write_bytes_total.inc(written, db=db_name)
+
+    if STORAGE_MODE == 'segments':
+        segment_store.maybe_compact_in_background(database_path)
+
+
+def update_db(dict_in, database_path=db_path, debug=False):
+    if STORAGE_MODE != 'json' or current_transaction() is not None:
+        # replacing whole keys, prefer appending with apply_db_ops where possible
+        apply_db_ops([set_op([k], v) for k, v in dict_in.items()], database_path=database_path, debug=debug)
+        return
+
+    db_name = _db_name(database_path)
+    with metrics.db_write_seconds.time(db=db_name, mode=STORAGE_MODE):
+        with open(database_path, 'r') as json_db:
+            state_str = json_db.read()
+            state = json.loads(state_str)
+            if debug:
+                print('current state')
+                print(json.dumps(state, indent=4, ensure_ascii=False))
+                print('replacing state (this is not redux yet)')
+
+            # update logic
+            for k, v in dict_in.items():
+                state[k] = dict_in[k]
+
+        written = _save_json_state(state, database_path, debug=debug)
+    metrics.db_write_bytes_total.inc(written, db=db_name)
+
+
+# ------------------
+# UPDATE TRANSACTION
+# ------------------
+# an update cycle used to load and write each db twice: once in the stage that fetches into it and again
+# in the adjust_* stage that trims it. between begin_transaction() and commit_transaction(),
+# load_db hands out one state per db (loaded the first time it is asked for), apply_db_ops changes that
+# state and keeps the ops, and the commit writes every changed db once
+# (json: one rewrite, segments: one segment, sqlite: one sqlite transaction).
+# a transaction belongs to the thread that began it, requests on other threads keep reading the committed dbs.
+# DB_UPDATE_TRANSACTION=0 goes back to writing on every apply_db_ops.
+UPDATE_TRANSACTION = os.environ.get('DB_UPDATE_TRANSACTION', '1') == '1'
+
+# what a record counts for in list_weight
+LIST_WEIGHTS = {
+    "tweets": lambda record: len(record.get('tweets') or []),
+}
+
+_transactions = threading.local()
+# (db, list path, weight) -> (storage version, value), carried from one commit to the next transaction
+_weights = {}
+# db -> (storage version, upsert indexes of its lists, see db_ops.ListIndex), carried the same way
+_indexes = {}
+
+
+def _take_indexes(key, version):
+    # the indexes of the last write, if nobody has written the db since. taken out while in use,
+    # so an update that fails halfway can't leave a half updated one behind
+    carried = _indexes.pop(key, None)
+    return carried[1] if carried is not None and carried[0] == version else {}
+
+
+def current_transaction():
+    return getattr(_transactions, 'current', None)
+
+
+class DbTransaction(object):
+    def __init__(self):
+        self.states = {}
+        self.paths = {}
+        self.ops = {}
+        self.versions = {}
+        self.indexes = {}
+        self.weights = {}
+        # dbs an apply failed on halfway, their state no longer matches their ops
+        self.broken = set()
+        # see on_commit
+        self.after_commit = []
+
+    def load(self, database_path):
+        key = _snapshot_key(database_path)
+        if key not in self.states:
+            version = _storage_version(database_path)
+            self.states[key] = _load_db(database_path)
+            self.paths[key] = database_path
+            self.versions[key] = version
+            self.indexes[key] = _take_indexes(key, version)
+            # weights from the last commit still hold if the db hasn't been written since
+            for counter, (weight_version, value) in _weights.items():
+                if counter[0] == key and weight_version == version:
+                    self.weights[counter] = value
+        return self.states[key]
+
+    def apply(self, ops, database_path):
+        key = _snapshot_key(database_path)
+        state = self.load(database_path)
+        try:
+            for op in ops:
+                self._track_weights(key, state, op)
+                apply_ops(state, [op], self.indexes[key])
+        except Exception:
+            self.broken.add(key)
+            raise
+        self.ops.setdefault(key, []).extend(ops)
+
+    def list_weight(self, database_path, list_path, weight):
+        key = _snapshot_key(database_path)
+        state = self.load(database_path)
+        counter = (key, tuple(list_path), weight)
+        if counter not in self.weights:
+            self.weights[counter] = sum(LIST_WEIGHTS[weight](r) for r in _get_path(state, list_path))
+        return self.weights[counter]
+
+    def _track_weights(self, key, state, op):
+        # keeps the maintained weights up to date with the op about to be applied
+        path = tuple(op['path'])
+        for counter in [c for c in self.weights if c[0] == key]:
+            list_path, weight = counter[1], LIST_WEIGHTS[counter[2]]
+            if path != list_path:
+                if path[:len(list_path)] == list_path or list_path[:len(path)] == path:
+                    # something inside or above the list changed, count again when next asked
+                    del self.weights[counter]
+                continue
+
+            current = _get_path(state, list_path)
+            if op['op'] == 'append':
+                removed = 0
+                if op.get('unique_key'):
+                    new_keys = set(r.get(op['unique_key']) for r in op['records'])
+                    removed = sum(weight(r) for r in current if r.get(op['unique_key']) in new_keys)
+                self.weights[counter] += sum(weight(r) for r in op['records']) - removed
+            elif op['op'] == 'trim':
+                self.weights[counter] -= sum(weight(r) for r in current[:op['count']])
+            elif op['op'] == 'set':
+                self.weights[counter] = sum(weight(r) for r in op['value'])
+            else:
+                del self.weights[counter]
+
+    def commit(self, debug=False):
+        """
+        :return: {db key: state} of the dbs whose state is now what is on disk
+        """
+        for key in self.states:
+            ops = self.ops.get(key)
+            if key in self.broken:
+                continue
+            if not ops:
+                # unchanged, its indexes still hold
+                _indexes[key] = (self.versions[key], self.indexes[key])
+                continue
+            _write_db_ops(ops, self.paths[key], self.states[key], debug=debug)
+            version = _storage_version(self.paths[key])
+            for counter, value in self.weights.items():
+                if counter[0] == key:
+                    _weights[counter] = (version, value)
+            _indexes[key] = (version, self.indexes[key])
+        for key in self.broken:
+            print('not writing {}, an update failed halfway through changing it'.format(self.paths[key]))
+        for callback in self.after_commit:
+            callback()
+        return {key: state for key, state in self.states.items() if key not in self.broken}
+
+
+def _get_path(state, path):
+    for k in path:
+        state = state[k]
+    return state
+
+
+def begin_transaction():
+    if not UPDATE_TRANSACTION:
+        return
+    if current_transaction() is not None:
+        raise RuntimeError('a db transaction is already open in this thread')
+    _transactions.current = DbTransaction()
+
+
+def commit_transaction(debug=False):
+    """
+    writes every db the transaction changed, once
+    :return: {db key: state} of the dbs the transaction loaded, as committed (for publish_db_snapshots).
+             None without a transaction
+    """
+    transaction = current_transaction()
+    if transaction is None:
+        return None
+    _transactions.current = None
+    return transaction.commit(debug=debug)
+
+
+def abort_transaction():
+    """
+    forgets the transaction's changes, nothing is written
+    :return: True if there was a transaction to forget
+    """
+    transaction = current_transaction()
+    _transactions.current = None
+    return transaction is not None
+
+
+def on_commit(callback):
+    """
+    calls callback once what was just applied is written: at commit inside a transaction (never if it is aborted),
+    right away without one. for in-process views of a db, so they never show changes that weren't kept
+    """
+    transaction = current_transaction()
+    if transaction is None:
+        callback()
+    else:
+        transaction.after_commit.append(callback)
+
+
+def list_weight(database_path, list_path, weight, state=None):
+    """
+    sum of LIST_WEIGHTS[weight] over the list at list_path, e.g. the tweets in the trend search db.
+    inside a transaction the sum is kept up to date by the ops instead of counted again every time
+    (and carried over to the next cycle as long as nobody else writes the db)
+    """
+    transaction = current_transaction()
+    if transaction is not None:
+        return transaction.list_weight(database_path, list_path, weight)
+    if state is None:
+        state = load_db(database_path)
+    return sum(LIST_WEIGHTS[weight](r) for r in _get_path(state, list_path))
 
 
 def make_db(db_json_dict_structure, database_path=db_path, debug=False):
@@ -55,64 +526,39 @@ def make_db(db_json_dict_structure, database_path=db_path, debug=False):
             print('new db constructed')
 
 
-def adjust_db(database_path=db_path, max_capacity=10000, num_to_delete=30, debug=False):
-    with open(database_path, 'r') as json_db:
-        state_str = json_db.read()
-        state = json.loads(state_str)
-        if debug:
-            print('current state')
-            print(json.dumps(state, indent=4, ensure_ascii=False))
-            print('replacing state (this is not redux yet)')
-
-    # checking logic
-    total_capacity = 0
-    trends_cache = state['trends']['include_hashtags']
-
-
-
-    # for tweets in state['trends']:
-    #     tw_len = len(tweets['tweets'])
-    #     total_tweets += tw_len
-    #
-    #     if debug:
-    #         print('{} has {} tweets in db'.format(tweets['label'], tw_len))
-    #
-    # print('\ntotal tweets: {}'.format(total_tweets))
-    #
-    # if total_tweets <= max_capacity:
-    #     print('images db within max capacity. not adjusting.')
-    # else:
-    #     print('images db close to over capacity. deleting 30 oldest trends')
-    #     state['trends'] = state['trends'][num_to_delete:]
-    # ---------------
+def adjust_db(database_path=db_path, now=None, debug=False):
+    """
+    rolls expired trend snapshots into hourly / daily aggregates (see tools.retention)
+    :param database_path:
+    :param now: epoch seconds, defaults to time.time()
+    :param debug:
+    :return:
+    """
+    state = load_db(database_path)
 
-    with open(database_path + '.tmp', 'w') as json_db:
-        if debug:
-            print('saving state')
-        json.dump(state, json_db, indent=4, ensure_ascii=False)
+    ops = retention.trend_history_ops(state, now=now)
+    if not ops:
+        print('trend history within retention. not adjusting.')
+    else:
+        for op in ops:
+            print('trend history retention: {} {} ({})'.format(
+                op['op'], '/'.join(op['path']), op.get('count', len(op.get('records') or []))))
+        apply_db_ops(ops, database_path=database_path, state=state, debug=debug)
 
-    os.rename(database_path, database_path + '.bak')
-    os.rename(database_path + '.tmp', database_path)
-    print('database updated. backup replaced.')
+    del state
 
 
 def adjust_images_db(database_path=img_db_path, max_capacity=65000, num_to_delete=30, debug=False):
-    with open(database_path, 'r') as json_db:
-        state_str = json_db.read()
-        state = json.loads(state_str)
-        if debug:
-            print('current state')
-            print(json.dumps(state, indent=4, ensure_ascii=False))
-            print('replacing state (this is not redux yet)')
+    state = load_db(database_path)
+    if debug:
+        print('current state')
+        print(json.dumps(state, indent=4, ensure_ascii=False))
 
     # checking logic
-    total_tweets = 0
-    for tweets in state['trends']:
-        tw_len = len(tweets['tweets'])
-        total_tweets += tw_len
-
-        if debug:
-            print('{} has {} tweets in db'.format(tweets['label'], tw_len))
+    total_tweets = list_weight(database_path, ['trends'], 'tweets', state=state)
+    if debug:
+        for tweets in state['trends']:
+            print('{} has {} tweets in db'.format(tweets['label'], len(tweets['tweets'])))
 
     print('\ntotal tweets: {}'.format(total_tweets))
 
@@ -120,31 +566,18 @@ def adjust_images_db(database_path=img_db_path, max_capacity=65000, num_to_delet
         print('images db within max capacity. not adjusting.')
     else:
         print('images db close to over capacity. deleting 30 oldest trends')
-        state['trends'] = state['trends'][num_to_delete:]
+        apply_db_ops([trim_op(['trends'], num_to_delete)], database_path=database_path, state=state, debug=debug)
     # ---------------
 
-    with open(database_path + '.tmp', 'w') as json_db:
-        if debug:
-            print('saving state')
-        json.dump(state, json_db, indent=4, ensure_ascii=False)
-
-    os.rename(database_path, database_path + '.bak')
-    os.rename(database_path + '.tmp', database_path)
-    print('database updated. backup replaced.')
-
-    del state_str
     del state
 
 
 
 def adjust_top_posts_db(database_path=top_retweets_db_path, max_capacity=100000, num_to_delete=30, debug=False):
-    with open(database_path, 'r') as json_db:
-        state_str = json_db.read()
-        state = json.loads(state_str)
-        if debug:
-            print('current state')
-            print(json.dumps(state, indent=4, ensure_ascii=False))
-            print('replacing state (this is not redux yet)')
+    state = load_db(database_path)
+    if debug:
+        print('current state')
+        print(json.dumps(state, indent=4, ensure_ascii=False))
 
     # checking logic
     total_tweets = len(state['top_posts'])
@@ -152,22 +585,12 @@ def adjust_top_posts_db(database_path=top_retweets_db_path, max_capacity=100000,
     print('\ntotal tweets: {}'.format(total_tweets))
 
     if total_tweets <= max_capacity:
-        print('images db within max capacity. not adjusting.')
+        print('top posts db within max capacity. not adjusting.')
     else:
-        print('images db close to over capacity. deleting 30 oldest trends')
-        state['trends'] = state['trends'][num_to_delete:]
+        print('top posts db close to over capacity. deleting {} oldest posts'.format(num_to_delete))
+        apply_db_ops([trim_op(['top_posts'], num_to_delete)], database_path=database_path, state=state, debug=debug)
     # ---------------
 
-    with open(database_path + '.tmp', 'w') as json_db:
-        if debug:
-            print('saving state')
-        json.dump(state, json_db, indent=4, ensure_ascii=False)
-
-    os.rename(database_path, database_path + '.bak')
-    os.rename(database_path + '.tmp', database_path)
-    print('database updated. backup replaced.')
-
-    del state_str
     del state
 
 
@@ -264,6 +687,7 @@ def __split_db(database_path=db_path, second_database_path=img_db_path,  debug=F
 
     os.rename(database_path, database_path + '.bak')
     os.rename(database_path + '.tmp', database_path)
+    invalidate_snapshot(database_path)
     print('database updated. backup replaced.')
 
     # save image db
@@ -0,0 +1,179 @@
+import json
+import random
+import threading
+import time
+
+import twitter
+
+
+# ------------------
+# OFFLINE TWITTER API
+# ------------------
+# stands in for twitter.Api, so the update cycle can be run and profiled without the network:
+#   from tools import twitter_api
+#   twitter_api.set_api(FakeTwitterApi(latency=0.2))
+# serves recorded responses (a json file, see load_recording) or synthetic ones,
+# sleeps latency seconds per call, and keeps rate limits like twitter does:
+# fixed windows, x-rate-limit-* values in api.rate_limit.resources, TwitterError code 88 when a window is used up.
+# searches with since_id only return newer statuses (synthetic ones: a few new ones, as a trend that is still going would)
+
+# python-twitter files these under rate_limit.resources[family][endpoint]
+SEARCH_ENDPOINT = '/search/tweets'
+TRENDS_ENDPOINT = '/trends/place'
+
+_words = ['大阪', '甲子園', '決勝', 'ライブ', '新曲', '台風', '速報', 'ゲーム', 'アニメ', '優勝',
+          '東京', '映画', '発売', '配信', '地震', '誕生日', '試合', 'コラボ', '限定', '公開']
+
+
+class FakeRateLimit(object):
+    def __init__(self):
+        self.resources = {}
+
+
+class FakeTwitterApi(object):
+    """
+    the parts of twitter.Api the app uses: GetTrendsWoeid, GetSearch and rate_limit
+    """
+
+    def __init__(self, recording=None, latency=0.0, jitter=0.0, num_trends=50, search_limit=180, trends_limit=75,
+                 window_secs=15*60, trend_step_secs=15*60, start_time=None, seed=0):
+        """
+        :param recording: {"trends": [trend dicts], "search": {term: [status dicts]}, "raw_search": [status dicts]},
+                          as dict or path to a json file. anything missing is made up
+        :param latency: seconds each call takes
+        :param jitter: up to this many extra seconds per call, random
+        :param num_trends: synthetic trends per GetTrendsWoeid call
+        :param search_limit: GetSearch calls per window, None for no limit
+        :param trends_limit: GetTrendsWoeid calls per window, None for no limit
+        :param window_secs: rate limit window
+        :param trend_step_secs: how far the as_of time of synthetic trends moves on per call
+        :param start_time: epoch of the first synthetic trends, defaults to now
+        :param seed: for the synthetic data
+        """
+        if isinstance(recording, str):
+            recording = load_recording(recording)
+        self.recording = recording or {}
+        self.latency = latency
+        self.jitter = jitter
+        self.num_trends = num_trends
+        self.trend_step_secs = trend_step_secs
+        self.trend_time = int(start_time if start_time is not None else time.time())
+        self.window_secs = window_secs
+        self.limits = {"search": search_limit, "trends": trends_limit}
+        self.rate_limit = FakeRateLimit()
+        self.calls = {"search": 0, "trends": 0}
+        self._windows = {}
+        self._random = random.Random(seed)
+        self._next_id = 1000000000000000000
+        self._lock = threading.Lock()
+
+    # -------------
+    # RATE LIMITING
+    # -------------
+    def _call(self, family, endpoint):
+        if self.latency or self.jitter:
+            time.sleep(self.latency + self._random.random() * self.jitter)
+
+        with self._lock:
+            self.calls[family] += 1
+            limit = self.limits[family]
+            if limit is None:
+                return
+
+            now = time.time()
+            reset, remaining = self._windows.get(family, (0, limit))
+            if now >= reset:
+                reset, remaining = now + self.window_secs, limit
+            if remaining <= 0:
+                raise twitter.TwitterError([{'message': 'Rate limit exceeded', 'code': 88}])
+            remaining -= 1
+            self._windows[family] = reset, remaining
+
+            # what python-twitter copies out of the response headers
+            self.rate_limit.resources.setdefault(family, {})[endpoint] = {
+                "limit": limit,
+                "remaining": remaining,
+                "reset": int(reset)
+            }
+
+    # ------
+    # TRENDS
+    # ------
+    def GetTrendsWoeid(self, woeid, exclude=None):
+        self._call('trends', TRENDS_ENDPOINT)
+
+        with self._lock:
+            as_of = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self.trend_time))
+            self.trend_time += self.trend_step_secs
+
+            trends = self.recording.get('trends')
+            if trends is None:
+                trends = []
+                for i in range(self.num_trends):
+                    name = self._random.choice(_words) + self._random.choice(_words)
+                    if exclude != 'hashtags' and i % 3 == 0:
+                        name = '#' + name
+                    trends.append({
+                        "name": name,
+                        "query": name,
+                        "url": "http://twitter.com/search?q=" + name,
+                        "tweet_volume": self._random.choice([None, self._random.randint(10000, 700000)])
+                    })
+
+        return [twitter.Trend.NewFromJsonDict(dict(t, timestamp=as_of)) for t in trends]
+
+    # ------
+    # SEARCH
+    # ------
+    def _status(self, terms=None):
+        self._next_id += 1
+        created = time.gmtime(time.time() - self._random.randint(0, 6 * 60 * 60))
+        words = [self._random.choice(_words) for _ in range(8)]
+        if terms:
+            # it was found by searching for one of them, so it mentions it
+            words.insert(0, self._random.choice(terms))
+        status = {
+            "id": self._next_id,
+            "text": ' '.join(words),
+            "created_at": time.strftime('%a %b %d %H:%M:%S +0000 %Y', created),
+            "favorite_count": self._random.randint(0, 200000),
+            "retweet_count": self._random.randint(0, 50000),
+            "entities": {
+                "hashtags": [{"text": self._random.choice(_words)}],
+            }
+        }
+        if self._random.random() < 0.6:
+            status['entities']['media'] = [{
+                "id": self._next_id,
+                "type": "photo",
+                "media_url_https": "https://pbs.twimg.com/media/{}.jpg".format(self._next_id)
+            }]
+        return status
+
+    def GetSearch(self, term=None, raw_query=None, count=15, since_id=None, return_json=False, **kwargs):
+        self._call('search', SEARCH_ENDPOINT)
+
+        with self._lock:
+            if raw_query is not None:
+                statuses = self.recording.get('raw_search')
+            else:
+                statuses = (self.recording.get('search') or {}).get(term)
+            if statuses is None:
+                count = count if raw_query is None else 100
+                if since_id:
+                    # a search that ran before only gets what was tweeted since
+                    count = self._random.randint(0, count // 3)
+                # "a" OR "b" OR ... as tools.search_batch builds them
+                terms = [t.strip().strip('"') for t in term.split(' OR ')] if term else None
+                statuses = [self._status(terms) for _ in range(count)]
+            elif since_id:
+                statuses = [s for s in statuses if s.get('id', 0) > since_id]
+
+        if return_json:
+            return {"statuses": statuses}
+        return [twitter.Status.NewFromJsonDict(s) for s in statuses]
+
+
+def load_recording(filepath):
+    with open(filepath, 'r') as f:
+        return json.load(f)
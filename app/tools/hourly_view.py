@@ -0,0 +1,112 @@
+import datetime
+import threading
+from bisect import bisect_left, insort
+
+import pytz
+
+try:
+    from tools.db_utils import sync_snapshot_view, db_path
+    from tools.retention import trend_volume, bucket_start, HOUR
+    from tools.time_utils import record_epoch, datetime_2_str
+except:
+    from app.tools.db_utils import sync_snapshot_view, db_path
+    from app.tools.retention import trend_volume, bucket_start, HOUR
+    from app.tools.time_utils import record_epoch, datetime_2_str
+
+
+# -----------------
+# HOURLY TREND VIEW
+# -----------------
+# trends per Asia/Tokyo hour, in the shape of misc/thdal_ideal_output_format.json:
+#   {"date": "2018-08-21 17時", "hashtags": ["大阪桐蔭(608,300)", "閉会式", ...]}
+# built once per process from the main db (hourly aggregates, then raw snapshots) and
+# updated by every trend update (or, in a serving-only process, from the tail of each new db version),
+# so a request is a bisect and a slice over the hours.
+# JST is a whole number of hours off utc, so utc hour buckets are JST hour buckets.
+
+jp_timezone = pytz.timezone('Asia/Tokyo')
+time_format_hour = '%Y-%m-%d %H時'
+
+DEFAULT_HOURS = 24
+
+# hour epoch -> {label: highest volume seen that hour}, labels in the order they first showed up
+_buckets = {}
+# sorted hour epochs
+_hours = []
+# hour epoch -> output entry, dropped when that hour changes
+_rendered = {}
+# newest snapshot seen
+_latest = {"epoch": 0}
+# db version the index has caught up with
+_synced = {"version": None}
+_lock = threading.Lock()
+
+
+def _add_records(records):
+    for r in records:
+        epoch = record_epoch(r)
+        label = r.get('label')
+        if not epoch or label is None:
+            continue
+        hour = bucket_start(epoch, HOUR)
+        volume = r['volume_max'] if 'samples' in r else trend_volume(r)
+
+        bucket = _buckets.get(hour)
+        if bucket is None:
+            bucket = _buckets[hour] = {}
+            if not _hours or hour > _hours[-1]:
+                _hours.append(hour)
+            else:
+                insort(_hours, hour)
+
+        if label not in bucket or volume > bucket[label]:
+            bucket[label] = volume
+        _rendered.pop(hour, None)
+        if epoch > _latest['epoch']:
+            _latest['epoch'] = epoch
+
+
+# every tier of the trends in the main db, oldest first
+_TIERS = [['trends', 'include_hashtags', 'hourly'], ['trends', 'include_hashtags', 'content']]
+
+
+def _sync(database_path):
+    sync_snapshot_view(_synced, _latest, _add_records, _TIERS, _TIERS[-1], database_path=database_path)
+
+
+def _render(hour):
+    entry = _rendered.get(hour)
+    if entry is None:
+        hashtags = []
+        for label, volume in _buckets[hour].items():
+            hashtags.append('{}({:,})'.format(label, volume) if volume else label)
+        entry = _rendered[hour] = {
+            "date": datetime_2_str(datetime.datetime.fromtimestamp(hour, tz=jp_timezone), output_format=time_format_hour),
+            "hashtags": hashtags
+        }
+    return entry
+
+
+def add_snapshots(records, database_path=db_path):
+    """
+    call with the trend snapshots that were just written to the db
+    """
+    with _lock:
+        _sync(database_path)
+        _add_records(records)
+
+
+def get_hours(since=None, until=None, limit=DEFAULT_HOURS, database_path=db_path):
+    """
+    :param since: epoch, the hour it falls in is included
+    :param until: epoch, exclusive
+    :param limit: most recent hours of the range to return
+    :param database_path:
+    :return: list of {date, hashtags}, newest hour first
+    """
+    with _lock:
+        _sync(database_path)
+        start = bisect_left(_hours, bucket_start(since, HOUR)) if since is not None else 0
+        end = bisect_left(_hours, until) if until is not None else len(_hours)
+        start = max(start, end - limit)
+        return [_render(hour) for hour in reversed(_hours[start:end])]
@@ -0,0 +1,211 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+
+
+# -------
+# METRICS
+# -------
+# counters, gauges and histograms, rendered in the prometheus text format by /metrics.
+# recording is a dict lookup and an add under a lock, cheap enough for every request.
+# a standalone collector.py has no /metrics of its own, it writes its metrics to a file after every update
+# and the serving processes append that file to their own output.
+# (with several uwsgi workers each worker counts its own requests, like any per-process exporter)
+
+LATENCY_BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+PHASE_BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+SIZE_BUCKETS = [256, 1024, 10*1024, 100*1024, 1024*1024, 10*1024*1024, 100*1024*1024]
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _label_str(labelnames, values):
+    if not labelnames:
+        return ''
+    pairs = []
+    for k, v in zip(labelnames, values):
+        v = str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append('{}="{}"'.format(k, v))
+    return '{' + ','.join(pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric(object):
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(k, '') for k in self.labelnames)
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation),
+                 '# TYPE {} {}'.format(self.name, self.kind)]
+        with self._lock:
+            lines += list(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        key = self._key(labels)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def _samples(self):
+        if not self._values and not self.labelnames:
+            yield '{} 0'.format(self.name)
+        for key, value in sorted(self._values.items()):
+            yield '{}{} {}'.format(self.name, _label_str(self.labelnames, key), _number(value))
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = list(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            h = self._values.get(key)
+            if h is None:
+                # per bucket counts (the last one is +Inf), sum, count
+                h = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            h[0][i] += 1
+            h[1] += value
+            h[2] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def _samples(self):
+        for key, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, c in zip(self.buckets + [float('inf')], counts):
+                cumulative += c
+                yield '{}_bucket{} {}'.format(self.name, _label_str(self.labelnames + ('le',), key + (_number(float(bound)),)), cumulative)
+            yield '{}_sum{} {}'.format(self.name, _label_str(self.labelnames, key), _number(total))
+            yield '{}_count{} {}'.format(self.name, _label_str(self.labelnames, key), count)
+
+
+class _Timer(object):
+    """
+    with histogram.time(phase='trends'): ...
+    """
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+        self.histogram.observe(self.elapsed, **self.labels)
+        return False
+
+
+def render(skip=()):
+    """
+    :param skip: metric names to leave out (because another process reports them)
+    :return: prometheus text format
+    """
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for m in metrics:
+        if m.name not in skip:
+            lines += m.render()
+    return '\n'.join(lines) + '\n'
+
+
+def write_textfile(filepath):
+    """
+    writes every metric of this process to a file, replaced atomically
+    """
+    with open(filepath + '.tmp', 'w') as f:
+        f.write(render())
+    os.rename(filepath + '.tmp', filepath)
+
+
+def read_textfile(filepath):
+    """
+    :return: text, names of the metrics in it. ('', set()) if there is no file
+    """
+    try:
+        with open(filepath, 'r') as f:
+            text = f.read()
+    except FileNotFoundError:
+        return '', set()
+    names = set(line.split()[2] for line in text.splitlines() if line.startswith('# TYPE '))
+    return text, names
+
+
+# ------------------
+# THE APP'S METRICS
+# ------------------
+update_seconds = Histogram('twitter_update_seconds', 'duration of a whole update cycle', buckets=PHASE_BUCKETS)
+update_phase_seconds = Histogram('twitter_update_phase_seconds', 'duration of each phase of an update cycle',
+                                 ['phase'], buckets=PHASE_BUCKETS)
+updates_total = Counter('twitter_updates_total', 'update cycles run, by result', ['result'])
+last_update = Gauge('twitter_last_update_timestamp_seconds', 'when the last update cycle finished')
+
+api_calls_total = Counter('twitter_api_calls_total', 'calls made to the twitter api', ['endpoint'])
+api_call_seconds = Histogram('twitter_api_call_seconds', 'duration of twitter api calls', ['endpoint'],
+                             buckets=PHASE_BUCKETS)
+rate_limited_total = Counter('twitter_rate_limited_total', 'calls skipped because the rate limit budget was used up',
+                             ['family'])
+
+db_write_seconds = Histogram('db_write_seconds', 'duration of db writes', ['db', 'mode'], buckets=PHASE_BUCKETS)
+db_write_bytes_total = Counter('db_write_bytes_total', 'bytes written to the db files (json and segments mode)', ['db'])
+
+http_request_seconds = Histogram('http_request_seconds', 'request latency by route', ['route', 'method', 'status'])
+http_response_bytes = Histogram('http_response_bytes', 'response body size by route (not for streamed responses)',
+                                ['route'], buckets=SIZE_BUCKETS)
+
+snapshot_cache_total = Counter('db_snapshot_cache_total', 'db snapshot cache events (hit, miss, invalidation)', ['event'])
+
+search_cache_total = Counter('twitter_search_cache_total', 'trend search cache lookups by result (hit, stale, miss). '
+                             'hits are searches that were not made, '
+                             'stale hits stand in for ones there was no room for', ['result'])
+search_cache_evictions_total = Counter('twitter_search_cache_evictions_total', 'labels dropped from the full trend search cache')
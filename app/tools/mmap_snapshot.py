@@ -0,0 +1,173 @@
+import json
+import mmap
+import os
+import struct
+from array import array
+from collections.abc import Sequence
+
+
+# -------------------------
+# MEMORY MAPPED DB SNAPSHOTS
+# -------------------------
+# with several serving workers every one of them would json.load its own copy of the big dbs.
+# instead the collector publishes each generation of a db as ./db/<name>.snap, and workers mmap it read only,
+# so the data sits in the page cache once per host no matter how many workers map it.
+#
+#   header   MAGIC, record count, skeleton length, offsets position (4 x uint64)
+#   skeleton the db as json with the record list left empty
+#   records  one compact json document per record, back to back
+#   offsets  count + 1 native uint64, record i is records[offsets[i]:offsets[i + 1]]
+#
+# a new generation is written next to the old one and renamed over it. workers notice the new inode,
+# map the new file and drop the old mapping once nobody uses it, so a reader never sees half a generation.
+# records are only decoded when they are read, RecordView.raw() hands out the bytes without copying.
+# the offsets are native byte order, a snapshot is meant for the host that wrote it.
+
+MMAP_SNAPSHOTS = os.environ.get('DB_MMAP_SNAPSHOTS', '0') == '1'
+
+MAGIC = b'TWSNAP01'
+_header = struct.Struct('=8sQQQ')
+
+# record list of each db that goes into the snapshot, by db file name
+SNAPSHOT_RECORDS = {
+    "daily_trend_search_database": ['trends'],
+    "daily_top_rt_database": ['top_posts'],
+}
+
+
+def snapshot_path(database_path):
+    return os.path.splitext(database_path)[0] + '.snap'
+
+
+def records_path_for(database_path):
+    return SNAPSHOT_RECORDS.get(os.path.splitext(os.path.basename(database_path))[0])
+
+
+def _dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def publish_snapshot(state, database_path, records_path=None):
+    """
+    writes a new generation of the snapshot of a db
+    :param state: the db as load_db returns it
+    :param database_path:
+    :param records_path: list to store as records, defaults to SNAPSHOT_RECORDS
+    :return: number of records written
+    """
+    records_path = records_path or records_path_for(database_path)
+    container = state
+    for k in records_path[:-1]:
+        container = container[k]
+    records = container[records_path[-1]]
+
+    # skeleton without the records, state itself is left alone
+    skeleton = dict(state)
+    parent = skeleton
+    for k in records_path[:-1]:
+        parent[k] = dict(parent[k])
+        parent = parent[k]
+    parent[records_path[-1]] = []
+    skeleton_bytes = _dumps({"path": records_path, "db": skeleton})
+
+    path = snapshot_path(database_path)
+    offsets = array('Q', [0])
+    with open(path + '.tmp', 'wb') as f:
+        f.write(_header.pack(MAGIC, len(records), len(skeleton_bytes), 0))
+        f.write(skeleton_bytes)
+        f.write(b'\0' * (-f.tell() % 8))
+        data_start = f.tell()
+        for r in records:
+            f.write(_dumps(r))
+            offsets.append(f.tell() - data_start)
+        f.write(b'\0' * (-f.tell() % 8))
+        offsets_pos = f.tell()
+        f.write(offsets.tobytes())
+        f.seek(0)
+        f.write(_header.pack(MAGIC, len(records), len(skeleton_bytes), offsets_pos))
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.rename(path + '.tmp', path)
+    print('snapshot published: {} ({} records)'.format(path, len(records)))
+    return len(records)
+
+
+class RecordView(Sequence):
+    """
+    read only list of the records in a mapped snapshot, decoded on access
+    """
+
+    def __init__(self, mm, data_start, offsets):
+        self._mm = mm
+        self._data_start = data_start
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def _bounds(self, i):
+        n = len(self)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError('record index out of range')
+        return self._data_start + self._offsets[i], self._data_start + self._offsets[i + 1]
+
+    def raw(self, i):
+        """
+        the json bytes of record i, as a memoryview into the mapping (no copy)
+        """
+        start, end = self._bounds(i)
+        return memoryview(self._mm)[start:end]
+
+    def iter_raw(self):
+        view = memoryview(self._mm)
+        for i in range(len(self)):
+            yield view[self._data_start + self._offsets[i]:self._data_start + self._offsets[i + 1]]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        start, end = self._bounds(i)
+        return json.loads(self._mm[start:end])
+
+
+def snapshot_version(database_path):
+    """
+    identifies the published generation, None if there is none
+    """
+    try:
+        st = os.stat(snapshot_path(database_path))
+    except FileNotFoundError:
+        return None
+    return 'mmap', st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def open_snapshot(database_path):
+    """
+    maps the current generation of a db snapshot
+    :return: version, db dict with the record list as a RecordView
+    """
+    with open(snapshot_path(database_path), 'rb') as f:
+        st = os.fstat(f.fileno())
+        # the mapping stays valid after the file is closed, and after it is renamed over
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    version = 'mmap', st.st_ino, st.st_mtime_ns, st.st_size
+
+    magic, count, skeleton_len, offsets_pos = _header.unpack_from(mm, 0)
+    if magic != MAGIC:
+        raise ValueError('{} is not a db snapshot'.format(snapshot_path(database_path)))
+
+    skeleton_start = _header.size
+    skeleton = json.loads(mm[skeleton_start:skeleton_start + skeleton_len])
+    data_start = skeleton_start + skeleton_len
+    data_start += -data_start % 8
+    offsets = memoryview(mm)[offsets_pos:offsets_pos + (count + 1) * 8].cast('Q')
+
+    db = skeleton['db']
+    container = db
+    for k in skeleton['path'][:-1]:
+        container = container[k]
+    container[skeleton['path'][-1]] = RecordView(mm, data_start, offsets)
+    return version, db
@@ -0,0 +1,193 @@
+import cProfile
+import hmac
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+
+# ---------
+# PROFILING
+# ---------
+# off unless asked for, and then only for the one request / update it was asked for.
+#   requests: set PROFILE_SECRET, then send "X-Profile: <secret>" (or ?profile=<secret>).
+#             main.py only installs its hooks when PROFILE_SECRET is set, so there is nothing to pay otherwise
+#   updates:  PROFILE_UPDATES=N profiles the next N update cycles after start,
+#             or write N into <PROFILE_DIR>/profile_updates while the collector is running
+# two modes (PROFILE_MODE, or X-Profile-Mode / ?profile_mode= per request, PROFILE_UPDATES_MODE for updates):
+#   cprofile: <name>.prof, a pstats dump (python -m pstats, snakeviz, flameprof).
+#             only sees the thread it was started on, so not the search pool threads of an update
+#   sample:   <name>.folded, stacks sampled every PROFILE_INTERVAL_MS in collapsed format, one "a;b;c count" per line
+#             (flamegraph.pl, speedscope). an update is sampled across all its threads, hence the default for updates
+
+PROFILE_DIR = os.environ.get('PROFILE_DIR', './profiles')
+PROFILE_SECRET = os.environ.get('PROFILE_SECRET', '')
+PROFILE_MODE = os.environ.get('PROFILE_MODE', 'cprofile')
+PROFILE_UPDATES_MODE = os.environ.get('PROFILE_UPDATES_MODE', 'sample')
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', 5))
+MODES = ('cprofile', 'sample')
+
+UPDATES_TRIGGER_FILE = 'profile_updates'
+
+_pending_updates = int(os.environ.get('PROFILE_UPDATES', 0))
+_lock = threading.Lock()
+
+
+def _frame_name(code):
+    filename = code.co_filename
+    app_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if filename.startswith(app_dir):
+        filename = os.path.relpath(filename, app_dir)
+    return '{} ({}:{})'.format(code.co_name, filename, code.co_firstlineno).replace(';', ':')
+
+
+def collapse(frame):
+    """
+    :return: the stack of frame as "outermost;...;innermost"
+    """
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler(object):
+    """
+    samples the stacks of some (or all) threads from a background thread
+    """
+
+    def __init__(self, thread_ids=None, interval_ms=PROFILE_INTERVAL_MS):
+        """
+        :param thread_ids: threads to sample, None for every thread but the sampler
+        """
+        self.thread_ids = thread_ids
+        self.interval = interval_ms / 1000
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def _run(self):
+        me = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                    continue
+                stack = collapse(frame)
+                if self.thread_ids is None:
+                    if thread_id not in names:
+                        names = {t.ident: t.name for t in threading.enumerate()}
+                    stack = '{};{}'.format(names.get(thread_id, thread_id), stack)
+                self.stacks[stack] += 1
+
+    def enable(self):
+        self._thread.start()
+
+    def disable(self):
+        self._stop.set()
+        self._thread.join()
+
+    def dump_stats(self, filepath):
+        with open(filepath, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write('{} {}\n'.format(stack, count))
+
+
+class Profile(object):
+    """
+    one profiling run, written to PROFILE_DIR when stopped
+    """
+
+    def __init__(self, name, mode=None, all_threads=False):
+        """
+        :param name: goes into the file name, e.g. the route
+        :param mode: cprofile or sample, defaults to PROFILE_MODE
+        :param all_threads: sample every thread (sample mode only)
+        """
+        self.mode = mode if mode in MODES else PROFILE_MODE
+        self.name = re.sub(r'[^A-Za-z0-9_.-]+', '_', name).strip('_') or 'root'
+        if self.mode == 'sample':
+            self.profiler = StackSampler(None if all_threads else {threading.get_ident()})
+        else:
+            if all_threads:
+                print('cprofile only profiles the thread it is started on, {} will miss the others'.format(self.name))
+            self.profiler = cProfile.Profile()
+        self.filepath = None
+
+    def start(self):
+        self.start_time = time.time()
+        self.profiler.enable()
+        return self
+
+    def stop(self):
+        """
+        :return: path of the written file
+        """
+        if self.filepath is not None:
+            return self.filepath
+        self.profiler.disable()
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S', time.gmtime(self.start_time))
+        self.filepath = os.path.join(PROFILE_DIR, '{}-{}-{}.{}'.format(
+            self.name, stamp, int(self.start_time * 1000) % 1000, 'folded' if self.mode == 'sample' else 'prof'))
+        self.profiler.dump_stats(self.filepath)
+        print('profile written to {} ({:.3f}s)'.format(self.filepath, time.time() - self.start_time))
+        return self.filepath
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+
+# --------
+# REQUESTS
+# --------
+def requested(headers, args):
+    """
+    :return: the profile mode asked for, or None if this request isn't to be profiled
+    """
+    if not PROFILE_SECRET:
+        return None
+    secret = PROFILE_SECRET.encode('utf-8')
+    # compare_digest takes as long whatever the first wrong character is, so the secret can't be guessed by timing
+    if not any(hmac.compare_digest(secret, (given or '').encode('utf-8'))
+               for given in (headers.get('X-Profile'), args.get('profile'))):
+        return None
+    return headers.get('X-Profile-Mode') or args.get('profile_mode') or PROFILE_MODE
+
+
+# -------
+# UPDATES
+# -------
+def profile_next_updates(n):
+    global _pending_updates
+    with _lock:
+        _pending_updates = n
+
+
+def take_update_profile():
+    """
+    :return: True if this update cycle should be profiled (and counts it)
+    """
+    global _pending_updates
+    trigger = os.path.join(PROFILE_DIR, UPDATES_TRIGGER_FILE)
+    with _lock:
+        if os.path.exists(trigger):
+            try:
+                with open(trigger, 'r') as f:
+                    _pending_updates = int(f.read().strip() or 1)
+            except ValueError:
+                print('{} should hold a number of updates to profile'.format(trigger))
+            os.remove(trigger)
+
+        if _pending_updates <= 0:
+            return False
+        _pending_updates -= 1
+        return True
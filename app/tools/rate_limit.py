@@ -0,0 +1,136 @@
+import threading
+import time
+
+
+class RateLimitBucket(object):
+    """
+    thread safe request budget for one twitter endpoint family.
+    twitter uses fixed 15 minute windows, so the whole limit comes back at once when the window resets.
+    the bucket is decremented locally for every call and corrected from the x-rate-limit-* response headers,
+    so nobody has to ask twitter (InitializeRateLimit) how much is left.
+    """
+
+    def __init__(self, limit=180, window_secs=15*60):
+        self.limit = limit
+        self.window_secs = window_secs
+        self.remaining = limit
+        self.reset_at = time.time() + window_secs
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        if now >= self.reset_at:
+            self.remaining = self.limit
+            self.reset_at = now + self.window_secs
+
+    def try_acquire(self, n=1):
+        """
+        takes n calls from the budget if they are available
+        :return: True if the caller may make the calls
+        """
+        with self._lock:
+            self._refill(time.time())
+            if self.remaining < n:
+                return False
+            self.remaining -= n
+            return True
+
+    def available(self):
+        with self._lock:
+            self._refill(time.time())
+            return self.remaining
+
+    def update(self, limit, remaining, reset):
+        """
+        corrects the local model with what twitter reported
+        :param limit: x-rate-limit-limit
+        :param remaining: x-rate-limit-remaining
+        :param reset: x-rate-limit-reset, epoch seconds
+        """
+        limit, remaining, reset = int(limit or 0), int(remaining or 0), int(reset or 0)
+        if not limit or not reset:
+            # response without rate limit headers
+            return
+
+        with self._lock:
+            self.limit = limit
+            if reset > self.reset_at + 1:
+                # a new window started
+                self.remaining = remaining
+            else:
+                # same window. concurrent responses can arrive out of order, the lowest count is the newest
+                self.remaining = min(self.remaining, remaining)
+            self.reset_at = reset
+
+    def exhaust(self):
+        """
+        twitter answered that the window is used up (error 88) while the local count still had calls left,
+        e.g. after a restart in the middle of a window. nothing more is taken until the window resets
+        """
+        with self._lock:
+            self._refill(time.time())
+            self.remaining = 0
+
+    def status(self):
+        with self._lock:
+            self._refill(time.time())
+            return {
+                "limit": self.limit,
+                "remaining": self.remaining,
+                "reset": int(self.reset_at)
+            }
+
+
+# limits per 15 min window, from https://developer.twitter.com/en/docs/basics/rate-limits
+buckets = {
+    # GET search/tweets, shared by every GetSearch caller in this process
+    "search": RateLimitBucket(limit=180, window_secs=15*60),
+    # GET trends/place
+    "trends": RateLimitBucket(limit=75, window_secs=15*60),
+}
+search_budget = buckets['search']
+trends_budget = buckets['trends']
+
+# twitter's error code for a call over the limit (http 429)
+RATE_LIMIT_EXCEEDED = 88
+
+# the resource python-twitter files each family's response headers under
+_resources = {
+    "search": "/search/tweets",
+    "trends": "/trends/place",
+}
+
+
+def update_from_api(api, family):
+    """
+    python-twitter copies the x-rate-limit-* headers of every response into api.rate_limit.
+    call after a request to feed them into the local bucket, no network involved
+    """
+    try:
+        endpoint = api.rate_limit.resources[family][_resources[family]]
+    except (AttributeError, KeyError, TypeError):
+        return
+    buckets[family].update(endpoint.get('limit'), endpoint.get('remaining'), endpoint.get('reset'))
+
+
+def is_rate_limit_error(error):
+    """
+    :param error: twitter.TwitterError. python-twitter raises twitter's list of errors as its message
+    :return: True for "Rate limit exceeded" (code 88)
+    """
+    message = error.args[0] if error.args else None
+    if isinstance(message, dict):
+        message = [message]
+    if not isinstance(message, list):
+        return False
+    return any(isinstance(e, dict) and e.get('code') == RATE_LIMIT_EXCEEDED for e in message)
+
+
+def plan(family, wanted):
+    """
+    how many of the wanted calls fit into the current window
+    """
+    return min(wanted, buckets[family].available())
+
+
+def rate_limit_status():
+    return {family: {_resources[family]: bucket.status()} for family, bucket in buckets.items()}
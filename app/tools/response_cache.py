@@ -0,0 +1,168 @@
+import gzip
+import hashlib
+import json
+import zlib
+from collections import namedtuple
+
+from flask import request, Response
+
+try:
+    from tools.db_utils import get_snapshot_derived
+except:
+    from app.tools.db_utils import get_snapshot_derived
+
+
+# a response body serialized once per db version.
+# the requests themselves only look it up and compare etags
+PrebuiltResponse = namedtuple('PrebuiltResponse', ['body', 'gzip_body', 'etag'])
+
+CACHE_CONTROL = 'public, max-age=60, must-revalidate'
+DEFAULT_TOP_POSTS_COUNT = 100
+
+
+def serialize(payload):
+    # compact utf-8 json, keys sorted so the same payload always gives the same bytes (and etag)
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':'), sort_keys=True).encode('utf-8')
+
+
+def prebuild(payload):
+    """
+    serializes a payload into compact utf-8 json, plus a gzipped copy and a content hash.
+    for responses that are built once per db version and then sent many times
+    :param payload:
+    :return: PrebuiltResponse
+    """
+    body = serialize(payload)
+    etag = hashlib.sha1(body).hexdigest()
+    return PrebuiltResponse(body, gzip.compress(body, compresslevel=6), etag)
+
+
+def _send(body, etag, gzip_body, mimetype):
+    # 304 if the client already has this version, gzip body if the client accepts it.
+    # gzip_body is either the bytes or a function that makes them
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    elif request.accept_encodings['gzip']:
+        response = Response(gzip_body if isinstance(gzip_body, bytes) else gzip_body(), mimetype=mimetype)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(body, mimetype=mimetype)
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def send_prebuilt(prebuilt, mimetype='application/json'):
+    """
+    answers the current request from a PrebuiltResponse
+    :param prebuilt:
+    :param mimetype:
+    :return: flask Response
+    """
+    return _send(prebuilt.body, prebuilt.etag, prebuilt.gzip_body, mimetype)
+
+
+def send_payload(payload, mimetype='application/json'):
+    """
+    answers the current request with a payload built for it alone (pages, series, other counts).
+    nothing is kept for the next request, so the etag is a crc32 instead of a sha1,
+    and the body is only gzipped when the client takes gzip
+    :param payload:
+    :param mimetype:
+    :return: flask Response
+    """
+    body = serialize(payload)
+    etag = '{:x}-{:08x}'.format(len(body), zlib.crc32(body) & 0xffffffff)
+    return _send(body, etag, lambda: gzip.compress(body, compresslevel=6), mimetype)
+
+
+# ---------
+# PAYLOADS
+# ---------
+def trends_output(full_db):
+    # send back only a portion of the db
+    results = full_db['trends']['include_hashtags']
+
+    output_content = []
+    for c in results['content']:
+        output_content.append({
+            "label": c['label'],
+            "time": c['time'],
+            "volume": c['volume']
+        })
+
+    output_results = {
+        "content": output_content,
+        "timestamp": results['timestamp'],
+        "initial_timestamp": results['initial_timestamp']
+    }
+
+    return {
+        "results": output_results,
+        "status": 'ok'
+    }
+
+
+def images_output(full_db):
+    output_content = []
+    for c in full_db['trends']:
+        output_media_url = []
+        try:
+            for t in c['tweets']:
+                if t['media']:
+                    output_media_url.append({
+                        "url": t['url'],
+                        "images": t['media']
+                    })
+        except:
+            continue
+
+        output_content.append({
+            "label": c['label'],
+            "time": c['time'],
+            "media": output_media_url
+        })
+
+    output_results = {
+        "content": output_content
+    }
+
+    return {
+        "results": output_results,
+        "status": 'ok'
+    }
+
+
+def top_posts_output(full_db, count=DEFAULT_TOP_POSTS_COUNT):
+    return {
+        "results": full_db['top_posts'][count*-1:],
+        "status": "ok"
+    }
+
+
+# ------------------
+# PREBUILT RESPONSES
+# ------------------
+def get_prebuilt_trends(database_path):
+    return get_snapshot_derived('response:trends', lambda db: prebuild(trends_output(db)), database_path=database_path)
+
+
+def get_prebuilt_images(database_path):
+    return get_snapshot_derived('response:images', lambda db: prebuild(images_output(db)), database_path=database_path)
+
+
+def get_prebuilt_top_posts(database_path):
+    # only the default count, other counts are not kept around, that would let clients fill up memory one count at a time
+    return get_snapshot_derived('response:top_posts', lambda db: prebuild(top_posts_output(db)), database_path=database_path)
+
+
+def materialize_responses(database_path, trends_database_path, top_retweets_database_path):
+    """
+    builds every prebuilt response right after an update, so no request has to pay for it
+    """
+    get_prebuilt_trends(database_path)
+    get_prebuilt_images(trends_database_path)
+    get_prebuilt_top_posts(top_retweets_database_path)
+    print('responses prebuilt.')
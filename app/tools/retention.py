@@ -0,0 +1,188 @@
+import datetime
+import os
+import time
+
+try:
+    from tools.db_ops import set_op, append_op, trim_op
+    from tools.time_utils import record_epoch, datetime_2_str
+except:
+    from app.tools.db_ops import set_op, append_op, trim_op
+    from app.tools.time_utils import record_epoch, datetime_2_str
+
+
+# ---------------
+# TREND RETENTION
+# ---------------
+# trend snapshots come in every 15 minutes, so the trend history is kept in tiers:
+#   content: raw snapshots, for RETENTION_RAW_DAYS
+#   hourly:  one aggregate per label and hour, for RETENTION_HOURLY_DAYS
+#   daily:   one aggregate per label and day, for RETENTION_DAILY_DAYS (0 = forever)
+# every update rolls the snapshots that fell out of a tier into the next one.
+# cutoffs are aligned to the bucket size, so a bucket is only ever rolled up once and in one piece.
+# lists are in insertion order (roughly time order), only the expired prefix of a list is rolled up and trimmed.
+
+RAW_DAYS = float(os.environ.get('RETENTION_RAW_DAYS', 7))
+HOURLY_DAYS = float(os.environ.get('RETENTION_HOURLY_DAYS', 90))
+DAILY_DAYS = float(os.environ.get('RETENTION_DAILY_DAYS', 0))
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+time_format_full_with_timezone = '%Y-%m-%d %H:%M:%S%z'
+
+
+def bucket_start(epoch, size):
+    return int(epoch) // size * size
+
+
+def cutoff(now, days, size=1):
+    """
+    epoch before which records are expired, aligned down to size. None if the tier is kept forever
+    """
+    if not days:
+        return None
+    return bucket_start(now - days * DAY, size)
+
+
+def expired_prefix(records, cutoff_epoch):
+    """
+    how many records at the start of the list are older than cutoff_epoch
+    """
+    if cutoff_epoch is None:
+        return 0
+    n = 0
+    for r in records:
+        if record_epoch(r) >= cutoff_epoch:
+            break
+        n += 1
+    return n
+
+
+def trend_volume(record):
+    # stored as [n] (or [0] when twitter has no volume)
+    volume = record.get('volume')
+    if isinstance(volume, list):
+        volume = volume[0] if volume else 0
+    return volume or 0
+
+
+def _stats(record):
+    # raw snapshot or aggregate -> (max, sum, samples, first_seen, last_seen)
+    if 'samples' in record:
+        return (record['volume_max'], record['volume_avg'] * record['samples'], record['samples'],
+                record['first_seen'], record['last_seen'])
+    volume = trend_volume(record)
+    epoch = record_epoch(record)
+    return volume, volume, 1, epoch, epoch
+
+
+def rollup(records, size, resolution):
+    """
+    aggregates records (raw snapshots or finer aggregates) per label and bucket
+    :param records:
+    :param size: bucket size in seconds
+    :param resolution: 'hourly' / 'daily', stored on the aggregates
+    :return: aggregates ordered by bucket, then label
+    """
+    buckets = {}
+    for r in records:
+        epoch = record_epoch(r)
+        if not epoch:
+            # no usable time, nowhere to put it
+            continue
+        key = (bucket_start(epoch, size), r.get('label'))
+        volume_max, volume_sum, samples, first_seen, last_seen = _stats(r)
+
+        a = buckets.get(key)
+        if a is None:
+            a = buckets[key] = {
+                "label": key[1],
+                "epoch": key[0],
+                "time": datetime_2_str(datetime.datetime.fromtimestamp(key[0], tz=datetime.timezone.utc),
+                                       output_format=time_format_full_with_timezone),
+                "resolution": resolution,
+                "volume_max": volume_max,
+                "volume_sum": 0,
+                "samples": 0,
+                "first_seen": first_seen,
+                "last_seen": last_seen,
+            }
+        a['volume_max'] = max(a['volume_max'], volume_max)
+        a['volume_sum'] += volume_sum
+        a['samples'] += samples
+        a['first_seen'] = min(a['first_seen'], first_seen)
+        if last_seen >= a['last_seen']:
+            a['last_seen'] = last_seen
+            if r.get('query') is not None:
+                a['query'] = r['query']
+            if r.get('url') is not None:
+                a['url'] = r['url']
+
+    output = []
+    for key in sorted(buckets, key=lambda k: (k[0], str(k[1]))):
+        a = buckets[key]
+        a['volume_avg'] = round(a.pop('volume_sum') / a['samples'], 2)
+        output.append(a)
+    return output
+
+
+def _expire_ops(list_path, records, cutoff_epoch):
+    """
+    op that trims the expired prefix of the list at list_path
+    :param records: the list as it will be once the earlier ops of the batch are applied
+    :return: ops, the expired records
+    """
+    n = expired_prefix(records, cutoff_epoch)
+    if not n:
+        return [], []
+    return [trim_op(list_path, n)], records[:n]
+
+
+def _append_ops(path, container, key, records):
+    if not records:
+        return []
+    ops = []
+    if not isinstance(container.get(key), list):
+        ops.append(set_op(path + [key], []))
+    ops.append(append_op(path + [key], records))
+    return ops
+
+
+def trend_history_ops(state, now=None):
+    """
+    db ops that move expired trend snapshots of daily_database.json down the tiers
+    :param state: current db, not modified
+    :param now: epoch seconds, defaults to time.time()
+    :return: list of ops for apply_db_ops (empty if nothing expired)
+    """
+    if now is None:
+        now = time.time()
+
+    ops = []
+    trends = state.get('trends')
+    if not isinstance(trends, dict):
+        return ops
+
+    for group in ('include_hashtags', 'exclude_hashtags'):
+        container = trends.get(group)
+        if not isinstance(container, dict) or not isinstance(container.get('content'), list):
+            continue
+        path = ['trends', group]
+
+        # raw -> hourly
+        raw_ops, expired = _expire_ops(path + ['content'], container['content'], cutoff(now, RAW_DAYS, HOUR))
+        new_hourly = rollup(expired, HOUR, 'hourly')
+        ops += raw_ops + _append_ops(path, container, 'hourly', new_hourly)
+
+        # hourly -> daily, including what was just rolled into hourly
+        hourly = (container.get('hourly') or []) + new_hourly
+        hourly_ops, expired = _expire_ops(path + ['hourly'], hourly, cutoff(now, HOURLY_DAYS, DAY))
+        new_daily = rollup(expired, DAY, 'daily')
+        ops += hourly_ops + _append_ops(path, container, 'daily', new_daily)
+
+        # daily -> gone
+        daily = (container.get('daily') or []) + new_daily
+        daily_ops, expired = _expire_ops(path + ['daily'], daily, cutoff(now, DAILY_DAYS, DAY))
+        ops += daily_ops
+
+    return ops
@@ -0,0 +1,103 @@
+import os
+import unicodedata
+
+
+# ---------------
+# BATCHED SEARCHES
+# ---------------
+# one search per trend is what the 180 / 15 mins limit runs out on. trends the window has no room for
+# are searched several at a time instead, as one "a" OR "b" OR ... query, and every status that comes back
+# goes to the trend(s) it mentions (text or hashtags).
+# a batched search gets fewer tweets per trend than its own search would, so as many trends as the window
+# allows keep their own search and only the rest are batched.
+# SEARCH_BATCH_SIZE=1 turns it off.
+
+BATCH_SIZE = int(os.environ.get('SEARCH_BATCH_SIZE', 5))
+# twitter's standard search takes queries up to 500 characters, operators included
+MAX_QUERY_CHARS = 500
+
+
+def normalize(text):
+    # full width / half width and case differences shouldn't decide whether a tweet mentions a trend
+    return unicodedata.normalize('NFKC', text).lower()
+
+
+def _term(label):
+    return '"{}"'.format(label.replace('"', ''))
+
+
+def build_queries(labels, batch_size=None, max_chars=MAX_QUERY_CHARS):
+    """
+    :return: list of (query, labels in it), at most batch_size labels and max_chars characters per query
+    """
+    if batch_size is None:
+        batch_size = BATCH_SIZE
+
+    queries = []
+    group = []
+    query = ''
+    for label in labels:
+        term = _term(label)
+        candidate = query + ' OR ' + term if group else term
+        if group and (len(group) >= batch_size or len(candidate) > max_chars):
+            queries.append((query, group))
+            group, candidate = [], term
+        group.append(label)
+        query = candidate
+    if group:
+        queries.append((query, group))
+    return queries
+
+
+def plan_searches(labels, budget, batch_size=None):
+    """
+    splits labels into ones searched on their own and batched queries, so that they all fit in budget searches.
+    labels that don't fit even batched are left out (the last ones)
+
+    :param labels: in order of priority
+    :param budget: searches available
+    :return: labels for their own search, list of (query, labels) to search batched
+    """
+    if batch_size is None:
+        batch_size = BATCH_SIZE
+    if budget >= len(labels) or batch_size <= 1:
+        return labels[:max(budget, 0)], []
+
+    # as many single searches as leave enough room for batching the rest
+    single = max(0, min(budget, (budget * batch_size - len(labels)) // (batch_size - 1)))
+    while True:
+        queries = build_queries(labels[single:], batch_size=batch_size)
+        if single + len(queries) <= budget or single == 0:
+            return labels[:single], queries[:max(budget - single, 0)]
+        single -= 1
+
+
+def match_labels(tweet, labels):
+    """
+    :param tweet: tweet dict as get_search_tweets returns it
+    :param labels: the labels of the query the tweet came from
+    :return: the labels the tweet mentions
+    """
+    text = normalize(tweet.get('text') or '')
+    hashtags = set()
+    for h in tweet.get('hashtags') or []:
+        if isinstance(h, dict) and h.get('text'):
+            hashtags.add(normalize(h['text']))
+
+    matched = []
+    for label in labels:
+        name = normalize(label.replace('"', ''))
+        if name in text or name.lstrip('#') in hashtags:
+            matched.append(label)
+    return matched
+
+
+def demultiplex(tweets, labels):
+    """
+    :return: {label: [tweets that mention it]} for every label, in the order the tweets came in
+    """
+    output = {label: [] for label in labels}
+    for tweet in tweets:
+        for label in match_labels(tweet, labels):
+            output[label].append(tweet)
+    return output
@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    from tools import metrics
+except:
+    from app.tools import metrics
+
+
+# -------------------
+# TREND SEARCH CACHE
+# -------------------
+# trends stay on the list for hours, searching every one of them again every cycle spends the 180 searches
+# per window on results we already have. a label searched less than SEARCH_CACHE_TTL_MINS ago reuses that
+# search, so the window goes to trends that just appeared. least recently used labels go first when full.
+# with INCREMENTAL_SEARCH=0 results past the ttl also stand in for trends the window has no room for,
+# until they are evicted.
+# SEARCH_CACHE_TTL_MINS=0 turns it off.
+
+TTL_MINS = float(os.environ.get('SEARCH_CACHE_TTL_MINS', 45))
+MAX_LABELS = int(os.environ.get('SEARCH_CACHE_SIZE', 1000))
+
+_results = OrderedDict()
+_lock = threading.Lock()
+stats = {"hits": 0, "stale_hits": 0, "misses": 0, "evictions": 0}
+
+
+def enabled():
+    return TTL_MINS > 0
+
+
+def get(label, now=None):
+    """
+    :return: the cached search result of label, None if there is none within the ttl
+    """
+    if now is None:
+        now = time.time()
+    with _lock:
+        entry = _results.get(label)
+        if entry is None or now - entry[0] >= TTL_MINS * 60:
+            stats['misses'] += 1
+            metrics.search_cache_total.inc(result='miss')
+            return None
+
+        _results.move_to_end(label)
+        stats['hits'] += 1
+        metrics.search_cache_total.inc(result='hit')
+        return entry[1]
+
+
+def get_stale(label):
+    """
+    the cached search result of label however old it is, for trends the search window has no room for.
+    :return: None if there is none
+    """
+    with _lock:
+        entry = _results.get(label)
+        if entry is None:
+            return None
+        stats['stale_hits'] += 1
+        metrics.search_cache_total.inc(result='stale')
+        return entry[1]
+
+
+def put(label, result, now=None):
+    if now is None:
+        now = time.time()
+    with _lock:
+        _results[label] = (now, result)
+        _results.move_to_end(label)
+        while len(_results) > MAX_LABELS:
+            _results.popitem(last=False)
+            stats['evictions'] += 1
+            metrics.search_cache_evictions_total.inc()
+
+
+def forget_since(when):
+    """
+    drops the results put at or after when, e.g. the searches of an update cycle whose db writes were thrown away
+    (with INCREMENTAL_SEARCH a hit means "already in the db")
+    """
+    with _lock:
+        for label in [label for label, (put_at, result) in _results.items() if put_at >= when]:
+            del _results[label]
+
+
+def get_stats():
+    with _lock:
+        output = dict(stats)
+        output['labels'] = len(_results)
+    lookups = output['hits'] + output['misses']
+    output['hit_rate'] = output['hits'] / lookups if lookups else None
+    # every fresh hit is a search that wasn't made. a stale hit stands in for a search the window had no room
+    # for anyway, it saved nothing, so stale_hits are only reported
+    output['searches_saved'] = output['hits']
+    return output
+
+
+def clear():
+    with _lock:
+        _results.clear()
+        for k in stats:
+            stats[k] = 0
@@ -0,0 +1,217 @@
+import json
+import os
+import threading
+import time
+
+try:
+    from tools.db_ops import apply_op
+except:
+    from app.tools.db_ops import apply_op
+
+
+# ---------------------
+# APPEND-ONLY SEGMENTS
+# ---------------------
+# in segments mode a db is its base json file plus a folder of segment files next to it:
+#
+#   ./db/daily_database.json                       <- base, rewritten only by compaction
+#   ./db/daily_database.json.segments/00000001.jsonl
+#   ./db/daily_database.json.segments/00000002.jsonl   <- one segment per write, one db op per line
+#
+# a write only costs the size of its ops, not the size of the whole history.
+# compaction replays the segments into a new base in a background thread and deletes them.
+# the base remembers the last segment it contains (SEGMENT_SEQ_KEY), so a compaction that dies halfway
+# never applies a segment twice.
+# compaction in another process can delete the segments a reader has just listed. the new base already
+# holds them by then, so the reader starts over from the new base.
+# compactions of different dbs don't wait for each other.
+
+SEGMENT_DIR_SUFFIX = '.segments'
+SEGMENT_SEQ_KEY = '_segment_seq'
+COMPACTED_MARKER = 'compacted_through'
+
+# one segment per 15 min update cycle -> compact about once a day
+COMPACT_AFTER_SEGMENTS = int(os.environ.get('DB_COMPACT_AFTER_SEGMENTS', 96))
+# times load_segmented_db starts over when files it listed are gone
+LOAD_RETRIES = 5
+
+_append_lock = threading.Lock()
+# one compaction at a time per db
+_compaction_locks = {}
+_compaction_locks_lock = threading.Lock()
+
+
+def _compaction_lock(database_path):
+    key = os.path.realpath(database_path)
+    with _compaction_locks_lock:
+        if key not in _compaction_locks:
+            _compaction_locks[key] = threading.Lock()
+        return _compaction_locks[key]
+
+
+def segment_dir(database_path):
+    return database_path + SEGMENT_DIR_SUFFIX
+
+
+def list_segments(database_path):
+    """
+    :param database_path:
+    :return: [(seq, segment_filepath), ...] oldest first
+    """
+    folder = segment_dir(database_path)
+    try:
+        names = os.listdir(folder)
+    except FileNotFoundError:
+        return []
+
+    segments = []
+    for name in names:
+        if name.endswith('.jsonl'):
+            segments.append((int(name[:-len('.jsonl')]), os.path.join(folder, name)))
+
+    return sorted(segments)
+
+
+def _read_marker(database_path):
+    try:
+        with open(os.path.join(segment_dir(database_path), COMPACTED_MARKER), 'r') as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def _write_atomic(filepath, text):
+    with open(filepath + '.tmp', 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(filepath + '.tmp', filepath)
+
+
+def append_segment(ops, database_path, debug=False):
+    """
+    writes ops as a new segment file.
+    :param ops: list of db ops (see tools.db_ops)
+    :param database_path:
+    :return: number of bytes written
+    """
+    lines = [json.dumps(op, ensure_ascii=False, separators=(',', ':')) for op in ops]
+    text = '\n'.join(lines) + '\n'
+
+    with _append_lock:
+        folder = segment_dir(database_path)
+        os.makedirs(folder, exist_ok=True)
+
+        segments = list_segments(database_path)
+        last_seq = max(segments[-1][0] if segments else 0, _read_marker(database_path))
+        seq = last_seq + 1
+
+        _write_atomic(os.path.join(folder, '{:08d}.jsonl'.format(seq)), text)
+
+    if debug:
+        print('segment {} written to {} ({} ops)'.format(seq, folder, len(ops)))
+
+    return len(text.encode('utf-8'))
+
+
+def _replay(state, segments, base_seq):
+    # upsert indexes are shared by the whole replay, so they are built once per list, not once per segment
+    indexes = {}
+    for seq, filepath in segments:
+        if seq <= base_seq:
+            continue
+        with open(filepath, 'r') as f:
+            for line in f:
+                if line.strip():
+                    apply_op(state, json.loads(line), indexes=indexes)
+    return state
+
+
+def load_segmented_db(database_path):
+    """
+    compatibility reader: base json + every segment written after it.
+    returns the same dict load_db returns in json mode
+    """
+    for attempt in range(LOAD_RETRIES):
+        last_attempt = attempt == LOAD_RETRIES - 1
+        try:
+            with open(database_path, 'r') as json_db:
+                state = json.load(json_db)
+            base_seq = state.pop(SEGMENT_SEQ_KEY, 0)
+            state = _replay(state, list_segments(database_path), base_seq)
+            # a compaction moves the marker before it deletes segments, so if it hasn't moved past
+            # our base no segment we needed was missing
+            if _read_marker(database_path) <= base_seq or last_attempt:
+                return state
+        except FileNotFoundError:
+            if last_attempt:
+                raise
+        # a compaction replaced the base while we were reading, the new one has the segments it removed
+        time.sleep(0.01 * (attempt + 1))
+
+
+def segments_version(database_path):
+    """
+    changes whenever the base is replaced or a segment is added/removed
+    """
+    base = os.stat(database_path)
+    try:
+        folder = os.stat(segment_dir(database_path))
+        folder_version = (folder.st_ino, folder.st_mtime_ns)
+    except FileNotFoundError:
+        folder_version = None
+    return base.st_ino, base.st_mtime_ns, base.st_size, folder_version
+
+
+def compact(database_path, debug=False):
+    """
+    merges all current segments into the base file, then deletes them.
+    segments appended while this runs get a higher seq and are left for the next compaction
+    :return: True if something was compacted
+    """
+    lock = _compaction_lock(database_path)
+    if not lock.acquire(blocking=False):
+        print('compaction already running for {}'.format(database_path))
+        return False
+
+    try:
+        segments = list_segments(database_path)
+        if not segments:
+            return False
+
+        with open(database_path, 'r') as json_db:
+            state = json.load(json_db)
+        base_seq = state.pop(SEGMENT_SEQ_KEY, 0)
+
+        state = _replay(state, segments, base_seq)
+        last_seq = segments[-1][0]
+        state[SEGMENT_SEQ_KEY] = last_seq
+
+        with open(database_path + '.tmp', 'w') as json_db:
+            json.dump(state, json_db, ensure_ascii=False)
+
+        # .bak becomes a second name of the old base and the new one replaces it in one step,
+        # so readers never find the base missing
+        if os.path.exists(database_path + '.bak'):
+            os.remove(database_path + '.bak')
+        os.link(database_path, database_path + '.bak')
+        os.replace(database_path + '.tmp', database_path)
+
+        # only after the base has them, the segments can go
+        _write_atomic(os.path.join(segment_dir(database_path), COMPACTED_MARKER), str(last_seq))
+        for seq, filepath in segments:
+            os.remove(filepath)
+
+        print('compacted {} segments into {}'.format(len(segments), database_path))
+        return True
+    finally:
+        lock.release()
+
+
+def maybe_compact_in_background(database_path, max_segments=COMPACT_AFTER_SEGMENTS):
+    if len(list_segments(database_path)) < max_segments:
+        return None
+
+    t = threading.Thread(target=compact, args=(database_path,), daemon=True)
+    t.start()
+    return t
@@ -0,0 +1,333 @@
+import json
+import os
+import sqlite3
+import sys
+
+try:
+    from tools.db_ops import set_op, merge_fields
+    from tools.time_utils import record_epoch
+except:
+    from app.tools.db_ops import set_op, merge_fields
+    from app.tools.time_utils import record_epoch
+
+
+# ---------------
+# SQLITE BACKEND
+# ---------------
+# in sqlite mode each db lives in ./db/<name>.sqlite3 next to its json file.
+# the big lists (trend snapshots, trend searches, top posts, hashtags) are rows in the records table,
+# indexed by url, label and time. everything else (timestamps etc) is a small json skeleton in meta.
+# load_db() still returns the same dict as the json file, so nothing above db_utils has to change,
+# but routes can use query_records() for indexed range queries instead of scanning lists.
+
+# lists stored as rows instead of inside the skeleton
+RECORD_LISTS = [
+    ('trends', 'include_hashtags', 'content'),  # daily_database.json
+    ('trends', 'include_hashtags', 'hourly'),   # rolled up trend history, see retention
+    ('trends', 'include_hashtags', 'daily'),
+    ('trends', 'exclude_hashtags', 'content'),
+    ('trends', 'exclude_hashtags', 'hourly'),
+    ('trends', 'exclude_hashtags', 'daily'),
+    ('hashtags', 'content'),
+    ('trends',),                                # daily_trend_search_database.json
+    ('top_posts',),                             # daily_top_rt_database.json
+]
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    list TEXT NOT NULL,
+    label TEXT,
+    url TEXT,
+    epoch INTEGER,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS records_list_url ON records (list, url);
+CREATE INDEX IF NOT EXISTS records_list_label ON records (list, label);
+CREATE INDEX IF NOT EXISTS records_list_epoch ON records (list, epoch);
+'''
+
+
+def sqlite_path(database_path):
+    return os.path.splitext(database_path)[0] + '.sqlite3'
+
+
+def _connect(database_path):
+    conn = sqlite3.connect(sqlite_path(database_path), timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _list_name(path):
+    return '/'.join(path)
+
+
+def _is_record_list(path):
+    return tuple(path) in RECORD_LISTS
+
+
+def _record_row(list_name, record):
+    label = record.get('label') if isinstance(record, dict) else None
+    url = record.get('url') if isinstance(record, dict) else None
+    # records without a time sort first instead of being NULL, so range queries can stay on the index
+    return (list_name, label, url, record_epoch(record), json.dumps(record, ensure_ascii=False, separators=(',', ':')))
+
+
+def _insert_records(conn, path, records):
+    list_name = _list_name(path)
+    # one executemany per list instead of one statement per record
+    conn.executemany('INSERT INTO records (list, label, url, epoch, doc) VALUES (?, ?, ?, ?, ?)',
+                     [_record_row(list_name, r) for r in records])
+
+
+def _upsert_records(conn, path, records, key, fields=None):
+    """
+    indexed lookup of the stored versions, in place update of those, one batched insert for the rest
+    """
+    list_name = _list_name(path)
+    updates = []
+    inserts = []
+    seen = {}
+    for r in records:
+        value = r.get(key)
+        if value in seen:
+            stored = seen[value]
+        else:
+            row = conn.execute('SELECT id, doc FROM records WHERE list = ? AND {} = ? ORDER BY id LIMIT 1'.format(key),
+                               (list_name, value)).fetchone()
+            stored = seen[value] = [row[0], json.loads(row[1])] if row else None
+
+        if stored is None:
+            inserts.append(r)
+            continue
+
+        stored[1] = merge_fields(stored[1], r, fields) if fields else r
+        updates.append(stored)
+
+    conn.executemany('UPDATE records SET doc = ? WHERE id = ?',
+                     [(json.dumps(doc, ensure_ascii=False, separators=(',', ':')), row_id) for row_id, doc in updates])
+    _insert_records(conn, path, inserts)
+
+
+def _load_skeleton(conn):
+    row = conn.execute("SELECT value FROM meta WHERE key = 'skeleton'").fetchone()
+    return json.loads(row[0]) if row else {}
+
+
+def _save_skeleton(conn, skeleton):
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('skeleton', ?)",
+                 (json.dumps(skeleton, ensure_ascii=False),))
+
+
+def _store_value(conn, skeleton, path, value):
+    """
+    sets value at path. record lists found at or below path go to the records table,
+    the rest into the skeleton
+    """
+    if _is_record_list(path) and isinstance(value, list):
+        conn.execute('DELETE FROM records WHERE list = ?', (_list_name(path),))
+        _insert_records(conn, path, value)
+        value = []
+    elif isinstance(value, dict):
+        value = dict(value)
+        for k in list(value.keys()):
+            sub_path = list(path) + [k]
+            if any(r[:len(sub_path)] == tuple(sub_path) for r in RECORD_LISTS):
+                value[k] = _store_value(conn, skeleton, sub_path, value[k])
+
+    if not path:
+        return value
+
+    container = skeleton
+    for k in path[:-1]:
+        container = container.setdefault(k, {})
+    container[path[-1]] = value
+    return value
+
+
+def _ensure_imported(database_path):
+    # first use of sqlite mode on an existing deployment: pick up the json db
+    if not sqlite_db_exists(database_path) and os.path.exists(database_path):
+        import_json_db(database_path)
+
+
+def apply_ops_sqlite(ops, database_path, debug=False):
+    """
+    same ops as tools.db_ops.apply_ops, applied in one sqlite transaction
+    """
+    _ensure_imported(database_path)
+    conn = _connect(database_path)
+    try:
+        with conn:
+            skeleton = _load_skeleton(conn)
+            skeleton_dirty = False
+
+            for op in ops:
+                path = op['path']
+                kind = op['op']
+
+                if kind == 'set':
+                    _store_value(conn, skeleton, path, op['value'])
+                    skeleton_dirty = True
+
+                elif kind == 'append' and _is_record_list(path):
+                    unique_key = op.get('unique_key')
+                    if unique_key in ('url', 'label'):
+                        # indexed delete of older copies, the new version goes to the end
+                        conn.executemany('DELETE FROM records WHERE list = ? AND {} = ?'.format(unique_key),
+                                         [(_list_name(path), r.get(unique_key)) for r in op['records']])
+                    _insert_records(conn, path, op['records'])
+
+                elif kind == 'upsert' and _is_record_list(path) and op['key'] in ('url', 'label'):
+                    _upsert_records(conn, path, op['records'], op['key'], op.get('fields'))
+
+                elif kind == 'trim' and _is_record_list(path):
+                    conn.execute('DELETE FROM records WHERE id IN '
+                                 '(SELECT id FROM records WHERE list = ? ORDER BY id LIMIT ?)',
+                                 (_list_name(path), op['count']))
+
+                else:
+                    raise ValueError('sqlite backend cannot apply {} on {}'.format(kind, path))
+
+            if skeleton_dirty:
+                _save_skeleton(conn, skeleton)
+    finally:
+        conn.close()
+
+    if debug:
+        print('{} ops applied to {}'.format(len(ops), sqlite_path(database_path)))
+
+
+def load_sqlite_db(database_path):
+    """
+    compatibility reader, rebuilds the same dict the json file would hold
+    """
+    _ensure_imported(database_path)
+    conn = _connect(database_path)
+    try:
+        state = _load_skeleton(conn)
+        for path in RECORD_LISTS:
+            container = state
+            try:
+                for k in path[:-1]:
+                    container = container[k]
+                if not isinstance(container.get(path[-1]), list):
+                    continue
+            except (KeyError, TypeError, AttributeError):
+                continue
+
+            rows = conn.execute('SELECT doc FROM records WHERE list = ? ORDER BY id', (_list_name(path),))
+            container[path[-1]] = [json.loads(r[0]) for r in rows]
+        return state
+    finally:
+        conn.close()
+
+
+def query_records(database_path, path, since=None, until=None, label=None, after=None, key='label', limit=None):
+    """
+    indexed range query over one record list.
+    :param path: e.g. ['top_posts']
+    :param since: epoch seconds, inclusive
+    :param until: epoch seconds, exclusive
+    :param label:
+    :param after: (epoch, key) of the last record of the previous page
+    :param key: 'label' or 'url', orders records of the same epoch
+    :param limit:
+    :return: [(epoch, key, record), ...] in time order
+    """
+    if key not in ('label', 'url'):
+        raise ValueError('records can only be ordered by label or url, not {}'.format(key))
+    # same as time_index.record_key, records without one sort first
+    key_sql = "COALESCE({}, '')".format(key)
+
+    sql = 'SELECT epoch, {}, doc FROM records WHERE list = ?'.format(key_sql)
+    params = [_list_name(path)]
+    if since is not None:
+        sql += ' AND epoch >= ?'
+        params.append(since)
+    if until is not None:
+        sql += ' AND epoch < ?'
+        params.append(until)
+    if label is not None:
+        sql += ' AND label = ?'
+        params.append(label)
+    if after is not None:
+        sql += ' AND (epoch > ? OR (epoch = ? AND {} > ?))'.format(key_sql)
+        params.extend([after[0], after[0], after[1]])
+    sql += ' ORDER BY epoch, {}, id'.format(key_sql)
+    if limit is not None:
+        sql += ' LIMIT ?'
+        params.append(limit)
+
+    _ensure_imported(database_path)
+    conn = _connect(database_path)
+    try:
+        return [(epoch, record_key, json.loads(doc)) for epoch, record_key, doc in conn.execute(sql, params)]
+    finally:
+        conn.close()
+
+
+def sqlite_version(database_path):
+    # in WAL mode commits land in the -wal file first
+    path = sqlite_path(database_path)
+    version = []
+    for p in (path, path + '-wal'):
+        try:
+            st = os.stat(p)
+            version.append((st.st_ino, st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            version.append(None)
+    return tuple(version)
+
+
+def sqlite_db_exists(database_path):
+    return os.path.exists(sqlite_path(database_path))
+
+
+def import_json_db(database_path, debug=False):
+    """
+    one shot import of an existing json db (plain file, not segments) into its sqlite file.
+    replaces whatever the sqlite file held before.
+    """
+    with open(database_path, 'r') as json_db:
+        state = json.load(json_db)
+
+    conn = _connect(database_path)
+    try:
+        with conn:
+            conn.execute('DELETE FROM records')
+            conn.execute("DELETE FROM meta WHERE key = 'skeleton'")
+        apply_ops_sqlite([set_op([k], v) for k, v in state.items()], database_path, debug=debug)
+    finally:
+        conn.close()
+
+    count = _count_records(database_path)
+    print('imported {} into {} ({} records)'.format(database_path, sqlite_path(database_path), count))
+    return count
+
+
+def _count_records(database_path):
+    conn = _connect(database_path)
+    try:
+        return conn.execute('SELECT COUNT(*) FROM records').fetchone()[0]
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    # python -m tools.sqlite_store [db paths...]   (from ./app)
+    paths = sys.argv[1:] or ['./db/daily_database.json',
+                             './db/daily_trend_search_database.json',
+                             './db/daily_top_rt_database.json']
+    for p in paths:
+        if os.path.exists(p):
+            import_json_db(p)
+        else:
+            print('skipping {}, not found'.format(p))
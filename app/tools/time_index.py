@@ -0,0 +1,155 @@
+import base64
+import datetime
+from bisect import bisect_left, bisect_right
+
+try:
+    from tools import db_utils
+    from tools import sqlite_store
+    from tools.time_utils import record_epoch
+except:
+    from app.tools import db_utils
+    from app.tools import sqlite_store
+    from app.tools.time_utils import record_epoch
+
+
+# -----------------------------
+# TIME INDEX / CURSOR PAGINATION
+# -----------------------------
+# the stored lists are in insertion order, which is only roughly time order.
+# per snapshot we sort (epoch, key, position) once, after that a page is two binary searches and a slice.
+# a cursor is the (epoch, key) of the last record a client got, so the next page starts right after it.
+# the key (url of a top post, label of a trend) tells apart records of the same time, e.g. the trends of one
+# snapshot. not the position: retention and the adjust_* trims drop records from the front of the list,
+# which shifts every position in between two pages.
+# in sqlite mode the same pages come from the (list, epoch) index instead.
+
+time_format_full_with_timezone = '%Y-%m-%d %H:%M:%S%z'
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# record field that orders records of the same epoch, per list. 'label' for the rest
+CURSOR_KEYS = {
+    ('top_posts',): 'url',
+}
+
+
+def parse_time_arg(value):
+    """
+    query string time -> epoch seconds. accepts epoch seconds, '2018-08-21 17:00:00+0900' or '2018-08-21' (utc)
+    """
+    if value is None or value == '':
+        return None
+    if value.lstrip('-').isdigit():
+        return int(value)
+    # '+' in a query string arrives as a space
+    value = value.strip()
+    if len(value) > 19 and value[19] == ' ':
+        value = value[:19] + '+' + value[20:]
+    for fmt in (time_format_full_with_timezone, '%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+        try:
+            dt = datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=datetime.timezone.utc)
+        return int(dt.timestamp())
+    raise ValueError('unrecognized time: {}'.format(value))
+
+
+def cursor_key(path):
+    return CURSOR_KEYS.get(tuple(path), 'label')
+
+
+def record_key(record, key):
+    value = record.get(key) if isinstance(record, dict) else None
+    return value if isinstance(value, str) else ''
+
+
+def encode_cursor(epoch, key):
+    # urls and labels go into a query string, so the key is base64'd
+    return '{}_{}'.format(epoch, base64.urlsafe_b64encode(key.encode('utf-8')).decode('ascii').rstrip('='))
+
+
+def decode_cursor(cursor):
+    """
+    :return: (epoch, key), None without a cursor. ValueError if it isn't one
+    """
+    if not cursor:
+        return None
+    epoch, key = cursor.split('_', 1)
+    key = base64.b64decode(key + '=' * (-len(key) % 4), altchars=b'-_', validate=True).decode('utf-8')
+    return int(epoch), key
+
+
+def build_time_index(records, key='label'):
+    """
+    :param key: record field that orders records of the same epoch, see CURSOR_KEYS
+    :return: sorted [(epoch, key, position), ...]
+    """
+    return sorted((record_epoch(r), record_key(r, key), i) for i, r in enumerate(records))
+
+
+def page_index(index, since=None, until=None, after=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    :param index: from build_time_index
+    :param since: epoch, inclusive
+    :param until: epoch, exclusive
+    :param after: decoded cursor
+    :param limit:
+    :return: list of (epoch, key, position) for this page, has_more
+    """
+    start = 0
+    if since is not None:
+        start = bisect_left(index, (since,))
+    if after is not None:
+        # past every record of that epoch and key
+        start = max(start, bisect_right(index, (after[0], after[1], float('inf'))))
+
+    end = len(index)
+    if until is not None:
+        end = bisect_left(index, (until,))
+
+    stop = min(end, start + limit)
+    return index[start:stop], stop < end
+
+
+def get_records(full_db, path):
+    records = full_db
+    for k in path:
+        records = records[k]
+    return records
+
+
+def page_records(database_path, path, since=None, until=None, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    one page of the record list at path, in time order
+    :param database_path:
+    :param path: e.g. ['top_posts']
+    :param since: epoch, inclusive
+    :param until: epoch, exclusive
+    :param cursor: next_cursor of the previous page
+    :param limit:
+    :return: records, next_cursor (None on the last page)
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    after = decode_cursor(cursor)
+    key = cursor_key(path)
+
+    if db_utils.STORAGE_MODE == 'sqlite':
+        # one extra row tells us if there is another page
+        rows = sqlite_store.query_records(database_path, path, since=since, until=until, after=after, key=key,
+                                          limit=limit + 1)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1][0], rows[-1][1]) if has_more and rows else None
+        return [r[2] for r in rows], next_cursor
+
+    snapshot = db_utils.get_db_snapshot(database_path)
+    index = db_utils.snapshot_derived(snapshot, 'time_index:' + '/'.join(path),
+                                      lambda db: build_time_index(get_records(db, path), key=key))
+    records = get_records(snapshot.data, path)
+
+    page, has_more = page_index(index, since=since, until=until, after=after, limit=limit)
+    next_cursor = encode_cursor(page[-1][0], page[-1][1]) if has_more and page else None
+    return [records[position] for epoch, _, position in page], next_cursor
@@ -1,14 +1,153 @@
 import datetime, time
+from functools import lru_cache
 
 
-def str_2_datetime(str_in, input_format='%Y-%m-%d', timezone='JST'):
+time_format_full_with_timezone = '%Y-%m-%d %H:%M:%S%z'
+time_format_full_no_timezone = '%Y-%m-%d %H:%M:%S'
+time_format_twitter_trends = '%Y-%m-%dT%H:%M:%SZ'
+time_format_twitter_created_at = '%a %b %d %H:%M:%S %z %Y'
+time_format_date = '%Y-%m-%d'
+
+_months = {'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+           'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12}
+_weekdays = {'Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'}
+_timezones = {}
+
+
+# ------------
+# FAST PARSERS
+# ------------
+# strptime is slow and we only ever see a handful of fixed formats, so those are sliced by hand.
+# anything that doesn't look exactly right goes back to strptime, which also raises the usual ValueError.
+# (the digit checks matter, int() alone would take '+1' or ' 1' where strptime doesn't)
+def _offset(str_in):
+    # '+0900' -> tzinfo, same as what %z gives
+    tz = _timezones.get(str_in)
+    if tz is None:
+        if len(str_in) != 5 or str_in[0] not in '+-' or not str_in[1:].isdigit():
+            raise ValueError(str_in)
+        minutes = int(str_in[1:3]) * 60 + int(str_in[3:5])
+        if str_in[0] == '-':
+            minutes = -minutes
+        tz = _timezones[str_in] = datetime.timezone(datetime.timedelta(minutes=minutes))
+    return tz
+
+
+def _parse_full(s, tz=None):
+    # 2018-09-03 10:38:28
+    if s[4] != '-' or s[7] != '-' or s[10] != ' ' or s[13] != ':' or s[16] != ':' or \
+            not (s[0:4] + s[5:7] + s[8:10] + s[11:13] + s[14:16] + s[17:19]).isdigit():
+        raise ValueError(s)
+    return datetime.datetime(int(s[0:4]), int(s[5:7]), int(s[8:10]),
+                             int(s[11:13]), int(s[14:16]), int(s[17:19]), tzinfo=tz)
+
+
+def _parse_full_with_timezone(s):
+    # 2018-09-03 10:38:28+0000
+    if len(s) != 24:
+        raise ValueError(s)
+    return _parse_full(s, _offset(s[19:]))
+
+
+def _parse_full_no_timezone(s):
+    if len(s) != 19:
+        raise ValueError(s)
+    return _parse_full(s)
+
+
+def _parse_twitter_trends(s):
+    # 2018-08-21T08:00:00Z, naive like strptime gives it
+    if len(s) != 20 or s[10] != 'T' or s[19] != 'Z':
+        raise ValueError(s)
+    return _parse_full(s[:10] + ' ' + s[11:19])
+
+
+def _parse_twitter_created_at(s):
+    # Mon Sep 03 10:38:28 +0000 2018
+    if len(s) != 30 or s[3] != ' ' or s[7] != ' ' or s[10] != ' ' or s[13] != ':' or s[16] != ':' or \
+            s[19] != ' ' or s[25] != ' ' or s[0:3] not in _weekdays or \
+            not (s[8:10] + s[11:13] + s[14:16] + s[17:19] + s[26:30]).isdigit():
+        raise ValueError(s)
+    return datetime.datetime(int(s[26:30]), _months[s[4:7]], int(s[8:10]),
+                             int(s[11:13]), int(s[14:16]), int(s[17:19]), tzinfo=_offset(s[20:25]))
+
+
+def _parse_date(s):
+    if len(s) != 10 or s[4] != '-' or s[7] != '-' or not (s[0:4] + s[5:7] + s[8:10]).isdigit():
+        raise ValueError(s)
+    return datetime.datetime(int(s[0:4]), int(s[5:7]), int(s[8:10]))
+
+
+_fast_parsers = {
+    time_format_full_with_timezone: _parse_full_with_timezone,
+    time_format_full_no_timezone: _parse_full_no_timezone,
+    time_format_twitter_trends: _parse_twitter_trends,
+    time_format_twitter_created_at: _parse_twitter_created_at,
+    time_format_date: _parse_date,
+}
+
+
+@lru_cache(maxsize=8192)
+def _parse(str_in, input_format):
+    # datetimes are immutable, so the same object can be handed out to every caller
+    parser = _fast_parsers.get(input_format)
+    if parser is not None:
+        try:
+            return parser(str_in)
+        except (ValueError, KeyError, IndexError):
+            pass
     return datetime.datetime.strptime(str_in, input_format)
 
 
+def str_2_datetime(str_in, input_format='%Y-%m-%d', timezone='JST'):
+    return _parse(str_in, input_format)
+
+
 def datetime_2_str(datetime_in, output_format='%Y-%m-%d'):
     return datetime_in.strftime(output_format)
 
 
+def datetime_2_epoch(datetime_in):
+    return int(datetime_in.timestamp())
+
+
+def str_2_epoch(str_in, input_format=time_format_full_with_timezone):
+    return datetime_2_epoch(_parse(str_in, input_format))
+
+
+def record_epoch(record):
+    """
+    epoch seconds of a stored trend snapshot ('epoch' / 'time') or tweet ('timestamp'), 0 if it has none.
+    uses the stored epoch when there is one, so nothing gets parsed
+    """
+    if not isinstance(record, dict):
+        return 0
+    epoch = record.get('epoch')
+    if isinstance(epoch, int):
+        return epoch
+
+    time_str = record.get('time')
+    timestamp = record.get('timestamp')
+    if not time_str and isinstance(timestamp, dict):
+        if isinstance(timestamp.get('created_epoch'), int):
+            return timestamp['created_epoch']
+        time_str = timestamp.get('created')
+    try:
+        return str_2_epoch(time_str)
+    except (TypeError, ValueError):
+        return 0
+
+
+def records_after(records, epoch):
+    """
+    the records at the end of a (time ordered) list that are newer than epoch, without scanning the rest
+    """
+    i = len(records)
+    while i and record_epoch(records[i - 1]) > epoch:
+        i -= 1
+    return records[i:]
+
+
 def str_to_unix_timestamp(str_in=1535517446):
     if type(str_in) == str:
         str_in = int(str_in)
@@ -21,4 +160,3 @@ def str_to_unix_timestamp(str_in=1535517446):
     #print("timestamp {} to datetime {}".format(timestamp, dt))
 
     return timestamp
-
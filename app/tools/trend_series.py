@@ -0,0 +1,118 @@
+import threading
+from array import array
+from bisect import bisect_left
+
+try:
+    from tools.db_utils import sync_snapshot_view, db_path
+    from tools.retention import trend_volume
+    from tools.time_utils import record_epoch
+except:
+    from app.tools.db_utils import sync_snapshot_view, db_path
+    from app.tools.retention import trend_volume
+    from app.tools.time_utils import record_epoch
+
+
+# ------------------
+# TREND TIME SERIES
+# ------------------
+# per label volume/time series of daily_database.json, so "how did label X evolve" doesn't scan every snapshot.
+# built once per process from the db (daily + hourly aggregates, then raw snapshots),
+# after that every trend update appends its snapshot (or, in a serving-only process, the tail of each new db version),
+# O(new snapshots).
+# the series are two arrays of ints per label (epochs, volumes), in time order.
+# points at or before the last one of a label are skipped, so feeding the same snapshot twice is harmless.
+
+_series = {}
+# epoch of the newest snapshot, the labels that have a point there are the ones trending now
+_latest = {"epoch": 0}
+# db version the index has caught up with
+_synced = {"version": None}
+_lock = threading.Lock()
+
+
+def _add(label, epoch, volume):
+    s = _series.get(label)
+    if s is None:
+        s = _series[label] = (array('q'), array('q'))
+    epochs, volumes = s
+    if epochs and epoch <= epochs[-1]:
+        return
+    epochs.append(epoch)
+    volumes.append(int(volume))
+    if epoch > _latest['epoch']:
+        _latest['epoch'] = epoch
+
+
+def _add_records(records):
+    for r in records:
+        epoch = record_epoch(r)
+        if not epoch or r.get('label') is None:
+            continue
+        if 'samples' in r:
+            # hourly / daily aggregate from retention
+            _add(r['label'], epoch, round(r['volume_avg']))
+        else:
+            _add(r['label'], epoch, trend_volume(r))
+
+
+# every tier of the trends in the main db, oldest first
+_TIERS = [['trends', 'include_hashtags', 'daily'],
+          ['trends', 'include_hashtags', 'hourly'],
+          ['trends', 'include_hashtags', 'content']]
+
+
+def _sync(database_path):
+    sync_snapshot_view(_synced, _latest, _add_records, _TIERS, _TIERS[-1], database_path=database_path)
+
+
+def add_snapshots(records, database_path=db_path):
+    """
+    call with the trend snapshots that were just written to the db
+    """
+    with _lock:
+        _sync(database_path)
+        _add_records(records)
+
+
+def get_series(label, since=None, until=None, database_path=db_path):
+    """
+    :param label:
+    :param since: epoch, inclusive
+    :param until: epoch, exclusive
+    :param database_path:
+    :return: (epochs, volumes) as lists, None if the label was never seen
+    """
+    with _lock:
+        _sync(database_path)
+        s = _series.get(label)
+        if s is None:
+            return None
+        epochs, volumes = s
+        start = bisect_left(epochs, since) if since is not None else 0
+        end = bisect_left(epochs, until) if until is not None else len(epochs)
+        return epochs[start:end].tolist(), volumes[start:end].tolist()
+
+
+def rising(limit=10, database_path=db_path):
+    """
+    currently trending labels by how much their volume grew since their previous point.
+    a label seen for the first time counts from 0
+    :return: [{label, volume, previous, delta}, ...] biggest delta first
+    """
+    with _lock:
+        _sync(database_path)
+        latest = _latest['epoch']
+        ranking = []
+        for label, (epochs, volumes) in _series.items():
+            if epochs[-1] != latest:
+                continue
+            previous = volumes[-2] if len(volumes) > 1 else 0
+            ranking.append({
+                "label": label,
+                "volume": volumes[-1],
+                "previous": previous,
+                "delta": volumes[-1] - previous
+            })
+
+    ranking.sort(key=lambda r: r['delta'], reverse=True)
+    return ranking[:limit]
@@ -1,23 +1,34 @@
 import json
-import yweather
+import os
 import datetime
 import pytz
 from urllib import parse
+from concurrent.futures import ThreadPoolExecutor
 
 import twitter
 
 try:
     from hidden.hidden import Twitter
 
-    from tools.db_utils import load_db, update_db
-    from tools.time_utils import str_2_datetime, datetime_2_str, str_to_unix_timestamp
+    from tools.db_utils import load_db, apply_db_ops, on_commit
+    from tools.db_ops import set_op, append_op, upsert_op
+    from tools.time_utils import str_2_datetime, datetime_2_str, datetime_2_epoch, str_to_unix_timestamp
     from tools.baseutils import get_filepath
+    from tools.woeid import get_woeid
+    from tools import trend_series, hourly_view, metrics, search_cache, search_batch
+    from tools.rate_limit import search_budget, trends_budget, update_from_api, plan, rate_limit_status, \
+        is_rate_limit_error
 except:
     from app.hidden.hidden import Twitter
 
-    from app.tools.db_utils import load_db, update_db
-    from app.tools.time_utils import str_2_datetime, datetime_2_str, str_to_unix_timestamp
+    from app.tools.db_utils import load_db, apply_db_ops, on_commit
+    from app.tools.db_ops import set_op, append_op, upsert_op
+    from app.tools.time_utils import str_2_datetime, datetime_2_str, datetime_2_epoch, str_to_unix_timestamp
     from app.tools.baseutils import get_filepath
+    from app.tools.woeid import get_woeid
+    from app.tools import trend_series, hourly_view, metrics, search_cache, search_batch
+    from app.tools.rate_limit import search_budget, trends_budget, update_from_api, plan, rate_limit_status, \
+        is_rate_limit_error
 
 
 db_path = get_filepath('./db/daily_database.json')
@@ -31,6 +42,24 @@ time_format_twitter_created_at = '%a %b %d %H:%M:%S %z %Y'
 
 jp_timezone = pytz.timezone('Asia/Tokyo')
 
+# how many trend keywords are searched at the same time (1 = one after the other)
+search_workers = int(os.environ.get('TWITTER_SEARCH_WORKERS', 8))
+
+# store epoch seconds next to the display strings ('epoch', 'timestamp.created_epoch'),
+# so sorting and time filters never have to parse them back
+store_epoch_timestamps = os.environ.get('STORE_EPOCH_TIMESTAMPS', '1') == '1'
+
+# trend searches only fetch what is newer than the last search of the same label (since_id),
+# and fold it into that label's entry in the trend search db instead of adding another snapshot
+incremental_search = os.environ.get('INCREMENTAL_SEARCH', '1') == '1'
+# newest tweets kept per label entry when merging
+search_tweets_per_label = int(os.environ.get('SEARCH_TWEETS_PER_LABEL', 200))
+
+# what changes on a top post that is seen again
+top_posts_update_fields = ['likes', 'retweet_count', 'timestamp.last_checked']
+if store_epoch_timestamps:
+    top_posts_update_fields.append('timestamp.last_checked_epoch')
+
 
 t_secrets = Twitter()
 consumer_key = t_secrets.consumer_key
@@ -42,10 +71,25 @@ api = twitter.Api(consumer_key=consumer_key,
                   consumer_secret=consumer_secret,
                   access_token_key=access_token_key,
                   access_token_secret=access_token_secret,
-                  sleep_on_rate_limit=True)
+                  sleep_on_rate_limit=False)
+# no sleeping inside python-twitter, that blocked the scheduler thread without telling anyone.
+# the budgets in tools.rate_limit decide up front what fits in the current window instead.
+
+
+def set_api(new_api):
+    """
+    replaces the twitter.Api every call in this module goes through,
+    e.g. with tools.fake_twitter.FakeTwitterApi to run the update cycle offline
+    """
+    global api
+    api = new_api
 
 
 def check_rate_limit(endpoint="GetSearch", debug=False):
+    """
+    rate limit status from the local model in tools.rate_limit, which is kept up to date from
+    response headers. no call to twitter
+    """
     # check time now
     time_now = datetime.datetime.utcnow()
 
@@ -53,11 +97,7 @@ def check_rate_limit(endpoint="GetSearch", debug=False):
         print("time now: ", time_now)
         print("timestamp now: ", time_now.timestamp())
 
-    # twitter get rate limits from endpoint
-    api.InitializeRateLimit()
-
-    response = api.rate_limit
-    rl = response.resources
+    rl = rate_limit_status()
 
     if endpoint.lower() == "getsearch":
         output = rl['search']
@@ -88,16 +128,50 @@ def check_rate_limit(endpoint="GetSearch", debug=False):
     return rl_output
 
 
+def _get_search(endpoint, description, **kwargs):
+    """
+    one api.GetSearch within the search budget
+    :param endpoint: label of the call in the metrics
+    :param description: what is searched, for the log
+    :return: the response, None if the search was skipped because the window is used up
+    """
+    if not search_budget.try_acquire():
+        print('search budget used up for this window, skipping search for {}'.format(description))
+        metrics.rate_limited_total.inc(family='search')
+        return None
+
+    metrics.api_calls_total.inc(endpoint=endpoint)
+    try:
+        with metrics.api_call_seconds.time(endpoint=endpoint):
+            response = api.GetSearch(**kwargs)
+    except twitter.TwitterError as e:
+        if not is_rate_limit_error(e):
+            raise
+        # the local budget thought there were calls left. none until the window resets
+        print('twitter says the search window is used up, skipping search for {}'.format(description))
+        search_budget.exhaust()
+        metrics.rate_limited_total.inc(family='search')
+        return None
+    update_from_api(api, 'search')
+    return response
+
+
 # API call
-def get_search_tweets(query="pokemon", return_list=['media', 'text', 'hashtags', 'favorite_count', 'retweet_count', 'retweeted_status', 'id'], count=100, debug=False):
+def get_search_tweets(query="pokemon", return_list=['media', 'text', 'hashtags', 'favorite_count', 'retweet_count', 'retweeted_status', 'id'], count=100, since_id=None, debug=False):
     """
     search limit: 180 / 15 mins
     status limit:
     :param query:
-    :return:
+    :param since_id: only statuses newer than this id
+    :return: None if the search was skipped because the window is used up
     """
     # currently limited to japanese, as a way to geofence searches to Japan
-    response = api.GetSearch(lang="ja", term=query, count=count)
+    if since_id:
+        response = _get_search('search', query, lang="ja", term=query, count=count, since_id=since_id)
+    else:
+        response = _get_search('search', query, lang="ja", term=query, count=count)
+    if response is None:
+        return None
 
     output = []
     for r in response:
@@ -136,7 +210,9 @@ def get_search_tweet_images_raw(raw_query="q=min_retweets%3A10000%20filter%3Aima
     raw_query = escape_raw_query(raw_query)
 
     # currently limited to japanese, as a way to geofence searches to Japan
-    response = api.GetSearch(raw_query=raw_query)
+    response = _get_search('search_raw', raw_query, raw_query=raw_query)
+    if response is None:
+        return []
 
     output = []
     for r in response:
@@ -161,102 +237,182 @@ def get_search_tweet_images_raw(raw_query="q=min_retweets%3A10000%20filter%3Aima
     return output
 
 
-def process_tweets(tweets_response, keep_all=False, debug=False):
+class TweetRecord(object):
     """
-    by default, processing discards tweets with no retweets or likes
-    keep_all=False keeps all tweets, whether they have retweets or not
+    one processed tweet, kept compact (slots, shared check time) until as_dict at the serialization boundary
+    """
+    __slots__ = ('likes', 'media', 'text', 'hashtags', 'retweet_count', 'url', 'created', 'created_epoch',
+                 'checked', 'extra')
+
+    def __init__(self, likes, media, text, hashtags, retweet_count, url, created, created_epoch, checked, extra):
+        self.likes = likes
+        self.media = media
+        self.text = text
+        self.hashtags = hashtags
+        self.retweet_count = retweet_count
+        self.url = url
+        self.created = created
+        self.created_epoch = created_epoch
+        # (last_checked str, last_checked epoch), the same tuple for the whole batch
+        self.checked = checked
+        # keys outside the usual return_list, or an empty id
+        self.extra = extra
+
+    def as_dict(self):
+        # same keys, in the same order, as the tweet dicts process_tweets always returned
+        output_tweet = {'likes': self.likes}
+        if self.media is not _missing:
+            output_tweet['media'] = self.media
+        if self.text is not _missing:
+            output_tweet['text'] = self.text
+        if self.hashtags is not _missing:
+            output_tweet['hashtags'] = self.hashtags
+        if self.retweet_count is not _missing:
+            output_tweet['retweet_count'] = self.retweet_count
+        if self.url is not None:
+            output_tweet['url'] = self.url
+        elif self.extra and 'id' in self.extra:
+            output_tweet['id'] = self.extra['id']
+        if self.created is not None:
+            output_tweet['timestamp'] = {
+                "created": self.created,
+                "last_checked": self.checked[0]
+            }
+            if self.created_epoch is not None:
+                output_tweet['timestamp']['created_epoch'] = self.created_epoch
+                output_tweet['timestamp']['last_checked_epoch'] = self.checked[1]
+        if self.extra:
+            output_tweet.update(self.extra)
+        return output_tweet
+
+
+_missing = object()
+_tweet_keys = frozenset(['favorite_count', 'retweeted_status', 'media', 'id', 'retweet_count', 'created_at',
+                         'text', 'hashtags'])
+
+
+def tweet_as_dict(o):
+    """
+    json.dumps(..., default=tweet_as_dict) for output holding TweetRecords
+    """
+    if isinstance(o, TweetRecord):
+        return o.as_dict()
+    raise TypeError('{} is not JSON serializable'.format(type(o).__name__))
 
-    :param tweets_response:
+
+def iter_tweet_records(tweets_response, keep_all=False, debug=False):
+    """
+    process_tweets as a generator of TweetRecords, one pass, no dicts.
+    tweets that get dropped are dropped before anything is built for them
+
+    :param tweets_response: iterable of tweet dicts, as get_search_tweets returns them
     :param keep_all:
     :param debug:
     :return:
     """
-    tweets = tweets_response
-
-    #print(json.dumps(tweets, indent=4, ensure_ascii=False))
-
-    output_tweets = []
-    for tweet in tweets:
-        # loop through every tweet
-        output_tweet = {}
-        output_tweet['likes'] = 0
-        for k, v in tweet.items():
-            if k == "favorite_count" or k == "retweeted_status":
-                # print('checking favorite_count at {}'.format(k))
-                # print(v)
-                if k == "favorite_count" and v:
-                    output_tweet['likes'] = v
-                elif k == "retweeted_status" and v:
-                    # print("rt:", v)
-                    try:
-                        output_tweet['likes'] = v['favorite_count']
-                    except:
-                        print('favorites not found')
-                        print(v)
-                        pass
-
-            elif k == "media" and v:
-                # turn media dict into img url
-                output_tweet[k] = []
-                for m in v:
-                    output_tweet[k].append(m['media_url_https'])
-
-            elif k == "id" and v:
-                # make url from id and dispose id
-                output_tweet['url'] = "https://twitter.com/anyuser/status/" + str(v)
-
-            elif k == "retweet_count":
-                if v:
-                    if debug: print('       picking this: ', k, v)
-                    output_tweet[k] = v
-                else:
-                    if debug: print('       skipping this: ', k, v)
-                    # not keeping those with 0 RT
-                    output_tweet[k] = 0
-
-            elif k == "created_at":
-                tweet_creation_time = str_2_datetime(v, input_format=time_format_twitter_created_at)
-                tweet_checked_time = datetime.datetime.now(tz=pytz.utc)
-
-                output_tweet['timestamp'] = {
-                    "created": datetime_2_str(tweet_creation_time, output_format=time_format_full_with_timezone),
-                    "last_checked": datetime_2_str(tweet_checked_time, output_format=time_format_full_with_timezone)
-                }
+    # one check time for the whole batch
+    tweet_checked_time = datetime.datetime.now(tz=pytz.utc)
+    checked = (datetime_2_str(tweet_checked_time, output_format=time_format_full_with_timezone),
+               datetime_2_epoch(tweet_checked_time))
+
+    for tweet in tweets_response:
+        likes = tweet.get('favorite_count') or 0
+        retweeted_status = tweet.get('retweeted_status')
+        if retweeted_status:
+            try:
+                likes = retweeted_status['favorite_count']
+            except (KeyError, TypeError):
+                print('favorites not found')
+                print(retweeted_status)
+
+        retweet_count = tweet.get('retweet_count', _missing)
+        if retweet_count is not _missing and not retweet_count:
+            # not keeping those with 0 RT
+            retweet_count = 0
 
-            else:
-                # keep k:v same
-                if debug: print('keeping this: ', k, repr(v))
-                output_tweet[k] = v
+        if debug:
+            print('num of likes: ', likes)
 
-        print('num of likes: ', output_tweet['likes'])
+        if not keep_all and not (likes > 0 and retweet_count is not _missing and retweet_count > 0):
+            continue
 
-        output_tweets.append(output_tweet)
+        media = tweet.get('media', _missing)
+        if media:
+            # turn media dict into img url
+            media = [m['media_url_https'] for m in media]
 
-    output = []
-    if not keep_all:
-        for o in output_tweets:
-            if o['likes'] > 0 and o['retweet_count'] > 0:
-                output.append(o)
-    else:
-        output = output_tweets
+        extra = None
+        tweet_id = tweet.get('id')
+        # make url from id and dispose id
+        url = "https://twitter.com/anyuser/status/" + str(tweet_id) if tweet_id else None
+        if not tweet_id and 'id' in tweet:
+            extra = {'id': tweet_id}
 
-    return output
+        created = created_epoch = None
+        if 'created_at' in tweet:
+            tweet_creation_time = str_2_datetime(tweet['created_at'], input_format=time_format_twitter_created_at)
+            created = datetime_2_str(tweet_creation_time, output_format=time_format_full_with_timezone)
+            if store_epoch_timestamps:
+                created_epoch = datetime_2_epoch(tweet_creation_time)
+
+        if not tweet.keys() <= _tweet_keys:
+            # keep k:v same
+            extra = extra or {}
+            extra.update((k, v) for k, v in tweet.items() if k not in _tweet_keys)
+
+        yield TweetRecord(likes, media, tweet.get('text', _missing), tweet.get('hashtags', _missing), retweet_count,
+                          url, created, created_epoch, checked, extra)
+
+
+def process_tweets(tweets_response, keep_all=False, debug=False):
+    """
+    by default, processing discards tweets with no retweets or likes
+    keep_all=False keeps all tweets, whether they have retweets or not
+
+    :param tweets_response:
+    :param keep_all:
+    :param debug:
+    :return: list of tweet dicts
+    """
+    return [t.as_dict() for t in iter_tweet_records(tweets_response, keep_all=keep_all, debug=debug)]
 
 
 # helper function for search_tweets
-def analyze_trending_keyword(keyword="pokemon", count=100, keep_all=False, debug=False):
+def analyze_trending_keyword(keyword="pokemon", count=100, keep_all=False, records=False, debug=False):
     """
     i can do a 180 of these every 15 mins
     meaning i can analyze 180 keywords every 15 mins, returning all images
     :param keyword:
+    :param records: return TweetRecords instead of dicts (serialize with default=tweet_as_dict)
     :return:
     """
     print('analyzing keyword: {}'.format(keyword))
-    tweets = get_search_tweets(query=keyword, count=count, debug=debug)
+    tweets = get_search_tweets(query=keyword, count=count, debug=debug) or []
 
+    if records:
+        return list(iter_tweet_records(tweets, keep_all=keep_all, debug=debug))
     return process_tweets(tweets, keep_all=keep_all, debug=debug)
 
 
+def search_trending_keyword(keyword, since_id=None, count=50, debug=False):
+    """
+    analyze_trending_keyword for the incremental trend searches
+    :param since_id: id of the newest status the last search of this keyword got
+    :return: TweetRecords of the new statuses, the new since_id (the old one if there was nothing new).
+             None if the search was skipped
+    """
+    print('analyzing keyword: {} (since {})'.format(keyword, since_id))
+    tweets = get_search_tweets(query=keyword, count=count, since_id=since_id, debug=debug)
+    if tweets is None:
+        return None
+
+    newest_id = since_id
+    for t in tweets:
+        if isinstance(t.get('id'), int) and t['id'] > (newest_id or 0):
+            newest_id = t['id']
+    return list(iter_tweet_records(tweets, debug=debug)), newest_id
+
+
 def analyze_top_retweets(min_retweets=10000, debug=False):
     query = "q=min_retweets:{}".format(min_retweets)
     query += " filter:images lang:ja"
@@ -265,8 +421,70 @@ def analyze_top_retweets(min_retweets=10000, debug=False):
     return process_tweets(tweets, keep_all=True, debug=debug)
 
 
+def analyze_trending_keywords(keywords, count=50, max_workers=None, records=False, since_ids=None, debug=False):
+    """
+    analyze_trending_keyword for many keywords, on a bounded pool of threads.
+    every search draws from the shared search_budget, so the pool can't go over 180 / 15 mins.
+    :param keywords:
+    :param count:
+    :param max_workers: defaults to search_workers
+    :param records: see analyze_trending_keyword
+    :param since_ids: {keyword: since_id} to search incrementally with search_trending_keyword
+    :return: list of processed tweets per keyword, in the same order as keywords.
+             with since_ids, (TweetRecords, new since_id) per keyword
+    """
+    if max_workers is None:
+        max_workers = search_workers
+
+    def analyze(keyword):
+        if since_ids is not None:
+            return search_trending_keyword(keyword, since_id=since_ids.get(keyword), count=count, debug=debug)
+        return analyze_trending_keyword(keyword, count=count, records=records, debug=debug)
+
+    return _map_searches(analyze, keywords, max_workers)
+
+
+def _map_searches(search, items, max_workers):
+    if max_workers <= 1 or len(items) <= 1:
+        return [search(i) for i in items]
+
+    # the searches are network bound, so threads are enough. map() keeps the results in order
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as pool:
+        return list(pool.map(search, items))
+
+
+def search_trending_keywords_batched(query, labels, since_ids=None, count=100, debug=False):
+    """
+    one search for several trends, split up again by which trend each status mentions (see tools.search_batch)
+    :param query: the labels OR'ed together, from search_batch.build_queries
+    :param labels:
+    :param since_ids: {label: since_id}. the search goes back to the oldest of them
+    :return: {label: (TweetRecords, new since_id)}, None if the search was skipped
+    """
+    since_ids = since_ids or {}
+    marks = [since_ids.get(label) for label in labels]
+    since_id = min(marks) if all(marks) else None
+
+    print('analyzing {} keywords in one search: {}'.format(len(labels), query))
+    tweets = get_search_tweets(query=query, count=count, since_id=since_id, debug=debug)
+    if tweets is None:
+        return None
+
+    output = {}
+    for label, matched in search_batch.demultiplex(tweets, labels).items():
+        newest_id = since_ids.get(label)
+        if newest_id:
+            # already fetched for this label, the query only went back this far for another one
+            matched = [t for t in matched if isinstance(t.get('id'), int) and t['id'] > newest_id]
+        for t in matched:
+            if isinstance(t.get('id'), int) and t['id'] > (newest_id or 0):
+                newest_id = t['id']
+        output[label] = (list(iter_tweet_records(matched, debug=debug)), newest_id)
+    return output
+
+
 # API call
-def get_top_trends_from_twitter_api(country='Japan', exclude_hashtags=True):
+def get_top_trends_from_twitter_api(country='Japan', exclude_hashtags=True, since_ids=None):
     """
     what is it useful for?
     participation. from twitter API docs
@@ -280,19 +498,34 @@ def get_top_trends_from_twitter_api(country='Japan', exclude_hashtags=True):
     twitter Ads API has a keyword insights endpoint
     ref: https://developer.twitter.com/en/docs/ads/audiences/api-reference/keyword-insights.html#
     :param filter:
+    :param since_ids: {label: since_id} of the previous searches. only newer tweets are fetched,
+                      and every trend search output gets its new since_id
     :return:
     """
     # this stupid WOEID requires yweather to get (a library), because YAHOO itself has stopped supporting it
-    # WOEID
-    woeid_client = yweather.Client()
-    woeid = woeid_client.fetch_woeid(location=country)
+    # WOEID. resolved once and cached, see tools.woeid
+    woeid = get_woeid(country)
 
-    check_rate_limit()
+    if not trends_budget.try_acquire():
+        print('trends budget used up for this window, skipping trends update')
+        metrics.rate_limited_total.inc(family='trends')
+        return json.dumps([]), json.dumps([])
 
-    if exclude_hashtags :
-        trends = api.GetTrendsWoeid(woeid, exclude='hashtags')
-    else:
-        trends = api.GetTrendsWoeid(woeid, exclude=None)
+    metrics.api_calls_total.inc(endpoint='trends')
+    try:
+        with metrics.api_call_seconds.time(endpoint='trends'):
+            if exclude_hashtags :
+                trends = api.GetTrendsWoeid(woeid, exclude='hashtags')
+            else:
+                trends = api.GetTrendsWoeid(woeid, exclude=None)
+    except twitter.TwitterError as e:
+        if not is_rate_limit_error(e):
+            raise
+        print('twitter says the trends window is used up, skipping trends update')
+        trends_budget.exhaust()
+        metrics.rate_limited_total.inc(family='trends')
+        return json.dumps([]), json.dumps([])
+    update_from_api(api, 'trends')
 
     output = []
     images_output = []
@@ -323,11 +556,88 @@ def get_top_trends_from_twitter_api(country='Japan', exclude_hashtags=True):
         images_output.append({
             "label": trend['name'],
             "time": timestamp_utc_str,
-            "tweets": analyze_trending_keyword(trend['name'], count=50)
         })
 
+        if store_epoch_timestamps:
+            output[-1]['epoch'] = images_output[-1]['epoch'] = datetime_2_epoch(timestamp_dt)
+
+    # one search per trend, run concurrently.
+    # trends searched within the search cache ttl reuse that search (see tools.search_cache),
+    # so the window goes to the ones that just showed up
+    use_cache = search_cache.enabled()
+    results = {}
+    to_search = []
+    for t in images_output:
+        label = t['label']
+        if label in results or label in to_search:
+            continue
+        cached = search_cache.get(label) if use_cache else None
+        if cached is None:
+            to_search.append(label)
+        elif since_ids is not None:
+            # its tweets are already merged into the db, nothing new to add
+            results[label] = ([], since_ids.get(label, cached[1]))
+        else:
+            results[label] = cached[0]
+
+    def found(label, tweets, since_id):
+        results[label] = (tweets, since_id) if since_ids is not None else tweets
+        if use_cache:
+            search_cache.put(label, (tweets, since_id))
+
+    def skipped(label):
+        # not searched this time, nothing goes into the search cache
+        if since_ids is not None:
+            # keeps its since_id for next time
+            results[label] = ([], since_ids.get(label))
+        else:
+            stale = search_cache.get_stale(label) if use_cache else None
+            results[label] = stale[0] if stale is not None else []
+
+    # keep one search of the window for the top posts stage that runs after this
+    searches = max(plan('search', len(to_search) + 1) - 1, 0)
+    # trends the window has no room for are searched together (see tools.search_batch)
+    singles, batches = search_batch.plan_searches(to_search, searches)
+    covered = len(singles) + sum(len(labels) for query, labels in batches)
+    if covered < len(to_search):
+        print('only {} of {} trends fit in the current search window'.format(covered, len(to_search)))
+    if batches:
+        print('{} trends searched on their own, {} in {} batched searches'.format(
+            len(singles), covered - len(singles), len(batches)))
+
+    analyzed = analyze_trending_keywords(singles, count=50, since_ids=since_ids or {})
+    for label, searched in zip(singles, analyzed):
+        if searched is None:
+            skipped(label)
+        else:
+            found(label, *searched)
+
+    batched = _map_searches(lambda batch: search_trending_keywords_batched(batch[0], batch[1], since_ids=since_ids),
+                            batches, search_workers)
+    for (query, labels), output_by_label in zip(batches, batched):
+        if output_by_label is None:
+            for label in labels:
+                skipped(label)
+            continue
+        for label, (tweets, since_id) in output_by_label.items():
+            found(label, tweets, since_id)
+
+    # trends that didn't fit in the window
+    for label in to_search[covered:]:
+        skipped(label)
+
+    for trend_output in images_output:
+        if since_ids is not None:
+            trend_output['tweets'], trend_output['since_id'] = results[trend_output['label']]
+        else:
+            trend_output['tweets'] = results[trend_output['label']]
+    if use_cache:
+        print('trend search cache: {hits} hits, {stale_hits} stale, {misses} misses, {searches_saved} searches saved so far'.format(
+            **search_cache.get_stats()))
+
     output_json = json.dumps(output, ensure_ascii=False)
-    images_output_json = json.dumps(images_output, ensure_ascii=False)
+    # the tweets are TweetRecords up to here
+    images_output_json = json.dumps(images_output, ensure_ascii=False, default=tweet_as_dict)
     return output_json, images_output_json
 
 
@@ -428,13 +738,14 @@ def get_top_hashtags_from_twitter(country='Japan', debug=False, cache_duration_m
         # update
         output_list = json.loads(output_json)
 
+        # only the new hashtags are written, not the whole history
         if append_db:
-            output_list = hashtags_cache['content'] + output_list
-
-        cache_db['hashtags']['content'] = output_list
-        cache_db['hashtags']['timestamp'] = datetime_2_str(rq_timestamp, output_format=time_format_full_with_timezone)
+            ops = [append_op(['hashtags', 'content'], output_list)]
+        else:
+            ops = [set_op(['hashtags', 'content'], output_list)]
+        ops.append(set_op(['hashtags', 'timestamp'], datetime_2_str(rq_timestamp, output_format=time_format_full_with_timezone)))
 
-        update_db(cache_db, database_path=db_path, debug=debug)
+        apply_db_ops(ops, database_path=db_path, state=cache_db, debug=debug)
         return output_json
 
 
@@ -457,18 +768,12 @@ def get_update_top_posts_from_twitter(min_retweets=10000, cache_duration_mins=15
     output_list = analyze_top_retweets(min_retweets=min_retweets, debug=debug)
 
     if append_db:
-        # check for same post
-        for o in output_list:
-            # apparently [:] changes list in place (saves ram)
-            # cuts away duplicates of tweets
-            top_posts_cache[:] = [d for d in top_posts_cache if d.get('url') != o['url']]
-
-        # adds new tweets at the end
-        output_list = top_posts_cache + output_list
-
-    top_retweets_db['top_posts'] = output_list
+        # posts seen before get their counts refreshed in place, new posts go at the end
+        ops = [upsert_op(['top_posts'], output_list, key='url', fields=top_posts_update_fields)]
+    else:
+        ops = [set_op(['top_posts'], output_list)]
 
-    update_db(top_retweets_db, database_path=top_retweets_db_path, debug=debug)
+    apply_db_ops(ops, database_path=top_retweets_db_path, state=top_retweets_db, debug=debug)
 
     print('top posts db updated.')
 
@@ -479,6 +784,57 @@ def get_update_top_posts_from_twitter(min_retweets=10000, cache_duration_mins=15
     print('memory freed.')
 
 
+def latest_since_ids(trend_searches):
+    """
+    :param trend_searches: the trend search db's 'trends' list
+    :return: {label: since_id} from the newest entry of every label
+    """
+    since_ids = {}
+    for entry in trend_searches:
+        if entry.get('since_id'):
+            since_ids[entry['label']] = entry['since_id']
+    return since_ids
+
+
+def merge_trend_searches(trend_searches, new_searches, max_tweets=None):
+    """
+    folds this cycle's searches into the stored entries of the same labels:
+    the new tweets first, then the stored ones that weren't fetched again, max_tweets at most.
+    older entries of a label (from before the searches were incremental) are folded in as well, newest first
+
+    :param trend_searches: the trend search db's 'trends' list
+    :param new_searches: this cycle's trend search outputs
+    :param max_tweets: defaults to search_tweets_per_label
+    :return: the merged entries, to append with unique_key='label' (which drops the stored ones)
+    """
+    if max_tweets is None:
+        max_tweets = search_tweets_per_label
+
+    labels = set(s['label'] for s in new_searches)
+    stored = {}
+    for entry in reversed(trend_searches):
+        if entry.get('label') in labels:
+            stored.setdefault(entry['label'], []).append(entry)
+
+    merged = []
+    for search in new_searches:
+        if search['label'] not in labels:
+            # the same label twice in one trends list, the first one wins
+            continue
+        labels.discard(search['label'])
+        tweets = list(search.get('tweets') or [])[:max_tweets]
+        seen = set(t.get('url') for t in tweets)
+        for entry in stored.get(search['label'], []):
+            for t in entry.get('tweets') or []:
+                if len(tweets) >= max_tweets:
+                    break
+                if t.get('url') not in seen:
+                    seen.add(t.get('url'))
+                    tweets.append(t)
+        merged.append(dict(search, tweets=tweets))
+    return merged
+
+
 # database call and caching
 def get_top_trends_from_twitter(country='Japan', exclude_hashtags=False, debug=False, cache_duration_mins=15, append_db=True):
     """
@@ -526,26 +882,41 @@ def get_top_trends_from_twitter(country='Japan', exclude_hashtags=False, debug=F
         output_json = json.dumps(trends_cache['content'], ensure_ascii=False)
         return output_json
     else:
-        output_json, img_output_json = get_top_trends_from_twitter_api(country=country, exclude_hashtags=exclude_hashtags)
+        incremental = incremental_search and append_db
+        since_ids = latest_since_ids(trend_search_db['trends']) if incremental else None
+        output_json, img_output_json = get_top_trends_from_twitter_api(country=country, exclude_hashtags=exclude_hashtags,
+                                                                       since_ids=since_ids)
         # update
         output_list = json.loads(output_json)
         trend_search_list = json.loads(img_output_json)
 
-        if append_db:
-            output_list = trends_cache['content'] + output_list
-            trend_search_list = trend_search_db['trends'] + trend_search_list
-            
         if exclude_hashtags:
-            cache_db['trends']['exclude_hashtags']['content'] = output_list
-            cache_db['trends']['exclude_hashtags']['timestamp'] = datetime_2_str(rq_timestamp, output_format=time_format_full_with_timezone)
+            content_path = ['trends', 'exclude_hashtags']
         else:
-            cache_db['trends']['include_hashtags']['content'] = output_list
-            cache_db['trends']['include_hashtags']['timestamp'] = datetime_2_str(rq_timestamp, output_format=time_format_full_with_timezone)
-
-        trend_search_db['trends'] = trend_search_list
+            content_path = ['trends', 'include_hashtags']
 
-        update_db(cache_db, database_path=db_path, debug=debug)
-        update_db(trend_search_db, database_path=trends_db_path, debug=debug)
+        # only this cycle's snapshot is written, not the whole history
+        if append_db:
+            ops = [append_op(content_path + ['content'], output_list)]
+            if incremental:
+                # one entry per label, moved to the end (newest) of the list with its new tweets merged in
+                trend_search_list = merge_trend_searches(trend_search_db['trends'], trend_search_list)
+                trend_search_ops = [append_op(['trends'], trend_search_list, unique_key='label')]
+            else:
+                trend_search_ops = [append_op(['trends'], trend_search_list)]
+        else:
+            ops = [set_op(content_path + ['content'], output_list)]
+            trend_search_ops = [set_op(['trends'], trend_search_list)]
+        ops.append(set_op(content_path + ['timestamp'], datetime_2_str(rq_timestamp, output_format=time_format_full_with_timezone)))
+
+        apply_db_ops(ops, database_path=db_path, state=cache_db, debug=debug)
+        apply_db_ops(trend_search_ops, database_path=trends_db_path, state=trend_search_db, debug=debug)
+        if append_db and not exclude_hashtags:
+            # the views only get the snapshot once it is written, a failed update leaves no points behind
+            def add_to_views(snapshots=output_list):
+                trend_series.add_snapshots(snapshots, database_path=db_path)
+                hourly_view.add_snapshots(snapshots, database_path=db_path)
+            on_commit(add_to_views)
 
         print('trends and image database updated.')
 
@@ -0,0 +1,93 @@
+import json
+import os
+import threading
+
+import yweather
+
+
+# --------------
+# WOEID RESOLVER
+# --------------
+# twitter wants a yahoo WOEID for trends/place. they never change, so they are resolved once:
+# in-memory dict -> woeid cache file -> bundled table -> yweather lookup (network, last resort).
+# anything yweather finds is written to the cache file so the next process doesn't ask again.
+
+woeid_cache_path = './db/woeid_cache.json'
+
+# locations twitter has trends for, from GET trends/available
+BUNDLED_WOEIDS = {
+    "worldwide": 1,
+    "japan": 23424856,
+    "tokyo": 1118370,
+    "osaka": 15015370,
+    "nagoya": 1117817,
+    "fukuoka": 1117099,
+    "sapporo": 1118108,
+    "united states": 23424977,
+    "united kingdom": 23424975,
+    "korea": 23424868,
+    "canada": 23424775,
+    "australia": 23424748,
+    "india": 23424848,
+    "france": 23424819,
+    "germany": 23424829,
+    "brazil": 23424768,
+}
+
+_woeids = {}
+_loaded = False
+_lock = threading.Lock()
+
+
+def _normalize(location):
+    return location.strip().lower()
+
+
+def _load_cache_file():
+    global _loaded
+    if _loaded:
+        return
+    try:
+        with open(woeid_cache_path, 'r') as f:
+            _woeids.update(json.load(f))
+    except (FileNotFoundError, ValueError):
+        pass
+    _loaded = True
+
+
+def _save_cache_file():
+    folder = os.path.dirname(woeid_cache_path)
+    if folder and not os.path.isdir(folder):
+        return
+    with open(woeid_cache_path + '.tmp', 'w') as f:
+        json.dump(_woeids, f, ensure_ascii=False, indent=4, sort_keys=True)
+    os.rename(woeid_cache_path + '.tmp', woeid_cache_path)
+
+
+def get_woeid(location='Japan'):
+    """
+    :param location: country or city name, case insensitive
+    :return: WOEID as int
+    """
+    key = _normalize(location)
+
+    # fast path, no lock
+    woeid = _woeids.get(key)
+    if woeid is not None:
+        return woeid
+
+    with _lock:
+        _load_cache_file()
+        woeid = _woeids.get(key) or BUNDLED_WOEIDS.get(key)
+        if woeid is not None:
+            _woeids[key] = woeid
+            return woeid
+
+        print('resolving WOEID for {} with yweather'.format(location))
+        woeid = yweather.Client().fetch_woeid(location=location)
+        if woeid is None:
+            raise ValueError('no WOEID found for {}'.format(location))
+
+        _woeids[key] = int(woeid)
+        _save_cache_file()
+        return _woeids[key]